@@ -0,0 +1,121 @@
+import os
+import time
+from multiprocessing import Pool
+
+from helper_classes import *
+from hw3 import render_scene
+from bvh import BVH, build_scene_bvh
+from compiled_scene import compile_scene
+from packet_tracer import render_scene_packet
+
+# A refitted hierarchy is rebuilt once the total surface area of its boxes grew by more than this factor
+REBUILD_RATIO = 2.0
+
+# What the last animation did: the seconds every frame took in its worker, whether the hierarchy of each frame was
+# rebuilt instead of refitted, the total seconds and the frames per second
+animation_stats = {'frame_seconds': [], 'rebuilt': [], 'seconds': 0.0, 'fps': 0.0}
+
+# The scene of a worker process, set once by init_animation_worker when the process starts
+worker_state = {}
+
+
+# This function runs once in every worker process (or once in this process when there are no workers). The scene
+# arrives once, and is prepared for tracing once: the packet engine compiles it, and the scalar engine builds a BVH
+# over its bounded objects. Every frame then only moves the animated objects.
+def init_animation_worker(ambient, lights, objects, screen_size, max_depth, engine):
+    worker_state.update({
+        'ambient': ambient,
+        'lights': lights,
+        'objects': objects,
+        'screen_size': screen_size,
+        'max_depth': max_depth,
+        'engine': engine,
+    })
+    if engine == 'packet':
+        # The compiled scene keeps the moving instances themselves, so it stays valid when they move
+        worker_state['scene_objects'] = [compile_scene(objects)]
+    else:
+        worker_state['scene_objects'] = build_scene_bvh(objects)
+
+
+# This function moves the animated objects to their transforms of a frame, and updates the scene's hierarchy.
+# It returns whether the hierarchy had to be rebuilt.
+def move_objects(transforms):
+    for index, transform in transforms.items():
+        worker_state['objects'][index].set_transform(transform)
+
+    scene_objects = worker_state['scene_objects']
+    if not transforms or not scene_objects or not isinstance(scene_objects[0], BVH):
+        return False
+    bvh = scene_objects[0]
+    if bvh.refit() <= REBUILD_RATIO:
+        return False
+    scene_objects[0] = BVH(bvh.primitives, bvh.max_leaf_size)
+    return True
+
+
+# This function renders one frame of the animation, and returns its index, its image, the seconds it took and
+# whether the hierarchy was rebuilt for it
+def render_frame(frame):
+    index, camera, transforms = frame
+    start_time = time.perf_counter()
+    rebuilt = move_objects(transforms)
+    render = render_scene_packet if worker_state['engine'] == 'packet' else render_scene
+    image = render(camera, worker_state['ambient'], worker_state['lights'], worker_state['scene_objects'],
+                   worker_state['screen_size'], worker_state['max_depth'])
+    return index, image, time.perf_counter() - start_time, rebuilt
+
+
+# This function renders an animation, and yields its frames in order as they are finished.
+# cameras has the camera position of every frame. transforms, if given, has for every frame a dictionary from the
+# index of an animated object in objects to its 4x4 transform (see instancing.py) in that frame; the animated
+# objects must be Instances, and a transform stays until another frame changes it.
+# The frames are rendered by a pool of worker processes (one per core by default; workers=1 renders in this
+# process, and puts the animated objects back to their transforms when it is done), each of which prepares the
+# scene once and keeps it between the frames it renders: the compiled scene is reused, and the BVH of the scalar
+# engine is refitted to the moved objects instead of being built again.
+# animation_stats reports the seconds of every frame and the frames per second.
+def render_animation(cameras, ambient, lights, objects, screen_size, max_depth, transforms=None, workers=None,
+                     engine='packet'):
+    if engine not in ('packet', 'scalar'):
+        raise ValueError(f"Unknown engine {engine!r}, expected 'packet' or 'scalar'")
+    transforms = transforms or [{}] * len(cameras)
+    # Transforms stay until they are changed, so every frame carries all the transforms set up to it; a worker
+    # may render the frames in any order
+    frames = []
+    current_transforms = {}
+    for index, (camera, frame_transforms) in enumerate(zip(cameras, transforms)):
+        current_transforms = {**current_transforms, **frame_transforms}
+        frames.append((index, camera, current_transforms))
+
+    animation_stats.update({'frame_seconds': [0.0] * len(frames), 'rebuilt': [False] * len(frames),
+                            'seconds': 0.0, 'fps': 0.0})
+    start_time = time.perf_counter()
+    initargs = (ambient, lights, objects, screen_size, max_depth, engine)
+    workers = workers or os.cpu_count()
+
+    # The workers move copies of the objects, but rendering in this process moves the caller's own instances
+    original_transforms = {index: objects[index].transform for frame in frames for index in frame[2]}
+    if workers == 1:
+        init_animation_worker(*initargs)
+        results = map(render_frame, frames)
+        pool = None
+    else:
+        pool = Pool(min(workers, len(frames)) or 1, initializer=init_animation_worker, initargs=initargs)
+        results = pool.imap(render_frame, frames)
+
+    try:
+        for index, image, seconds, rebuilt in results:
+            animation_stats['frame_seconds'][index] = seconds
+            animation_stats['rebuilt'][index] = rebuilt
+            animation_stats['seconds'] = time.perf_counter() - start_time
+            animation_stats['fps'] = (index + 1) / animation_stats['seconds']
+            yield image
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        else:
+            for index, transform in original_transforms.items():
+                objects[index].set_transform(transform)
+
@@ -0,0 +1,118 @@
+import numpy as np
+
+from helper_classes import *
+from camera import Camera, get_pixel_axes, get_pixel_size
+from compiled_scene import compile_scene
+from packet_tracer import PACKET_SIZE, get_packet_colors, get_primary_directions
+
+# Neighbouring pixels whose colors differ by more than this (in any channel) are on an edge
+COLOR_THRESHOLD = 0.1
+
+# Refined pixels get SUBPIXEL_GRID x SUBPIXEL_GRID extra samples
+SUBPIXEL_GRID = 2
+
+# render_scene_supersampled averages this many jittered samples per pixel
+SUPERSAMPLES = 4
+
+# What the last adaptive render spent: the pixels found on edges, the pixels refined, and the extra rays traced
+antialiasing_stats = {'edge_pixels': 0, 'refined_pixels': 0, 'extra_rays': 0}
+
+
+# This function traces the rays of the given directions from the camera in packets, and returns their colors
+# (clipped like the pixels of render_scene) and the IDs of the primitives they hit first
+def trace_samples(scene, compiled_scene, camera, directions, max_depth, packet_size):
+    origins = np.broadcast_to(np.asarray(camera, dtype=float), directions.shape)
+    colors = np.zeros(directions.shape)
+    ids = np.full(len(directions), -1)
+    for start in range(0, len(directions), packet_size):
+        end = start + packet_size
+        colors[start:end] = get_packet_colors(scene, compiled_scene, origins[start:end], directions[start:end],
+                                              max_depth, ids[start:end])
+    return np.clip(colors, 0, 1), ids
+
+
+# This function returns, for every pixel, how strongly it differs from its 4 neighbours: the largest color
+# difference, or infinity where a neighbour shows a different object
+def get_edge_contrast(image, ids):
+    contrast = np.zeros(ids.shape)
+    for axis in (0, 1):
+        color_difference = np.abs(np.diff(image, axis=axis)).max(axis=2)
+        color_difference[np.diff(ids, axis=axis) != 0] = np.inf
+        before = [slice(None), slice(None)]
+        after = [slice(None), slice(None)]
+        before[axis] = slice(None, -1)
+        after[axis] = slice(1, None)
+        contrast[tuple(before)] = np.maximum(contrast[tuple(before)], color_difference)
+        contrast[tuple(after)] = np.maximum(contrast[tuple(after)], color_difference)
+    return contrast
+
+
+# This function returns the offsets of a subpixel_grid x subpixel_grid grid of samples inside a pixel, in pixel
+# units, around the pixel center
+def get_subpixel_offsets(subpixel_grid):
+    steps = (np.arange(subpixel_grid) + 0.5) / subpixel_grid - 0.5
+    return np.array([(dx, dy) for dy in steps for dx in steps])
+
+
+# This function renders the scene with one sample per pixel, like render_scene_packet, and then supersamples only
+# the pixels on edges: pixels whose color differs from a neighbour by more than color_threshold, or whose
+# neighbour shows a different object. Each of them gets subpixel_grid x subpixel_grid extra samples, averaged with
+# the first one. max_extra_rays caps the extra primary rays; when there are more edge pixels than the budget
+# allows, the ones with the strongest contrast are refined first. antialiasing_stats reports what was spent.
+def render_scene_adaptive(camera, ambient, lights, objects, screen_size, max_depth, color_threshold=COLOR_THRESHOLD,
+                          subpixel_grid=SUBPIXEL_GRID, max_extra_rays=None, packet_size=PACKET_SIZE):
+    width, height = screen_size
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    compiled_scene = compile_scene(objects)
+
+    colors, ids = trace_samples(scene, compiled_scene, camera, get_primary_directions(camera, screen_size),
+                                max_depth, packet_size)
+    image = colors.reshape(height, width, 3)
+    contrast = get_edge_contrast(image, ids.reshape(height, width)).ravel()
+
+    edge_pixels = np.flatnonzero(contrast > color_threshold)
+    offsets = get_subpixel_offsets(subpixel_grid)
+    refined_pixels = edge_pixels
+    if max_extra_rays is not None and len(edge_pixels) * len(offsets) > max_extra_rays:
+        strongest_first = np.argsort(-contrast[edge_pixels], kind='stable')
+        refined_pixels = edge_pixels[strongest_first[:max_extra_rays // len(offsets)]]
+    antialiasing_stats.update({'edge_pixels': len(edge_pixels), 'refined_pixels': len(refined_pixels),
+                               'extra_rays': len(refined_pixels) * len(offsets)})
+    if not len(refined_pixels):
+        return image
+
+    # The samples are spread around the pixels of the camera's screen, a pixel's size apart
+    pixel_width, pixel_height = get_pixel_size(screen_size)
+    rows, columns = np.divmod(refined_pixels, width)
+    xs, ys = get_pixel_axes(screen_size)
+    xs, ys = xs[columns], ys[rows]
+
+    samples = np.zeros((len(refined_pixels), len(offsets), 3))
+    samples[:, :, 0] = xs[:, np.newaxis] + offsets[:, 0] * pixel_width
+    samples[:, :, 1] = ys[:, np.newaxis] + offsets[:, 1] * pixel_height
+    directions = normalize_rows(samples.reshape(-1, 3) - camera)
+    sample_colors, _ = trace_samples(scene, compiled_scene, camera, directions, max_depth, packet_size)
+
+    sample_sums = sample_colors.reshape(len(refined_pixels), len(offsets), 3).sum(axis=1)
+    colors[refined_pixels] = (colors[refined_pixels] + sample_sums) / (len(offsets) + 1)
+    return colors.reshape(height, width, 3)
+
+
+# This function renders the scene with samples rays through every pixel, each through a random point of the pixel,
+# and averages them. Unlike render_scene_adaptive every pixel is supersampled, so it also smooths the edges of
+# reflections and shadows, which do not change the object a pixel shows. The camera writes every pass's directions
+# into the same array, so the passes allocate no new directions. seed makes the samples repeatable.
+def render_scene_supersampled(camera, ambient, lights, objects, screen_size, max_depth, samples=SUPERSAMPLES, seed=0,
+                              packet_size=PACKET_SIZE):
+    width, height = screen_size
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    compiled_scene = compile_scene(objects)
+    jittered_camera = Camera(camera)
+    rng = np.random.default_rng(seed)
+
+    image = np.zeros((height * width, 3))
+    for _ in range(samples):
+        directions = jittered_camera.get_jittered_directions(screen_size, rng)
+        colors, _ = trace_samples(scene, compiled_scene, camera, directions, max_depth, packet_size)
+        image += colors
+    return (image / samples).reshape(height, width, 3)
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+from helper_classes import *
+from hw3 import render_scene, your_own_scene
+from packet_tracer import render_scene_packet
+from wavefront_tracer import render_scene_wavefront
+
+# The renderers the benchmark can time. They all take the arguments of render_scene.
+ENGINES = {
+    'scalar': render_scene,
+    'packet': render_scene_packet,
+    'packet_float32': partial(render_scene_packet, dtype=np.float32),
+    'wavefront': render_scene_wavefront,
+}
+
+# Every scene is rendered at each of these resolutions and reflection depths
+RESOLUTIONS = ((64, 64), (128, 128))
+DEPTHS = (1, 3)
+
+# The sizes of the synthetic stress scenes
+STRESS_SPHERES = 100
+STRESS_TRIANGLES = 200
+STRESS_LIGHTS = 16
+
+# Every case is rendered this many times, and its best time counts, so a render slowed down by something else
+# running on the machine is not taken for a regression
+REPEAT = 5
+
+# A case is a regression when its time or peak memory grows by more than this fraction of the baseline
+REGRESSION_THRESHOLD = 0.1
+
+# Times below this many seconds (in the baseline and in the results) are too short to compare: the noise of the
+# timer and of the machine is a large fraction of them
+MIN_SECONDS = 0.05
+
+# The stored baseline of an engine is <engine>.json in this directory. Its times are those of the machine that
+# recorded it, so it is recorded locally (with --save-baseline) and not kept in the repository.
+BASELINE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines')
+
+# A pixel of a float32 render is counted as wrong when one of its values is off by more than this (one 8 bit step)
+PIXEL_TOLERANCE = 1 / 255
+
+
+# This function returns the scenes of the assignment notebook, and the scene of your_own_scene, as
+# name -> (camera, ambient, lights, objects)
+def get_notebook_scenes():
+    scenes = {}
+
+    plane_a = Plane([0, 1, 0], [0, -1, 0])
+    plane_a.set_material([0.3, 0.5, 1], [0.3, 0.5, 1], [1, 1, 1], 10, 0.5)
+    plane_b = Plane([0, 0, 1], [0, 0, -3])
+    plane_b.set_material([0, 0.5, 0], [0, 1, 0], [1, 1, 1], 10, 0.5)
+    light = PointLight(intensity=np.array([1, 1, 1]), position=np.array([1, 1, 1]), kc=0.1, kl=0.1, kq=0.1)
+    scenes['scene1'] = (np.array([0, 0, 1]), np.array([0.1, 0.1, 0.1]), [light], [plane_a, plane_b])
+
+    triangle = Triangle(*np.array([[-1, 0, -1], [1, 0, -1], [0, 1.5, -1.5]]))
+    triangle.set_material([1, 0, 0], [1, 0, 0], [0, 0, 0], 100, 0.5)
+    plane = Plane([0, 0, 1], [0, 0, -4])
+    plane.set_material([0, 0.5, 0], [0, 1, 0], [.1, .1, .1], 100, 0.5)
+    light = DirectionalLight(intensity=np.array([1, 1, 1]), direction=np.array([-1, -1, -1]))
+    scenes['scene2'] = (np.array([0, 0, 1]), np.array([0.1, 0.1, 0.1]), [light], [triangle, plane])
+
+    diamond = Pyramid(np.array([[-0.5, -0.142, -0.998], [-0.034, 0.092, -0.145], [0.484, 0.031, -0.998],
+                                [-0.104, 0.851, -0.828], [0.23, -0.833, -0.591]]))
+    diamond.set_material([0.1, 0.4, 0.7], [0.1, 0.4, 0.7], [0.3, 0.3, 0.3], 10, 0.5)
+    diamond.apply_materials_to_triangles()
+    plane = Plane([0, 1, 0], [0, -1, 0])
+    plane.set_material([0.2, 0.2, 0.2], [0.2, 0.2, 0.2], [1, 1, 1], 1000, 0.5)
+    background = Plane([0, 0, 1], [0, 0, -30])
+    background.set_material([1, 0.3, 0.3], [1, 0.3, 0.3], [0.2, 0.2, 0.2], 10, 0.5)
+    light = PointLight(intensity=np.array([1, 1, 1]), position=np.array([0, 1, 1]), kc=0.1, kl=0.1, kq=0.1)
+    scenes['scene3'] = (np.array([0, 0, 1]), np.array([0.1, 0.1, 0.1]), [light], [diamond, background, plane])
+
+    sphere_a = Sphere([-0.5, 0.2, -1], 0.5)
+    sphere_a.set_material([1, 0, 0], [1, 0, 0], [0.3, 0.3, 0.3], 100, 1)
+    sphere_b = Sphere([0.8, 0, -0.5], 0.3)
+    sphere_b.set_material([0, 1, 0], [0, 1, 0], [0.3, 0.3, 0.3], 100, 0.2)
+    plane = Plane([0, 1, 0], [0, -0.3, 0])
+    plane.set_material([0.2, 0.2, 0.2], [0.2, 0.2, 0.2], [1, 1, 1], 1000, 0.5)
+    background = Plane([0, 0, 1], [0, 0, -3])
+    background.set_material([0.2, 0.2, 0.2], [0.2, 0.2, 0.2], [0.2, 0.2, 0.2], 1000, 0.5)
+    light = PointLight(intensity=np.array([1, 1, 1]), position=np.array([1, 1.5, 1]), kc=0.1, kl=0.1, kq=0.1)
+    scenes['scene4'] = (np.array([0, 0, 1]), np.array([0.1, 0.2, 0.3]), [light],
+                        [sphere_a, sphere_b, plane, background])
+
+    background = Plane([0, 0, 1], [0, 0, -1])
+    background.set_material([1, 1, 1], [1, 1, 1], [1, 1, 1], 1000, 0.5)
+    lights = [SpotLight(intensity=np.array(intensity), position=np.array(position), direction=([0, 0, -1]),
+                        kc=0.1, kl=0.1, kq=0.1)
+              for intensity, position in (([0, 0, 1], [0.5, 0.5, 0]), ([0, 1, 0], [-0.5, 0.5, 0]),
+                                          ([1, 0, 0], [0, -0.5, 0]))]
+    scenes['scene5'] = (np.array([0, 0, 1]), np.array([0, 0, 0]), lights, [background])
+
+    camera, lights, objects = your_own_scene()
+    scenes['your_own_scene'] = (camera, np.array([0, 0, 0]), lights, objects)
+    return scenes
+
+
+# This function gives an object a random material
+def set_random_material(obj, rng):
+    color = rng.uniform(0.2, 1, 3)
+    obj.set_material(0.2 * color, color, [0.5, 0.5, 0.5], 50, rng.uniform(0, 0.5))
+
+
+# This function returns a floor, a back wall and a point light, the frame the stress scenes are built in
+def get_stress_frame():
+    floor = Plane([0, 1, 0], [0, -1.5, 0])
+    floor.set_material([0.1, 0.1, 0.1], [0.6, 0.6, 0.6], [0.5, 0.5, 0.5], 100, 0.3)
+    wall = Plane([0, 0, 1], [0, 0, -8])
+    wall.set_material([0.1, 0.1, 0.1], [0.4, 0.4, 0.6], [0.2, 0.2, 0.2], 10, 0.1)
+    light = PointLight(intensity=np.array([1, 1, 1]), position=np.array([1, 2, 1]), kc=0.1, kl=0.1, kq=0.01)
+    return [floor, wall], light
+
+
+# This function returns a scene of number_of_spheres random spheres in front of the camera
+def make_spheres_scene(number_of_spheres=STRESS_SPHERES, seed=0):
+    rng = np.random.default_rng(seed)
+    objects, light = get_stress_frame()
+    for _ in range(number_of_spheres):
+        sphere = Sphere(rng.uniform([-2, -1.5, -7], [2, 1.5, -2]), rng.uniform(0.05, 0.3))
+        set_random_material(sphere, rng)
+        objects.append(sphere)
+    return np.array([0, 0, 1]), np.array([0.1, 0.1, 0.1]), [light], objects
+
+
+# This function returns a scene of number_of_triangles random triangles in front of the camera
+def make_triangles_scene(number_of_triangles=STRESS_TRIANGLES, seed=0):
+    rng = np.random.default_rng(seed)
+    objects, light = get_stress_frame()
+    for _ in range(number_of_triangles):
+        center = rng.uniform([-2, -1.5, -7], [2, 1.5, -2])
+        triangle = Triangle(*(center + rng.uniform(-0.3, 0.3, (3, 3))))
+        set_random_material(triangle, rng)
+        objects.append(triangle)
+    return np.array([0, 0, 1]), np.array([0.1, 0.1, 0.1]), [light], objects
+
+
+# This function returns a few spheres lit by number_of_lights point lights on a circle above them
+def make_lights_scene(number_of_lights=STRESS_LIGHTS, seed=0):
+    camera, ambient, _, objects = make_spheres_scene(8, seed)
+    angles = np.linspace(0, 2 * np.pi, number_of_lights, endpoint=False)
+    lights = [PointLight(intensity=np.full(3, 2 / number_of_lights),
+                         position=np.array([3 * np.cos(angle), 2, -4 + 3 * np.sin(angle)]), kc=0.1, kl=0.1, kq=0.01)
+              for angle in angles]
+    return camera, ambient, lights, objects
+
+
+# This function returns all the benchmark scenes, as name -> (camera, ambient, lights, objects)
+def get_benchmark_scenes():
+    scenes = get_notebook_scenes()
+    scenes[f'{STRESS_SPHERES}_spheres'] = make_spheres_scene()
+    scenes[f'{STRESS_TRIANGLES}_triangles'] = make_triangles_scene()
+    scenes[f'{STRESS_LIGHTS}_lights'] = make_lights_scene()
+    return scenes
+
+
+# This function renders a scene repeat times, and returns the best wall time, the pixels per second of that time,
+# and the peak memory allocated during one more render (traced separately, since tracing slows the render)
+def benchmark_case(render, scene, screen_size, max_depth, repeat=REPEAT):
+    camera, ambient, lights, objects = scene
+    seconds = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        render(camera, ambient, lights, objects, screen_size, max_depth)
+        seconds = min(seconds, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    render(camera, ambient, lights, objects, screen_size, max_depth)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    width, height = screen_size
+    return {
+        'seconds': seconds,
+        'pixels_per_second': width * height / seconds,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+# This function benchmarks every scene at every resolution and depth, and returns the results keyed by case
+def run_benchmark(engine='packet', scene_names=None, resolutions=RESOLUTIONS, depths=DEPTHS, repeat=REPEAT):
+    scenes = get_benchmark_scenes()
+    results = {}
+    for name in scene_names or scenes:
+        for screen_size in resolutions:
+            for max_depth in depths:
+                case = f'{name}@{screen_size[0]}x{screen_size[1]}/depth{max_depth}'
+                results[case] = benchmark_case(ENGINES[engine], scenes[name], tuple(screen_size), max_depth, repeat)
+                print(f'{case:40} {results[case]["seconds"]:9.3f}s {results[case]["pixels_per_second"]:12.0f} pixels/s '
+                      f'{results[case]["peak_memory_bytes"] / 2 ** 20:9.1f} MiB', flush=True)
+    return {'engine': engine, 'results': results}
+
+
+# This function benchmarks the float32 pipeline of the packet tracer against the float64 one on every scene, at
+# every resolution and depth. Every case reports both times and peak memories, and the error of the float32 image
+# against the float64 image: the largest and the mean difference of a pixel value, and the fraction of the pixels
+# that differ by more than PIXEL_TOLERANCE.
+def compare_precisions(scene_names=None, resolutions=RESOLUTIONS, depths=DEPTHS, repeat=REPEAT):
+    scenes = get_benchmark_scenes()
+    results = {}
+    for name in scene_names or scenes:
+        camera, ambient, lights, objects = scenes[name]
+        for screen_size in resolutions:
+            for max_depth in depths:
+                case = f'{name}@{screen_size[0]}x{screen_size[1]}/depth{max_depth}'
+                results[case] = {
+                    precision: benchmark_case(ENGINES[engine], scenes[name], tuple(screen_size), max_depth, repeat)
+                    for precision, engine in (('float64', 'packet'), ('float32', 'packet_float32'))
+                }
+                reference = render_scene_packet(camera, ambient, lights, objects, tuple(screen_size), max_depth)
+                image = ENGINES['packet_float32'](camera, ambient, lights, objects, tuple(screen_size), max_depth)
+                errors = np.abs(image - reference)
+                results[case].update({
+                    'max_error': float(errors.max()),
+                    'mean_error': float(errors.mean()),
+                    'wrong_pixels': float((errors.max(axis=2) > PIXEL_TOLERANCE).mean()),
+                })
+                float64, float32 = results[case]['float64'], results[case]['float32']
+                print(f'{case:40} {float64["seconds"] / float32["seconds"]:6.2f}x faster '
+                      f'{float32["peak_memory_bytes"] / float64["peak_memory_bytes"]:6.1%} memory '
+                      f'max error {results[case]["max_error"]:.2e} '
+                      f'{results[case]["wrong_pixels"]:.2%} pixels off', flush=True)
+    return {'engine': 'packet', 'precisions': results}
+
+
+def get_baseline_path(engine):
+    return os.path.join(BASELINE_DIRECTORY, f'{engine}.json')
+
+
+# This function compares results with a baseline, and returns the cases whose time or peak memory grew by more
+# than threshold (a fraction of the baseline value), as a list of (case, metric, baseline value, value). The times
+# of a case are only compared when one of them is at least min_seconds.
+# Both must be results of run_benchmark with the same engine; the times of different engines say nothing about
+# regressions.
+def compare_with_baseline(results, baseline, threshold=REGRESSION_THRESHOLD, min_seconds=MIN_SECONDS):
+    if 'results' not in baseline:
+        raise ValueError('The baseline is not a result of run_benchmark')
+    if results['engine'] != baseline['engine']:
+        raise ValueError(f"Results of the {results['engine']!r} engine cannot be compared with a baseline of the "
+                         f"{baseline['engine']!r} engine")
+    regressions = []
+    for case, metrics in results['results'].items():
+        baseline_metrics = baseline['results'].get(case)
+        if baseline_metrics is None:
+            continue
+        for metric in ('seconds', 'peak_memory_bytes'):
+            if metric == 'seconds' and max(metrics[metric], baseline_metrics[metric]) < min_seconds:
+                continue
+            if metrics[metric] > baseline_metrics[metric] * (1 + threshold):
+                regressions.append((case, metric, baseline_metrics[metric], metrics[metric]))
+    return regressions
+
+
+# Run the benchmark from the command line, e.g.
+#   python benchmark.py --output results.json --baseline baseline.json --threshold 0.2
+# --save-baseline stores the results as the baseline of the engine on this machine (see BASELINE_DIRECTORY), and
+# --baseline without a file compares with it.
+# The exit status is 1 if any case regressed against the baseline.
+# With --compare-precisions the float32 pipeline is compared with the float64 one instead (see compare_precisions).
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ray tracer')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='packet')
+    parser.add_argument('--scenes', nargs='*', help='the scenes to render (default: all)')
+    parser.add_argument('--resolutions', nargs='*', type=int, help='width height pairs, e.g. 64 64 128 128')
+    parser.add_argument('--depths', nargs='*', type=int, default=list(DEPTHS))
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='the renders timed per case (the best one counts)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline of the engine')
+    parser.add_argument('--baseline', nargs='?', const='',
+                        help='compare the results with this JSON file (default: the stored baseline of the engine)')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS,
+                        help='times shorter than this are not compared with the baseline')
+    parser.add_argument('--compare-precisions', action='store_true',
+                        help='compare the speed, memory and error of float32 packet tracing with float64')
+    arguments = parser.parse_args(arguments)
+
+    resolutions = RESOLUTIONS
+    if arguments.resolutions:
+        resolutions = list(zip(arguments.resolutions[::2], arguments.resolutions[1::2]))
+    if arguments.compare_precisions:
+        results = compare_precisions(arguments.scenes, resolutions, arguments.depths, arguments.repeat)
+        if arguments.output:
+            with open(arguments.output, 'w') as file:
+                json.dump(results, file, indent=2)
+        return 0
+
+    # The baseline is read before the benchmark runs, so the results can be compared with the last baseline and stored
+    # as the next one in the same run
+    baseline = None
+    if arguments.baseline is not None:
+        baseline_path = arguments.baseline or get_baseline_path(arguments.engine)
+        if not os.path.exists(baseline_path):
+            parser.error(f'There is no baseline {baseline_path}; record one with --save-baseline')
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+    results = run_benchmark(arguments.engine, arguments.scenes, resolutions, arguments.depths, arguments.repeat)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if arguments.save_baseline:
+        os.makedirs(BASELINE_DIRECTORY, exist_ok=True)
+        with open(get_baseline_path(arguments.engine), 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline is not None:
+        try:
+            regressions = compare_with_baseline(results, baseline, arguments.threshold, arguments.min_seconds)
+        except ValueError as error:
+            parser.error(str(error))
+        for case, metric, baseline_value, value in regressions:
+            print(f'REGRESSION {case} {metric}: {baseline_value:.6g} -> {value:.6g} '
+                  f'({value / baseline_value - 1:+.1%})')
+        if regressions:
+            return 1
+        print(f'No regressions above {arguments.threshold:.0%}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
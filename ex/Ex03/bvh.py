@@ -0,0 +1,213 @@
+import time
+
+import numpy as np
+
+from helper_classes import *
+
+# The maximum number of primitives stored in a leaf of the hierarchy
+MAX_LEAF_SIZE = 4
+
+
+class BVHNode:
+    def __init__(self, bounds_min, bounds_max):
+        self.bounds_min = bounds_min
+        self.bounds_max = bounds_max
+        self.left = None
+        self.right = None
+        # Leaves hold a range of primitives: BVH.primitives[start:start + count]
+        self.start = 0
+        self.count = 0
+
+    def is_leaf(self):
+        return self.left is None
+
+    # This function returns the distance at which the ray enters the node's box, or None if it misses the box.
+    # inverse_direction is 1 / ray.direction, computed once per ray.
+    def hit_distance(self, origin, inverse_direction, max_t):
+        with np.errstate(invalid='ignore'):
+            t0 = (self.bounds_min - origin) * inverse_direction
+            t1 = (self.bounds_max - origin) * inverse_direction
+        # fmin and fmax ignore the nan of a ray that lies exactly on a slab of the box
+        t_near = np.max(np.fmin(t0, t1))
+        t_far = np.min(np.fmax(t0, t1))
+        if t_near > t_far or t_far < epsilon or t_near >= max_t:
+            return None
+        return t_near
+
+
+# A bounding volume hierarchy over the bounded objects of a scene.
+# Composite objects (like Pyramid) are flattened into their primitives, so every leaf holds simple objects.
+# The hierarchy behaves like any other object of the scene: intersect returns the nearest primitive it hits.
+class BVH:
+    def __init__(self, objects, max_leaf_size=MAX_LEAF_SIZE):
+        start_time = time.perf_counter()
+        self.max_leaf_size = max_leaf_size
+        self.primitives = []
+        for obj in objects:
+            self.primitives.extend(obj.get_primitives())
+
+        bounds = [primitive.get_bounds() for primitive in self.primitives]
+        self.bounds_min = np.array([b[0] for b in bounds], dtype=float).reshape(-1, 3)
+        self.bounds_max = np.array([b[1] for b in bounds], dtype=float).reshape(-1, 3)
+        self.centroids = (self.bounds_min + self.bounds_max) / 2
+
+        self.node_count = 0
+        self.leaf_count = 0
+        self.depth = 0
+        ordered = []
+        self.root = self.build(np.arange(len(self.primitives)), ordered, 1) if self.primitives else None
+        self.primitives = [self.primitives[i] for i in ordered]
+        self.bounds_min = self.bounds_min[ordered]
+        self.bounds_max = self.bounds_max[ordered]
+        self.build_surface_area = self.get_surface_area()
+        self.build_time = time.perf_counter() - start_time
+
+    # This function builds the subtree over the primitives in order, and appends the primitives of its leaves to
+    # ordered. Nodes are split at the median centroid along the longest axis of their centroids' bounds.
+    def build(self, order, ordered, depth):
+        self.node_count += 1
+        self.depth = max(self.depth, depth)
+        node = BVHNode(self.bounds_min[order].min(axis=0), self.bounds_max[order].max(axis=0))
+
+        if len(order) <= self.max_leaf_size:
+            self.leaf_count += 1
+            node.start = len(ordered)
+            node.count = len(order)
+            ordered.extend(order)
+            return node
+
+        centroids = self.centroids[order]
+        axis = np.argmax(centroids.max(axis=0) - centroids.min(axis=0))
+        order = order[np.argsort(centroids[:, axis], kind='stable')]
+        middle = len(order) // 2
+        node.left = self.build(order[:middle], ordered, depth + 1)
+        node.right = self.build(order[middle:], ordered, depth + 1)
+        return node
+
+    # This function updates the boxes of the hierarchy after its primitives moved, without changing its structure:
+    # every leaf gets the bounds of its primitives again, and every inner node the union of its children's boxes.
+    # It returns how much the total surface area of the boxes grew since the hierarchy was built; the more it grew,
+    # the worse the old structure fits the moved primitives, and the more rays visit nodes they miss.
+    def refit(self):
+        if self.root is None:
+            return 1.0
+        bounds = [primitive.get_bounds() for primitive in self.primitives]
+        self.bounds_min = np.array([b[0] for b in bounds], dtype=float).reshape(-1, 3)
+        self.bounds_max = np.array([b[1] for b in bounds], dtype=float).reshape(-1, 3)
+        self.refit_node(self.root)
+        return self.get_surface_area() / self.build_surface_area if self.build_surface_area else 1.0
+
+    def refit_node(self, node):
+        if node.is_leaf():
+            node.bounds_min = self.bounds_min[node.start:node.start + node.count].min(axis=0)
+            node.bounds_max = self.bounds_max[node.start:node.start + node.count].max(axis=0)
+            return
+        self.refit_node(node.left)
+        self.refit_node(node.right)
+        node.bounds_min = np.minimum(node.left.bounds_min, node.right.bounds_min)
+        node.bounds_max = np.maximum(node.left.bounds_max, node.right.bounds_max)
+
+    # This function returns the total surface area of the boxes of all the nodes
+    def get_surface_area(self):
+        area = 0.0
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            x, y, z = node.bounds_max - node.bounds_min
+            area += 2 * (x * y + y * z + z * x)
+            if not node.is_leaf():
+                stack.extend([node.left, node.right])
+        return area
+
+    def get_primitives(self):
+        return self.primitives
+
+    def get_bounds(self):
+        if self.root is None:
+            return None
+        return self.root.bounds_min, self.root.bounds_max
+
+    # This function returns the nearest primitive hit by the ray, like Ray.nearest_intersected_object, but it only
+    # visits the nodes whose boxes the ray enters before the nearest hit found so far.
+    def intersect(self, ray: Ray):
+        if self.root is None:
+            return None, None
+        origin = np.asarray(ray.origin, dtype=float)
+        with np.errstate(divide='ignore'):
+            inverse_direction = 1.0 / np.asarray(ray.direction, dtype=float)
+
+        min_t = np.inf
+        nearest_object = None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.hit_distance(origin, inverse_direction, min_t) is None:
+                continue
+            if node.is_leaf():
+                for primitive in self.primitives[node.start:node.start + node.count]:
+                    t, intersected_object = primitive.intersect(ray)
+                    if t is not None and min_t > t > epsilon:
+                        min_t = t
+                        nearest_object = intersected_object
+                continue
+
+            # Visit the nearer child first, so its hits can prune the farther one
+            left_t = node.left.hit_distance(origin, inverse_direction, min_t)
+            right_t = node.right.hit_distance(origin, inverse_direction, min_t)
+            if left_t is None:
+                if right_t is not None:
+                    stack.append(node.right)
+            elif right_t is None:
+                stack.append(node.left)
+            elif left_t <= right_t:
+                stack.extend([node.right, node.left])
+            else:
+                stack.extend([node.left, node.right])
+
+        if nearest_object is None:
+            return None, None
+        return min_t, nearest_object
+
+    # This function returns whether any primitive blocks the ray closer than max_distance.
+    # It stops at the first blocking primitive, so the order the nodes are visited in does not matter.
+    def is_occluding(self, ray: Ray, max_distance):
+        if self.root is None:
+            return False
+        origin = np.asarray(ray.origin, dtype=float)
+        with np.errstate(divide='ignore'):
+            inverse_direction = 1.0 / np.asarray(ray.direction, dtype=float)
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.hit_distance(origin, inverse_direction, max_distance) is None:
+                continue
+            if node.is_leaf():
+                for primitive in self.primitives[node.start:node.start + node.count]:
+                    if primitive.is_occluding(ray, max_distance):
+                        return True
+            else:
+                stack.extend([node.right, node.left])
+        return False
+
+    # This function returns the build time and the size of the hierarchy
+    def get_stats(self):
+        return {
+            'primitives': len(self.primitives),
+            'nodes': self.node_count,
+            'leaves': self.leaf_count,
+            'depth': self.depth,
+            'build_time': self.build_time,
+        }
+
+
+# This function replaces the objects of a scene with a BVH over the bounded objects and a list of the unbounded ones
+# (like Plane). The returned list can be used anywhere the original objects list is used, for example:
+#     objects = build_scene_bvh(objects)
+#     im = render_scene(camera, ambient, lights, objects, RENDER_RESOLUTION, 3)
+def build_scene_bvh(objects, max_leaf_size=MAX_LEAF_SIZE):
+    bounded = [obj for obj in objects if obj.get_bounds() is not None]
+    unbounded = [obj for obj in objects if obj.get_bounds() is None]
+    if not bounded:
+        return unbounded
+    return [BVH(bounded, max_leaf_size)] + unbounded
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from helper_classes import *
+
+# The number of (camera, resolution) pairs whose primary ray directions are kept. The cache is shared by all the
+# cameras, so its size is set here, for all of them.
+RAY_CACHE_SIZE = 4
+
+# The primary ray directions of the last RAY_CACHE_SIZE (camera, resolution) pairs, the least recently used first
+ray_cache = OrderedDict()
+
+# How often the directions of a render were found in the cache, and how often they had to be computed
+camera_stats = {'hits': 0, 'misses': 0}
+
+
+def clear_ray_cache():
+    ray_cache.clear()
+    camera_stats.update({'hits': 0, 'misses': 0})
+
+
+# This function returns the screen of render_scene, as (left, top, right, bottom)
+def get_screen(screen_size):
+    width, height = screen_size
+    ratio = float(width) / height
+    return -1, 1 / ratio, 1, -1 / ratio
+
+
+# This function returns the x of every column and the y of every row of the pixels of the screen. They are spread by
+# linspace, like the pixels of render_scene.
+def get_pixel_axes(screen_size):
+    width, height = screen_size
+    screen = get_screen(screen_size)
+    return np.linspace(screen[0], screen[2], width), np.linspace(screen[1], screen[3], height)
+
+
+# This function returns the width and height of a pixel of the screen: the spacing between the pixels
+def get_pixel_size(screen_size):
+    width, height = screen_size
+    screen = get_screen(screen_size)
+    return (screen[2] - screen[0]) / max(width - 1, 1), (screen[3] - screen[1]) / max(height - 1, 1)
+
+
+# This function normalizes (n, 3) directions in place. Every norm is the dot product of a direction with itself, the
+# way np.linalg.norm takes the norm of one vector, so the directions are exactly those normalize gives one by one.
+def normalize_directions(directions):
+    directions /= np.sqrt(directions[:, np.newaxis, :] @ directions[:, :, np.newaxis]).reshape(-1, 1)
+    return directions
+
+
+# A camera at a position, looking at the screen of render_scene (at z = 0, with the pixels spread by linspace).
+# It makes the primary rays of a whole resolution at once, as one normalized (height * width, 3) array, row by row.
+# The directions of the last RAY_CACHE_SIZE (camera, resolution) pairs are kept, so rendering the same view again
+# (while editing materials or lights, or in an animation that stops moving) does not compute them again.
+class Camera:
+    def __init__(self, position):
+        self.position = np.asarray(position, dtype=float)
+        # The arrays get_jittered_directions writes into, one set per resolution
+        self.jitter_buffers = {}
+
+    # This function returns the pixels of the screen in rows [top, bottom) and columns [left, right) (the whole
+    # screen by default), row by row, as a (rows * columns, 3) array
+    def get_pixels(self, screen_size, top=0, bottom=None, left=0, right=None):
+        xs, ys = get_pixel_axes(screen_size)
+        xs, ys = xs[left:right], ys[top:bottom]
+        pixels = np.zeros((len(ys), len(xs), 3))
+        pixels[:, :, 0] = xs[np.newaxis, :]
+        pixels[:, :, 1] = ys[:, np.newaxis]
+        return pixels.reshape(-1, 3)
+
+    # This function returns the direction of the primary ray of every pixel. The returned array is shared with the
+    # cache, so it is read only.
+    def get_directions(self, screen_size):
+        key = (self.position.tobytes(), tuple(screen_size))
+        if key in ray_cache:
+            camera_stats['hits'] += 1
+            ray_cache.move_to_end(key)
+            return ray_cache[key]
+
+        camera_stats['misses'] += 1
+        directions = normalize_directions(self.get_pixels(screen_size) - self.position)
+        directions.flags.writeable = False
+        ray_cache[key] = directions
+        while len(ray_cache) > RAY_CACHE_SIZE:
+            ray_cache.popitem(last=False)
+        return directions
+
+    # This function returns the primary ray directions of the pixels at the given rows and columns, looked up in
+    # the directions of the whole resolution
+    def get_pixel_directions(self, screen_size, rows, columns):
+        width, _ = screen_size
+        return self.get_directions(screen_size)[np.asarray(rows) * width + np.asarray(columns)]
+
+    # This function returns the primary ray directions of the pixels in rows [top, bottom) and columns [left,
+    # right), the same ones get_directions returns for them. Only the tile's directions are computed, and they are
+    # not cached, so rendering an image tile by tile never holds the directions of the whole image.
+    def get_tile_directions(self, screen_size, top, bottom, left, right):
+        return normalize_directions(self.get_pixels(screen_size, top, bottom, left, right) - self.position)
+
+    # This function returns the direction of a ray through a random point of every pixel, each pixel's point moved
+    # from its center by up to half a pixel along x and y (a pixel's size is the spacing between the pixels).
+    # The directions are written into arrays the camera keeps for the resolution, so taking many samples per pixel
+    # allocates nothing after the first; the returned array is overwritten by the next call for the same
+    # resolution.
+    def get_jittered_directions(self, screen_size, rng):
+        width, height = screen_size
+        key = tuple(screen_size)
+        if key not in self.jitter_buffers:
+            self.jitter_buffers[key] = (self.get_pixels(screen_size), np.zeros((width * height, 3)),
+                                        np.zeros((width * height, 2)), np.zeros(width * height))
+        pixels, directions, offsets, norms = self.jitter_buffers[key]
+
+        rng.random(out=offsets)
+        offsets -= 0.5
+        offsets *= get_pixel_size(screen_size)
+        np.subtract(pixels, self.position, out=directions)
+        directions[:, :2] += offsets
+        np.einsum('ij,ij->i', directions, directions, out=norms)
+        np.sqrt(norms, out=norms)
+        directions /= norms[:, np.newaxis]
+        return directions
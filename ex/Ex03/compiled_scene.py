@@ -0,0 +1,323 @@
+import hashlib
+from functools import partial
+
+import numpy as np
+
+from helper_classes import *
+from triangle_kernels import intersect_triangles_packet
+
+# The types of primitives the compiled scene packs into arrays
+SPHERE = 0
+TRIANGLE = 1
+PLANE = 2
+# Any other primitive is kept as an object, and intersected through its own intersect / intersect_packet.
+# Other primitives made of faces (like Mesh) also have intersect_faces, occluded, get_face and get_face_normals,
+# so the compiled scene can tell which of their faces a ray hit.
+OTHER = 3
+
+# The maximum number of ray-primitive tests computed together in one batch of a packet intersection
+MAX_TESTS_PER_BATCH = 2 ** 20
+
+# The keys of the material table
+MATERIAL_KEYS = ('ambient', 'diffuse', 'specular', 'shininess', 'reflection')
+
+
+# This function returns the primitives of all the objects in the scene, in the order nearest_intersected_object
+# visits them, so ties between equally distant objects are broken the same way.
+def get_scene_primitives(objects):
+    primitives = []
+    for obj in objects:
+        primitives.extend(obj.get_primitives())
+    return primitives
+
+
+# This function intersects every ray with every sphere.
+# It returns a (number of spheres, number of rays) array of distances, with np.inf for a miss.
+def intersect_spheres(centers, radii, origins, directions):
+    L = origins[np.newaxis, :, :] - centers[:, np.newaxis, :]
+    a = np.einsum('ij,ij->i', directions, directions)[np.newaxis, :]
+    b = 2 * np.einsum('rj,srj->sr', directions, L)
+    c = np.einsum('srj,srj->sr', L, L) - (radii ** 2)[:, np.newaxis]
+    discriminant = b ** 2 - 4 * a * c
+
+    with np.errstate(invalid='ignore'):
+        sqrt_D = np.sqrt(discriminant)
+    t1 = (-b + sqrt_D) / (2 * a)
+    t2 = (-b - sqrt_D) / (2 * a)
+    min_t = get_epsilon(directions.dtype)
+    t1[~(t1 >= min_t)] = np.inf
+    t2[~(t2 >= min_t)] = np.inf
+    return np.minimum(t1, t2)
+
+
+# This function intersects every ray with every triangle, given by its vertex a and its edges ab and ac.
+# It returns a (number of triangles, number of rays) array of distances, with np.inf for a miss.
+def intersect_triangles(a, ab, ac, origins, directions):
+    return intersect_triangles_packet(a, ab, ac, origins, directions, get_epsilon(directions.dtype))
+
+
+# This function intersects every ray with every plane.
+# It returns a (number of planes, number of rays) array of distances, with np.inf for a miss.
+def intersect_planes(normals, points, origins, directions):
+    denominators = normals @ directions.T
+    numerators = np.einsum('pj,pj->p', points, normals)[:, np.newaxis] - normals @ origins.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = numerators / denominators
+    t[~((np.abs(denominators) >= epsilon) & (t > get_epsilon(directions.dtype)))] = np.inf
+    return t
+
+
+# A scene whose primitives are packed by type into contiguous arrays, with their materials packed into a material
+# table indexed by primitive ID. Primitive IDs follow the order of get_scene_primitives.
+# Like any other object of the scene, it has intersect for a single ray and intersect_packet for a packet of rays,
+# so [compile_scene(objects)] can replace objects in render_scene and in the packet tracer.
+# The geometry and the materials are packed as dtype, the dtype of the rays the scene is meant to trace: a float32
+# scene moves half the memory of a float64 scene through every kernel.
+class CompiledScene:
+    # The names of the packed arrays, which a compiled scene can be saved as and made from again
+    ARRAY_NAMES = ('types', 'slots', 'sphere_ids', 'sphere_centers', 'sphere_radii', 'triangle_ids', 'triangle_a',
+                   'triangle_ab', 'triangle_ac', 'triangle_normals', 'plane_ids', 'plane_normals', 'plane_points',
+                   'other_ids')
+
+    def __init__(self, objects, dtype=float):
+        self.dtype = np.dtype(dtype)
+        self.primitives = get_scene_primitives(objects)
+        self.types = np.array([get_primitive_type(primitive) for primitive in self.primitives], dtype=int)
+        # The index of every primitive within the arrays of its type
+        self.slots = np.zeros(len(self.primitives), dtype=int)
+        for primitive_type in (SPHERE, TRIANGLE, PLANE, OTHER):
+            ids = np.flatnonzero(self.types == primitive_type)
+            self.slots[ids] = np.arange(len(ids))
+
+        spheres = self.get_primitives_of_type(SPHERE)
+        self.sphere_ids = np.flatnonzero(self.types == SPHERE)
+        self.sphere_centers = np.array([s.center for s in spheres], dtype=dtype).reshape(-1, 3)
+        self.sphere_radii = np.array([s.radius for s in spheres], dtype=dtype)
+
+        triangles = self.get_primitives_of_type(TRIANGLE)
+        self.triangle_ids = np.flatnonzero(self.types == TRIANGLE)
+        vertices = np.array([[t.a, t.b, t.c] for t in triangles], dtype=dtype).reshape(-1, 3, 3)
+        self.triangle_a = vertices[:, 0]
+        self.triangle_ab = vertices[:, 1] - vertices[:, 0]
+        self.triangle_ac = vertices[:, 2] - vertices[:, 0]
+        self.triangle_normals = np.array([t.normal for t in triangles], dtype=dtype).reshape(-1, 3)
+
+        planes = self.get_primitives_of_type(PLANE)
+        self.plane_ids = np.flatnonzero(self.types == PLANE)
+        self.plane_normals = np.array([p.normal for p in planes], dtype=dtype).reshape(-1, 3)
+        self.plane_points = np.array([p.point for p in planes], dtype=dtype).reshape(-1, 3)
+
+        self.others = self.get_primitives_of_type(OTHER)
+        self.other_ids = np.flatnonzero(self.types == OTHER)
+
+        self.materials = {
+            key: np.array([primitive.material[key] for primitive in self.primitives], dtype=dtype)
+            for key in MATERIAL_KEYS
+        }
+
+    # This function returns the packed arrays and the material table of the scene, by name
+    def get_arrays(self):
+        arrays = {name: getattr(self, name) for name in self.ARRAY_NAMES}
+        arrays.update({f'material_{key}': values for key, values in self.materials.items()})
+        return arrays
+
+    # This function returns a compiled scene made of arrays that get_arrays returned, instead of packing its objects
+    # again. others are its primitives of type OTHER, in the order of other_ids; they are all that tracing packets
+    # needs besides the arrays. primitives are all its primitives, or a function that returns them, which is only
+    # called once something needs the primitives as objects (like intersect, which returns the primitive a single
+    # ray hits), so a scene that is only traced in packets never makes them.
+    @classmethod
+    def from_arrays(cls, arrays, others, primitives):
+        compiled_scene = cls.__new__(cls)
+        compiled_scene.dtype = np.dtype(arrays['sphere_centers'].dtype)
+        for name in cls.ARRAY_NAMES:
+            setattr(compiled_scene, name, arrays[name])
+        compiled_scene.others = list(others)
+        compiled_scene.materials = {key: arrays[f'material_{key}'] for key in MATERIAL_KEYS}
+        if callable(primitives):
+            compiled_scene.make_primitives = primitives
+        else:
+            compiled_scene.primitives = primitives
+        return compiled_scene
+
+    # The primitives of a compiled scene made by from_arrays with a function are made the first time they are used
+    def __getattr__(self, name):
+        if name == 'primitives' and 'make_primitives' in self.__dict__:
+            self.primitives = self.make_primitives()
+            return self.primitives
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    # This function returns the same scene packed as dtype. Its primitives are those of this scene, made only when
+    # one of the two scenes needs them.
+    def astype(self, dtype):
+        arrays = {name: array_.astype(dtype) if array_.dtype.kind == 'f' else array_
+                  for name, array_ in self.get_arrays().items()}
+        return type(self).from_arrays(arrays, self.others, partial(getattr, self, 'primitives'))
+
+    # This function returns, for every packed type, its primitive IDs, its intersection kernel and its arrays.
+    # The cheaper kernels come first, so occlusion queries can drop blocked rays before the expensive ones.
+    def get_kernels(self):
+        return [
+            (self.plane_ids, intersect_planes, (self.plane_normals, self.plane_points)),
+            (self.sphere_ids, intersect_spheres, (self.sphere_centers, self.sphere_radii)),
+            (self.triangle_ids, intersect_triangles, (self.triangle_a, self.triangle_ab, self.triangle_ac)),
+        ]
+
+    # This function returns a hash of the scene's geometry: the packed arrays, and the geometry of the other
+    # primitives. Materials are not part of it, so scenes that only differ in their materials share a hash.
+    def get_geometry_hash(self):
+        digest = hashlib.sha1()
+        arrays = [self.types, self.sphere_centers, self.sphere_radii, self.triangle_a, self.triangle_ab,
+                  self.triangle_ac, self.plane_normals, self.plane_points]
+        for other in self.others:
+            arrays.extend(other.get_geometry())
+        for array_ in arrays:
+            digest.update(str(array_.shape).encode())
+            digest.update(np.ascontiguousarray(array_).tobytes())
+        return digest.hexdigest()
+
+    def get_primitives_of_type(self, primitive_type):
+        return [primitive for primitive, t in zip(self.primitives, self.types) if t == primitive_type]
+
+    def get_primitives(self):
+        return self.primitives
+
+    def get_bounds(self):
+        return None
+
+    # This function returns the nearest primitive hit by the ray, like Ray.nearest_intersected_object.
+    # Each type of primitive is tested against the ray in one call over its packed arrays.
+    def intersect(self, ray: Ray):
+        faces = np.zeros(1, dtype=int)
+        ids, distances = self.nearest_intersection(np.asarray(ray.origin, dtype=float)[np.newaxis],
+                                                   np.asarray(ray.direction, dtype=float)[np.newaxis], faces)
+        if ids[0] < 0:
+            return None, None
+        primitive = self.primitives[ids[0]]
+        if hasattr(primitive, 'get_face'):
+            return distances[0], primitive.get_face(faces[0])
+        return distances[0], primitive
+
+    # This function intersects a packet of rays, and returns the distance to the nearest primitive of every ray
+    def intersect_packet(self, origins, directions):
+        return self.nearest_intersection(origins, directions)[1]
+
+    # This function looks for the nearest primitive hit by every ray of the packet.
+    # It returns the ID of the nearest primitive (-1 for no hit) and its distance (np.inf for no hit) per ray.
+    # Ties are broken by the lower primitive ID, like the linear scan of nearest_intersected_object.
+    # If faces is given, the index of the face each ray hits within its primitive is written into it (0 for
+    # primitives that are not made of faces).
+    def nearest_intersection(self, origins, directions, faces=None):
+        if faces is None:
+            faces = np.zeros(len(origins), dtype=int)
+        nearest_ids = np.full(len(origins), -1)
+        nearest_t = np.full(len(origins), np.inf, dtype=directions.dtype)
+        batch_size = max(1, MAX_TESTS_PER_BATCH // max(1, len(origins)))
+
+        for ids, kernel, arrays in self.get_kernels():
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                t = kernel(*[array[start:end] for array in arrays], origins, directions)
+                nearest = np.argmin(t, axis=0)
+                t = t[nearest, np.arange(len(origins))]
+                closer = update_nearest(nearest_ids, nearest_t, ids[start:end][nearest], t)
+                faces[closer] = 0
+
+        for primitive_id, primitive in zip(self.other_ids, self.others):
+            if hasattr(primitive, 'intersect_faces'):
+                t, primitive_faces = primitive.intersect_faces(origins, directions)
+            else:
+                t = primitive.intersect_packet(origins, directions)
+                primitive_faces = np.zeros(len(origins), dtype=int)
+            closer = update_nearest(nearest_ids, nearest_t, np.full(len(origins), primitive_id), t)
+            faces[closer] = primitive_faces[closer]
+
+        return nearest_ids, nearest_t
+
+    # This function returns whether the primitives block the ray closer than max_distance
+    def is_occluding(self, ray: Ray, max_distance):
+        return self.occluded(np.asarray(ray.origin, dtype=float)[np.newaxis],
+                             np.asarray(ray.direction, dtype=float)[np.newaxis],
+                             np.array([max_distance], dtype=float))[0]
+
+    # This function returns, for every ray of the packet, whether any primitive blocks it closer than its
+    # max_distance. Blocked rays are dropped from the packet as soon as they are found, so the following batches
+    # and types only test the rays that are still unblocked.
+    def occluded(self, origins, directions, max_distances):
+        occluded = np.zeros(len(origins), dtype=bool)
+        active = np.arange(len(origins))
+        batch_size = max(1, MAX_TESTS_PER_BATCH // max(1, len(origins)))
+
+        for ids, kernel, arrays in self.get_kernels():
+            for start in range(0, len(ids), batch_size):
+                if not len(active):
+                    return occluded
+                end = start + batch_size
+                t = kernel(*[array[start:end] for array in arrays], origins[active], directions[active])
+                blocked = (t < max_distances[active]).any(axis=0)
+                occluded[active[blocked]] = True
+                active = active[~blocked]
+
+        for primitive in self.others:
+            if not len(active):
+                return occluded
+            if hasattr(primitive, 'occluded'):
+                blocked = primitive.occluded(origins[active], directions[active], max_distances[active])
+            else:
+                blocked = primitive.intersect_packet(origins[active], directions[active]) < max_distances[active]
+            occluded[active[blocked]] = True
+            active = active[~blocked]
+
+        return occluded
+
+    # This function returns the normals of the primitives with the given IDs, at the given (n, 3) points.
+    # faces are the faces nearest_intersection found, for the primitives made of faces.
+    def get_normals(self, ids, points, faces=None):
+        normals = np.zeros_like(points)
+        types = self.types[ids]
+        slots = self.slots[ids]
+
+        mask = types == SPHERE
+        normals[mask] = normalize_rows(points[mask] - self.sphere_centers[slots[mask]])
+        mask = types == TRIANGLE
+        normals[mask] = self.triangle_normals[slots[mask]]
+        mask = types == PLANE
+        normals[mask] = self.plane_normals[slots[mask]]
+        for primitive_id in np.unique(ids[types == OTHER]):
+            mask = ids == primitive_id
+            primitive = self.others[self.slots[primitive_id]]
+            if hasattr(primitive, 'get_face_normals'):
+                normals[mask] = primitive.get_face_normals(faces[mask])
+            else:
+                normals[mask] = primitive.get_normals(points[mask])
+        return normals
+
+
+# This function returns the type the compiled scene packs the primitive as
+def get_primitive_type(primitive):
+    if isinstance(primitive, Sphere):
+        return SPHERE
+    if isinstance(primitive, Triangle):
+        return TRIANGLE
+    if isinstance(primitive, Plane):
+        return PLANE
+    return OTHER
+
+
+# This function keeps, for every ray, the nearer of its current nearest hit and the new hit.
+# It returns which rays took the new hit.
+def update_nearest(nearest_ids, nearest_t, ids, t):
+    closer = (t < nearest_t) | ((t == nearest_t) & (ids < nearest_ids) & np.isfinite(t))
+    nearest_ids[closer] = ids[closer]
+    nearest_t[closer] = t[closer]
+    return closer
+
+
+# This function compiles the objects of a scene into a CompiledScene packed as dtype.
+# A scene that is already compiled ([compiled_scene]) is returned as it is, or converted if it has another dtype.
+def compile_scene(objects, dtype=float):
+    if len(objects) == 1 and isinstance(objects[0], CompiledScene):
+        if objects[0].dtype != dtype:
+            return objects[0].astype(dtype)
+        return objects[0]
+    return CompiledScene(objects, dtype)
@@ -0,0 +1,234 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from helper_classes import *
+from compiled_scene import compile_scene
+from packet_tracer import PACKET_SIZE, get_packet_is_in_shadow, get_primary_directions
+
+# The number of G-buffers the deferred renderer keeps
+GBUFFER_CACHE_SIZE = 4
+
+# The number of lights whose shadows and terms every G-buffer keeps
+LIGHT_CACHE_SIZE = 16
+
+# What the last deferred render did: whether its G-buffer was cached, and the seconds spent tracing and shading
+deferred_stats = {'cache_hit': False, 'trace_seconds': 0.0, 'shade_seconds': 0.0}
+
+
+# The hits of one reflection depth of a G-buffer, stored as arrays.
+# sources is, for every hit, the pixel of its camera ray for the primary hits, and the index of the hit whose
+# reflected ray found it for the deeper ones.
+class GBufferLayer:
+    def __init__(self, sources, ids, points, normals, directions):
+        self.sources = sources
+        self.ids = ids
+        self.points = points
+        self.normals = normals
+        self.directions = directions
+
+    def __len__(self):
+        return len(self.sources)
+
+
+# What a light adds to the hits of one layer of a G-buffer, apart from its intensity and the materials.
+# attenuations scales the light's intensity at every hit and is 0 where the hit is in the light's shadow,
+# diffuse_factors is the attenuation times the cosine between the normal and the direction to the light, and
+# specular_cosines is the cosine between the reflected light direction and the direction to the camera.
+class LightTerms:
+    def __init__(self, in_shadow, attenuations, diffuse_factors, specular_cosines):
+        self.in_shadow = in_shadow
+        self.attenuations = attenuations
+        self.diffuse_factors = diffuse_factors
+        self.specular_cosines = specular_cosines
+        self.shininess_table = None
+        self.specular_factors = None
+
+    # This function returns the attenuation times the specular cosine to the power of the shininess of every hit.
+    # The powers are kept until the shininess of a material changes, since they are the slowest term to compute.
+    def get_specular_factors(self, ids, shininess_table):
+        if self.shininess_table is None or not np.array_equal(self.shininess_table, shininess_table):
+            self.shininess_table = shininess_table.copy()
+            self.specular_factors = self.attenuations * self.specular_cosines ** np.take(shininess_table, ids)
+        return self.specular_factors
+
+
+# The geometry seen by every pixel of an image: for every reflection depth, the primitive ID, position, normal and
+# view direction of every hit. None of it depends on the lights or the materials, so the image can be shaded again
+# without tracing a single camera or reflected ray.
+# The shadow masks only depend on where a light is, and the rest of its terms only on where it is and how it falls
+# off, so both are kept per light: changing a light's intensity, the ambient light or the materials is only a few
+# array operations per light, and only a light that moved has its shadow rays traced again.
+class GBuffer:
+    def __init__(self, screen_size, layers):
+        self.screen_size = screen_size
+        self.layers = layers
+        self.shadows = OrderedDict()
+        self.light_terms = OrderedDict()
+
+    # This function returns, for every layer, whether each of its hits is in the shadow of the light
+    def get_shadows(self, compiled_scene, light, packet_size=PACKET_SIZE):
+        key = get_light_key(light)
+        if key not in self.shadows:
+            shadows = []
+            for layer in self.layers:
+                in_shadow = np.zeros(len(layer), dtype=bool)
+                for start in range(0, len(layer), packet_size):
+                    end = start + packet_size
+                    in_shadow[start:end] = get_packet_is_in_shadow(compiled_scene, light, layer.points[start:end])
+                shadows.append(in_shadow)
+            put_in_cache(self.shadows, key, shadows)
+        self.shadows.move_to_end(key)
+        return self.shadows[key]
+
+    # This function returns the LightTerms of the light for every layer
+    def get_light_terms(self, compiled_scene, light, packet_size=PACKET_SIZE):
+        key = get_light_key(light) + tuple(getattr(light, name, None) for name in ('kc', 'kl', 'kq'))
+        if key not in self.light_terms:
+            light_terms = []
+            for layer, in_shadow in zip(self.layers, self.get_shadows(compiled_scene, light, packet_size)):
+                light_directions = light.get_light_directions(layer.points)
+                attenuations = light.get_attenuations(layer.points) * ~in_shadow
+                cosines = np.einsum('ij,ij->i', light_directions, layer.normals)
+                reflections = reflected_rows(-light_directions, layer.normals)
+                specular_cosines = np.einsum('ij,ij->i', reflections, -layer.directions)
+                light_terms.append(LightTerms(in_shadow, attenuations, attenuations * cosines, specular_cosines))
+            put_in_cache(self.light_terms, key, light_terms)
+        self.light_terms.move_to_end(key)
+        return self.light_terms[key]
+
+
+# This function returns what the shadows of a light depend on: its type, position and direction
+def get_light_key(light):
+    return (type(light).__name__,
+            np.asarray(getattr(light, 'position', ()), dtype=float).tobytes(),
+            np.asarray(getattr(light, 'direction', ()), dtype=float).tobytes())
+
+
+# This function adds a value to a cache of a G-buffer, and drops its least recently used value if it holds more
+# than LIGHT_CACHE_SIZE values
+def put_in_cache(cache, key, value):
+    cache[key] = value
+    if len(cache) > LIGHT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+# This function traces the camera rays and their reflections up to max_depth, and returns their hits as a G-buffer.
+# Like get_packet_colors, every hit reflects a ray, and the rays that miss leave the G-buffer.
+def build_gbuffer(compiled_scene, camera, screen_size, max_depth, packet_size=PACKET_SIZE):
+    directions = get_primary_directions(camera, screen_size)
+    origins = np.broadcast_to(np.asarray(camera, dtype=float), directions.shape)
+    layers = []
+
+    while len(directions):
+        ids = np.full(len(directions), -1)
+        distances = np.full(len(directions), np.inf)
+        faces = np.zeros(len(directions), dtype=int)
+        for start in range(0, len(directions), packet_size):
+            end = start + packet_size
+            ids[start:end], distances[start:end] = compiled_scene.nearest_intersection(
+                origins[start:end], directions[start:end], faces[start:end])
+
+        # The rays of a depth are the reflections of the hits of the previous depth, in the same order
+        rays = np.flatnonzero(ids >= 0)
+        ids, distances, faces, directions = ids[rays], distances[rays], faces[rays], directions[rays]
+        points = origins[rays] + distances[:, np.newaxis] * directions
+        normals = compiled_scene.get_normals(ids, points, faces)
+        layers.append(GBufferLayer(rays, ids, points, normals, directions))
+
+        if len(layers) + 1 > max_depth:
+            break
+        origins, directions = points, reflected_rows(directions, normals)
+
+    return GBuffer(screen_size, layers)
+
+
+# This function shades a G-buffer with the lights, ambient light and materials of the scene, and returns the image.
+# It gives the same image as render_scene_packet for the scene the G-buffer was built from.
+# The layers are shaded from the deepest one up, and every layer adds the reflected colors of the layer below to
+# the hits that reflected them, so only the colors of the primary hits are written into the image.
+def shade_gbuffer(gbuffer, scene, compiled_scene, packet_size=PACKET_SIZE):
+    width, height = gbuffer.screen_size
+    image = np.zeros((height * width, 3))
+    light_terms = [gbuffer.get_light_terms(compiled_scene, light, packet_size) for light in scene["lights"]]
+    intensities = np.array([np.broadcast_to(np.asarray(light.intensity, dtype=float), 3)
+                            for light in scene["lights"]]).reshape(-1, 3)
+    reflected_colors = None
+
+    for depth in reversed(range(len(gbuffer.layers))):
+        layer = gbuffer.layers[depth]
+        colors = shade_layer(layer, [terms[depth] for terms in light_terms], intensities, scene["ambient"],
+                             compiled_scene.materials)
+        if reflected_colors is not None:
+            parents = gbuffer.layers[depth + 1].sources
+            reflections = compiled_scene.materials['reflection'][layer.ids[parents]]
+            colors[parents] += reflections[:, np.newaxis] * reflected_colors
+        reflected_colors = colors
+
+    if gbuffer.layers:
+        image[gbuffer.layers[0].sources] = reflected_colors
+    # We clip the values between 0 and 1 so all pixel values will make sense.
+    return np.clip(image, 0, 1).reshape(height, width, 3)
+
+
+# This function returns the local colors of the hits of a layer, the same way get_color computes them.
+# The colors of the lights are summed with one product of a (hits, lights) matrix and a (lights, 3) matrix of the
+# light intensities.
+def shade_layer(layer, layer_terms, intensities, ambient, materials):
+    ids = layer.ids
+    shape = (len(layer_terms), len(layer))
+    diffuse_factors = np.array([terms.diffuse_factors for terms in layer_terms]).reshape(shape).T
+    specular_factors = np.array([terms.get_specular_factors(ids, materials['shininess'])
+                                 for terms in layer_terms]).reshape(shape).T
+    colors = (np.take(materials['diffuse'], ids, axis=0) * (diffuse_factors @ intensities) +
+              np.take(materials['specular'], ids, axis=0) * (specular_factors @ intensities))
+
+    # Like get_color, the ambient light depends on whether the point is in the shadow of the last light
+    if layer_terms:
+        lit = ~layer_terms[-1].in_shadow
+        colors += np.take(ambient * materials['ambient'], ids, axis=0) * lit[:, np.newaxis]
+    return colors
+
+
+# A renderer that keeps the G-buffers of its last renders, keyed on the camera, the resolution, max_depth and the
+# geometry of the scene. A render that only changes the lights, the ambient light or the materials finds its
+# G-buffer in the cache, and only runs the shading stage.
+class DeferredRenderer:
+    def __init__(self, cache_size=GBUFFER_CACHE_SIZE, packet_size=PACKET_SIZE):
+        self.cache_size = cache_size
+        self.packet_size = packet_size
+        self.gbuffers = OrderedDict()
+
+    def render(self, camera, ambient, lights, objects, screen_size, max_depth):
+        start_time = time.perf_counter()
+        scene = {"objects": objects, "ambient": ambient, "lights": lights}
+        compiled_scene = compile_scene(objects)
+        key = (np.asarray(camera, dtype=float).tobytes(), tuple(screen_size), max_depth,
+               compiled_scene.get_geometry_hash())
+
+        cache_hit = key in self.gbuffers
+        if cache_hit:
+            self.gbuffers.move_to_end(key)
+        else:
+            self.gbuffers[key] = build_gbuffer(compiled_scene, camera, screen_size, max_depth, self.packet_size)
+            if len(self.gbuffers) > self.cache_size:
+                self.gbuffers.popitem(last=False)
+        trace_time = time.perf_counter()
+
+        image = shade_gbuffer(self.gbuffers[key], scene, compiled_scene, self.packet_size)
+        deferred_stats.update({'cache_hit': cache_hit, 'trace_seconds': trace_time - start_time,
+                               'shade_seconds': time.perf_counter() - trace_time})
+        return image
+
+    def clear(self):
+        self.gbuffers.clear()
+
+
+# The renderer render_scene_deferred caches its G-buffers in
+deferred_renderer = DeferredRenderer()
+
+
+# This function renders the same image as render_scene_packet, through the cached G-buffers of deferred_renderer
+def render_scene_deferred(camera, ambient, lights, objects, screen_size, max_depth):
+    return deferred_renderer.render(camera, ambient, lights, objects, screen_size, max_depth)
@@ -0,0 +1,217 @@
+import time
+
+import numpy as np
+
+from helper_classes import *
+from hw3 import render_scene
+
+# The grid is given about this many cells per primitive
+GRID_DENSITY = 2.0
+
+# The largest number of cells along an axis of the grid
+MAX_RESOLUTION = 64
+
+
+# This function returns the number of cells along every axis of a grid over a box of the given size holding
+# number_of_primitives primitives: cubic cells, density cells per primitive (Cleary and Wyvill's rule), and at least
+# one and at most MAX_RESOLUTION cells along every axis
+def get_grid_resolution(size, number_of_primitives, density=GRID_DENSITY):
+    cells_per_unit = np.cbrt(density * number_of_primitives / np.prod(size))
+    return np.clip(np.round(size * cells_per_unit), 1, MAX_RESOLUTION).astype(int)
+
+
+# A uniform grid over the bounded objects of a scene. Every cell lists the primitives whose boxes overlap it, and a
+# ray walks through the cells it crosses in order (3D-DDA), testing only their primitives, and stops at the first
+# cell that holds a hit nearer than the cell's far side.
+# A primitive that overlaps many cells is tested once per ray: the grid keeps a mailbox per primitive with the
+# number of the last ray that tested it. Like the BVH, composite objects are flattened into their primitives, and
+# the grid behaves like any other object of the scene.
+# For many similar objects spread evenly (like the stars of your_own_scene) the grid is faster to build than a
+# BVH and walks few empty cells; for a few large objects, or objects of very different sizes, use the BVH.
+class UniformGrid:
+    def __init__(self, objects, density=GRID_DENSITY):
+        start_time = time.perf_counter()
+        self.primitives = []
+        for obj in objects:
+            self.primitives.extend(obj.get_primitives())
+        bounds = [primitive.get_bounds() for primitive in self.primitives]
+        primitives_min = np.array([b[0] for b in bounds], dtype=float).reshape(-1, 3)
+        primitives_max = np.array([b[1] for b in bounds], dtype=float).reshape(-1, 3)
+
+        if self.primitives:
+            # The grid is padded a little, so primitives that are flat along an axis still have a cell to be in
+            self.bounds_min = primitives_min.min(axis=0) - epsilon
+            self.bounds_max = primitives_max.max(axis=0) + epsilon
+        else:
+            self.bounds_min = self.bounds_max = np.zeros(3)
+        size = self.bounds_max - self.bounds_min
+        self.resolution = get_grid_resolution(size, len(self.primitives), density)
+        self.cell_size = size / np.maximum(self.resolution, 1)
+
+        # The cells every primitive overlaps, as a range of cell coordinates along every axis
+        low = self.get_cell_coordinates(primitives_min)
+        high = self.get_cell_coordinates(primitives_max)
+        cells, owners = [], []
+        for primitive_index, (cell_low, cell_high) in enumerate(zip(low, high)):
+            x, y, z = np.meshgrid(*[np.arange(cell_low[axis], cell_high[axis] + 1) for axis in range(3)],
+                                  indexing='ij')
+            cells.append(self.get_cell_index(x.ravel(), y.ravel(), z.ravel()))
+            owners.append(np.full(x.size, primitive_index))
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype=int)
+        owners = np.concatenate(owners) if owners else np.zeros(0, dtype=int)
+
+        # The primitives of cell i are cell_primitives[cell_start[i]:cell_start[i + 1]], in the order of the objects.
+        # They are kept as lists, since the walk reads them one cell at a time.
+        order = np.lexsort((owners, cells))
+        number_of_cells = int(np.prod(self.resolution))
+        self.cell_start = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=number_of_cells))]).tolist()
+        self.cell_primitives = owners[order].tolist()
+        self.mailboxes = [0] * len(self.primitives)
+        self.ray_number = 0
+        self.build_time = time.perf_counter() - start_time
+
+    # This function returns the cell coordinates of (n, 3) points, clipped to the grid
+    def get_cell_coordinates(self, points):
+        cells = np.floor((points - self.bounds_min) / self.cell_size).astype(int)
+        return np.clip(cells, 0, self.resolution - 1)
+
+    def get_cell_index(self, x, y, z):
+        return (x * self.resolution[1] + y) * self.resolution[2] + z
+
+    def get_primitives(self):
+        return self.primitives
+
+    def get_bounds(self):
+        if not self.primitives:
+            return None
+        return self.bounds_min, self.bounds_max
+
+    # This function yields the cells the ray crosses, in order, up to max_t: the index of every cell and the
+    # distance at which the ray leaves it
+    def walk(self, ray: Ray, max_t):
+        if not self.primitives:
+            return
+        origin = np.asarray(ray.origin, dtype=float)
+        direction = np.asarray(ray.direction, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse_direction = 1.0 / direction
+            t0 = (self.bounds_min - origin) * inverse_direction
+            t1 = (self.bounds_max - origin) * inverse_direction
+        t_enter = max(np.max(np.fmin(t0, t1)), 0.0)
+        t_exit = min(np.min(np.fmax(t0, t1)), max_t)
+        if t_enter > t_exit:
+            return
+
+        cell = self.get_cell_coordinates((origin + t_enter * direction)[np.newaxis])[0].tolist()
+        resolution = self.resolution.tolist()
+        steps, next_t, delta_t = [], [], []
+        for axis in range(3):
+            if direction[axis] > 0:
+                steps.append(1)
+                boundary = self.bounds_min[axis] + (cell[axis] + 1) * self.cell_size[axis]
+            elif direction[axis] < 0:
+                steps.append(-1)
+                boundary = self.bounds_min[axis] + cell[axis] * self.cell_size[axis]
+            else:
+                steps.append(0)
+                next_t.append(np.inf)
+                delta_t.append(np.inf)
+                continue
+            next_t.append(float((boundary - origin[axis]) * inverse_direction[axis]))
+            delta_t.append(float(self.cell_size[axis] * abs(inverse_direction[axis])))
+
+        while True:
+            axis = next_t.index(min(next_t))
+            leave_t = min(next_t[axis], t_exit)
+            yield (cell[0] * resolution[1] + cell[1]) * resolution[2] + cell[2], leave_t
+            if next_t[axis] >= t_exit:
+                return
+            cell[axis] += steps[axis]
+            if not 0 <= cell[axis] < resolution[axis]:
+                return
+            next_t[axis] += delta_t[axis]
+
+    # This function returns the nearest primitive hit by the ray, like Ray.nearest_intersected_object, but it only
+    # tests the primitives of the cells the ray crosses before the nearest hit found so far
+    def intersect(self, ray: Ray):
+        self.ray_number += 1
+        min_t = np.inf
+        nearest_object = None
+        for cell, leave_t in self.walk(ray, np.inf):
+            for primitive_index in self.cell_primitives[self.cell_start[cell]:self.cell_start[cell + 1]]:
+                if self.mailboxes[primitive_index] == self.ray_number:
+                    continue
+                self.mailboxes[primitive_index] = self.ray_number
+                t, intersected_object = self.primitives[primitive_index].intersect(ray)
+                if t is not None and min_t > t > epsilon:
+                    min_t = t
+                    nearest_object = intersected_object
+            # A primitive that reaches past this cell may have been hit past it, where a primitive of a later cell
+            # can still be nearer; only a hit before the ray leaves this cell is final
+            if min_t <= leave_t:
+                break
+
+        if nearest_object is None:
+            return None, None
+        return min_t, nearest_object
+
+    # This function returns whether any primitive blocks the ray closer than max_distance
+    def is_occluding(self, ray: Ray, max_distance):
+        self.ray_number += 1
+        for cell, _ in self.walk(ray, max_distance):
+            for primitive_index in self.cell_primitives[self.cell_start[cell]:self.cell_start[cell + 1]]:
+                if self.mailboxes[primitive_index] == self.ray_number:
+                    continue
+                self.mailboxes[primitive_index] = self.ray_number
+                if self.primitives[primitive_index].is_occluding(ray, max_distance):
+                    return True
+        return False
+
+    # This function returns the build time and the size of the grid
+    def get_stats(self):
+        number_of_cells = len(self.cell_start) - 1
+        counts = np.diff(self.cell_start)
+        return {
+            'primitives': len(self.primitives),
+            'resolution': tuple(self.resolution.tolist()),
+            'cells': number_of_cells,
+            'empty_cells': int(np.count_nonzero(counts == 0)),
+            'references': len(self.cell_primitives),
+            'build_time': self.build_time,
+        }
+
+
+# This function replaces the objects of a scene with a uniform grid over the bounded objects and a list of the
+# unbounded ones (like Plane), which are tested by every ray as before. Like build_scene_bvh, the returned list can
+# be used anywhere the original objects list is used:
+#     objects = build_scene_grid(objects)
+#     im = render_scene(camera, ambient, lights, objects, RENDER_RESOLUTION, 3)
+def build_scene_grid(objects, density=GRID_DENSITY):
+    bounded = [obj for obj in objects if obj.get_bounds() is not None]
+    unbounded = [obj for obj in objects if obj.get_bounds() is None]
+    if not bounded:
+        return unbounded
+    return [UniformGrid(bounded, density)] + unbounded
+
+
+# This function renders the scene with render_scene over the objects as they are (a linear scan of every object
+# for every ray) and over build_scene_grid(objects). It returns the build time of the grid, the render time of
+# each, and the largest difference between the two images.
+def compare_with_linear_scan(camera, ambient, lights, objects, screen_size, max_depth):
+    start_time = time.perf_counter()
+    grid_objects = build_scene_grid(objects)
+    build_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    linear_image = render_scene(camera, ambient, lights, objects, screen_size, max_depth)
+    linear_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    grid_image = render_scene(camera, ambient, lights, grid_objects, screen_size, max_depth)
+    grid_seconds = time.perf_counter() - start_time
+    return {
+        'build_seconds': build_seconds,
+        'linear_seconds': linear_seconds,
+        'grid_seconds': grid_seconds,
+        'speedup': linear_seconds / grid_seconds,
+        'max_difference': float(np.max(np.abs(linear_image - grid_image))),
+    }
@@ -1,7 +1,19 @@
 import numpy as np
 
+from triangle_kernels import hits_box, intersect_triangle, intersect_triangles_packet
+
 epsilon = 1e-6
 
+# The epsilon of rays traced in float32 (see render_scene_packet). A float32 hit point is only accurate to about
+# 1e-7 of its distance from the origin, so with epsilon the rays leaving it hit its own surface again (shadow acne).
+# The benchmark scenes (see benchmark.compare_precisions) have no acne from 1e-4 up; this leaves some margin.
+float32_epsilon = 3e-4
+
+
+# This function returns the epsilon of rays whose arrays have the given dtype
+def get_epsilon(dtype):
+    return float32_epsilon if dtype == np.float32 else epsilon
+
 
 # This function gets a vector and returns its normalized form.
 def normalize(vector):
@@ -14,6 +26,17 @@ def reflected(vector, axis):
     return normalize(vector - 2 * np.dot(vector, axis) * axis)
 
 
+# This function gets an (n, 3) array of vectors and returns each row normalized
+def normalize_rows(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+
+
+# This function is the batched version of reflected, for (n, 3) arrays of vectors and normals
+def reflected_rows(vectors, axes):
+    dots = np.einsum('ij,ij->i', vectors, axes)[:, np.newaxis]
+    return normalize_rows(vectors - 2 * dots * axes)
+
+
 ## Lights
 
 class LightSource:
@@ -39,6 +62,21 @@ class DirectionalLight(LightSource):
     def get_intensity(self, intersection):
         return self.intensity
 
+    # Batched versions of the functions above, for an (n, 3) array of points
+    # The returned arrays have the dtype of points
+    def get_light_directions(self, points):
+        return np.broadcast_to(-self.direction, points.shape).astype(points.dtype)
+
+    def get_distances_from_light(self, points):
+        return np.full(len(points), np.inf, dtype=points.dtype)
+
+    # This function returns the factor the intensity of the light is scaled by at every point
+    def get_attenuations(self, points):
+        return np.ones(len(points), dtype=points.dtype)
+
+    def get_intensities(self, points):
+        return np.broadcast_to(np.asarray(self.intensity, dtype=points.dtype), points.shape).copy()
+
 
 class PointLight(LightSource):
     def __init__(self, intensity, position, kc, kl, kq):
@@ -61,6 +99,21 @@ class PointLight(LightSource):
         d = self.get_distance_from_light(intersection)
         return self.intensity / (self.kc + self.kl * d + self.kq * (d ** 2))
 
+    # Batched versions of the functions above, for an (n, 3) array of points.
+    # The returned arrays have the dtype of points.
+    def get_light_directions(self, points):
+        return normalize_rows(self.position.astype(points.dtype) - points)
+
+    def get_distances_from_light(self, points):
+        return np.linalg.norm(points - self.position.astype(points.dtype), axis=1)
+
+    def get_attenuations(self, points):
+        d = self.get_distances_from_light(points)
+        return 1 / (self.kc + self.kl * d + self.kq * (d ** 2))
+
+    def get_intensities(self, points):
+        return np.asarray(self.intensity, dtype=points.dtype) * self.get_attenuations(points)[:, np.newaxis]
+
 
 class SpotLight(LightSource):
     def __init__(self, intensity, position, direction, kc, kl, kq):
@@ -85,6 +138,35 @@ class SpotLight(LightSource):
         return (self.intensity * dot_product) / (self.kc + self.kl * distance_from_light + self.kq *
                                                  (distance_from_light ** 2))
 
+    # Batched versions of the functions above, for an (n, 3) array of points.
+    # The returned arrays have the dtype of points.
+    def get_light_directions(self, points):
+        return np.broadcast_to(normalize(self.position - self.direction), points.shape).astype(points.dtype)
+
+    def get_distances_from_light(self, points):
+        return np.linalg.norm(points - self.position.astype(points.dtype), axis=1)
+
+    def get_attenuations(self, points):
+        d = self.get_distances_from_light(points)
+        directions_to_points = normalize_rows(points - self.position.astype(points.dtype))
+        dot_products = directions_to_points @ normalize(self.direction).astype(points.dtype)
+        attenuation = self.kc + self.kl * d + self.kq * (d ** 2)
+        return dot_products / attenuation
+
+    def get_intensities(self, points):
+        return np.asarray(self.intensity, dtype=points.dtype) * self.get_attenuations(points)[:, np.newaxis]
+
+
+# Everything shading needs to know about the point where a ray hit an object.
+# It is computed once per hit and passed through shading, instead of intersecting the ray again.
+class HitRecord:
+    def __init__(self, obj, t, point, normal):
+        self.object = obj
+        self.t = t
+        self.point = point
+        self.normal = normal
+        self.material = obj.material
+
 
 class Ray:
     def __init__(self, origin, direction):
@@ -106,6 +188,21 @@ class Ray:
                 intersection_point = self.origin + t * self.direction
         return nearest_object, min_t, intersection_point
 
+    # The function returns a HitRecord of the nearest object the ray hits, or None if it hits nothing
+    def nearest_hit(self, objects):
+        nearest_object, min_t, intersection_point = self.nearest_intersected_object(objects)
+        if nearest_object is None:
+            return None
+        return HitRecord(nearest_object, min_t, intersection_point, nearest_object.get_normal(intersection_point))
+
+    # The function checks whether any of the objects blocks the ray closer than max_distance.
+    # Unlike nearest_intersected_object, it returns as soon as it finds one blocking object.
+    def is_occluded(self, objects, max_distance=np.inf):
+        for obj in objects:
+            if obj.is_occluding(self, max_distance):
+                return True
+        return False
+
 
 class Object3D:
     def __init__(self):
@@ -120,6 +217,64 @@ class Object3D:
             'reflection': reflection  ## Kr
         }
 
+    # This function returns the primitives a packet tracer should intersect instead of this object.
+    # Composite objects (like Pyramid) return the simple objects they are made of.
+    def get_primitives(self):
+        return [self]
+
+    # This function returns the axis aligned bounding box of the object, as a (min corner, max corner) pair.
+    # Unbounded objects (like Plane) return None.
+    def get_bounds(self):
+        return None
+
+    # This function returns arrays that describe the object's geometry, so caches can tell when it changed.
+    # Objects that do not describe their geometry are only told apart by their identity.
+    def get_geometry(self):
+        return [np.array([id(self)])]
+
+    # This function returns whether the object blocks the ray closer than max_distance
+    def is_occluding(self, ray, max_distance):
+        t, _ = self.intersect(ray)
+        return t is not None and epsilon < t < max_distance
+
+    # This function returns the normal of the object at a point on its surface
+    def get_normal(self, point):
+        return self.get_normals(np.asarray(point, dtype=float)[np.newaxis])[0]
+
+
+# An object made of simple objects (its primitives, like the triangles of a Pyramid).
+# A ray is first tested against the box around the object, computed once from get_bounds, and only tested against
+# the primitives if it enters the box, so rays that pass far from the object cost one slab test instead of a test
+# per primitive. A composite object only has to implement get_primitives and get_bounds. One whose primitives move
+# must set bounding_box back to None.
+class CompositeObject3D(Object3D):
+    bounding_box = None
+
+    # This function returns the box around the object, padded by epsilon so hits on its faces are never rejected
+    def get_bounding_box(self):
+        if self.bounding_box is None:
+            bounds_min, bounds_max = self.get_bounds()
+            self.bounding_box = (np.asarray(bounds_min, dtype=float) - epsilon,
+                                 np.asarray(bounds_max, dtype=float) + epsilon)
+        return self.bounding_box
+
+    # This function returns whether the ray enters the box around the object before max_t
+    def hits_bounds(self, ray, max_t=np.inf):
+        bounds_min, bounds_max = self.get_bounding_box()
+        return hits_box(np.asarray(ray.origin, dtype=float), np.asarray(ray.direction, dtype=float), bounds_min,
+                        bounds_max, 0.0, max_t)
+
+    def intersect(self, ray: Ray):
+        if not self.hits_bounds(ray):
+            return None, None
+        nearest_object, min_t, _ = ray.nearest_intersected_object(self.get_primitives())
+        if nearest_object is None:
+            return None, None
+        return min_t, nearest_object
+
+    def is_occluding(self, ray, max_distance):
+        return self.hits_bounds(ray, max_distance) and ray.is_occluded(self.get_primitives(), max_distance)
+
 
 class Plane(Object3D):
     def __init__(self, normal, point):
@@ -137,6 +292,24 @@ class Plane(Object3D):
             return t, self
         return None, None
 
+    # This function intersects a packet of rays, given as (n, 3) arrays of origins and directions.
+    # It returns an array of n distances, with np.inf wherever the ray misses the plane.
+    def intersect_packet(self, origins, directions):
+        denominators = directions @ self.normal
+        min_t = get_epsilon(directions.dtype)
+        valid = np.abs(denominators) >= epsilon
+        t = np.full(len(origins), np.inf)
+        t[valid] = ((self.point - origins[valid]) @ self.normal) / denominators[valid]
+        t[~(t > min_t)] = np.inf
+        return t
+
+    def get_normal(self, point):
+        return self.normal
+
+    # This function returns the normal at each of the given (n, 3) points
+    def get_normals(self, points):
+        return np.broadcast_to(self.normal, points.shape).astype(float)
+
 
 class Triangle(Object3D):
     # """
@@ -154,6 +327,8 @@ class Triangle(Object3D):
         self.b = np.array(b)
         self.c = np.array(c)
         self.normal = self.compute_normal()
+        self.ab = (self.b - self.a).astype(float)
+        self.ac = (self.c - self.a).astype(float)
 
     # computes normal to the trainagle surface. Pay attention to its direction!
     def compute_normal(self):
@@ -161,27 +336,34 @@ class Triangle(Object3D):
         bc = self.c - self.b
         return normalize(np.cross(bc, ba))
 
+    # Solves a + u * ab + v * ac = ray.origin + t * ray.direction with the Möller–Trumbore kernel.
+    # The edges are computed once in __init__, so no matrix is built per ray.
     def intersect(self, ray):
-        ab = self.b - self.a
-        ac = self.c - self.a
-        A = np.column_stack((ab, ac, -ray.direction))
-        if np.linalg.det(A) == 0:
-            return None, None
-        b = ray.origin - self.a
-        try:
-            # Solving the system using numpy's linear algebra solver
-            u, v, t = np.linalg.solve(A, b)
-            # Check if the solution is within the bounds of the triangle and ray is pointing towards it
-            if 0 <= u <= 1 and 0 <= v <= 1 and (u + v) <= 1 and t > epsilon:
-                return t, self
-            else:
-                return None, None
-        except np.linalg.LinAlgError:
-            # This occurs if the matrix A is singular, i.e., no solution
+        t = intersect_triangle(np.asarray(ray.origin, dtype=float), np.asarray(ray.direction, dtype=float),
+                               self.a, self.ab, self.ac, epsilon)
+        if t == np.inf:
             return None, None
+        return t, self
 
+    # This function intersects a packet of rays, given as (n, 3) arrays of origins and directions.
+    # It returns an array of n distances, with np.inf wherever the ray misses the triangle.
+    def intersect_packet(self, origins, directions):
+        return intersect_triangles_packet(self.a[np.newaxis], self.ab[np.newaxis], self.ac[np.newaxis],
+                                          origins, directions, get_epsilon(directions.dtype))[0]
 
-class Pyramid(Object3D):
+    def get_normal(self, point):
+        return self.normal
+
+    # This function returns the normal at each of the given (n, 3) points
+    def get_normals(self, points):
+        return np.broadcast_to(self.normal, points.shape).astype(float)
+
+    def get_bounds(self):
+        vertices = np.array([self.a, self.b, self.c], dtype=float)
+        return vertices.min(axis=0), vertices.max(axis=0)
+
+
+class Pyramid(CompositeObject3D):
     #     """
     #             D
     #             /\*\
@@ -208,21 +390,23 @@ class Pyramid(Object3D):
     #         C -> E -> A
     #     """
 
+    # The indices in v_list of the vertices of every face
+    t_idx = [
+        [0, 1, 3],
+        [1, 2, 3],
+        [0, 3, 2],
+        [4, 1, 0],
+        [4, 2, 1],
+        [2, 4, 0]
+    ]
+
     def __init__(self, v_list):
         self.v_list = v_list
         self.triangle_list = self.create_triangle_list()
 
     def create_triangle_list(self):
         l = []
-        t_idx = [
-            [0, 1, 3],
-            [1, 2, 3],
-            [0, 3, 2],
-            [4, 1, 0],
-            [4, 2, 1],
-            [2, 4, 0]
-        ]
-        for idx in t_idx:
+        for idx in self.t_idx:
             a = self.v_list[idx[0]]
             b = self.v_list[idx[1]]
             c = self.v_list[idx[2]]
@@ -234,12 +418,12 @@ class Pyramid(Object3D):
             triangle.set_material(self.material["ambient"], self.material["diffuse"], self.material["specular"],
                                   self.material["shininess"], self.material["reflection"])
 
-    def intersect(self, ray: Ray):
-        intersection = ray.nearest_intersected_object(self.triangle_list)
-        if intersection is not None:
-            nearest_object, min_t, _ = intersection
-            return min_t, nearest_object
-        return None, None
+    def get_primitives(self):
+        return self.triangle_list
+
+    def get_bounds(self):
+        vertices = np.array(self.v_list, dtype=float)
+        return vertices.min(axis=0), vertices.max(axis=0)
 
 
 class Sphere(Object3D):
@@ -270,3 +454,34 @@ class Sphere(Object3D):
         if t2 < epsilon:
             return t1, self
         return min(t1, t2), self
+
+    # This function intersects a packet of rays, given as (n, 3) arrays of origins and directions.
+    # It returns an array of n distances, with np.inf wherever the ray misses the sphere.
+    def intersect_packet(self, origins, directions):
+        L = origins - self.center
+        a = np.einsum('ij,ij->i', directions, directions)
+        b = 2 * np.einsum('ij,ij->i', directions, L)
+        c = np.einsum('ij,ij->i', L, L) - (self.radius ** 2)
+        discriminant = b ** 2 - 4 * a * c
+
+        t = np.full(len(origins), np.inf)
+        valid = discriminant >= 0
+        sqrt_D = np.sqrt(discriminant[valid])
+        t1 = (-b[valid] + sqrt_D) / (2 * a[valid])
+        t2 = (-b[valid] - sqrt_D) / (2 * a[valid])
+        min_t = get_epsilon(directions.dtype)
+        t1[t1 < min_t] = np.inf
+        t2[t2 < min_t] = np.inf
+        t[valid] = np.minimum(t1, t2)
+        return t
+
+    def get_normal(self, point):
+        return normalize(point - self.center)
+
+    # This function returns the normal at each of the given (n, 3) points
+    def get_normals(self, points):
+        return normalize_rows(points - self.center)
+
+    def get_bounds(self):
+        center = np.array(self.center, dtype=float)
+        return center - self.radius, center + self.radius
@@ -1,38 +1,40 @@
 import numpy as np
 
 from helper_classes import *
+from camera import Camera
 import matplotlib.pyplot as plt
 
 
-def get_color(scene, ray, depth, max_depth):
+# This function returns the color seen along the ray. hit is the ray's HitRecord if the caller already has it,
+# so the nearest intersection is never computed twice for the same ray.
+def get_color(scene, ray, depth, max_depth, hit=None):
     color = np.zeros(3)
     is_in_shadow = True
-    nearest_object, min_t, intersection_point = ray.nearest_intersected_object(scene["objects"])
+    if hit is None:
+        hit = ray.nearest_hit(scene["objects"])
 
-    if nearest_object is None:
+    if hit is None:
         return color
 
-    normal = np.zeros(3)
-    if isinstance(nearest_object, Plane) or isinstance(nearest_object, Triangle):
-        normal = nearest_object.normal
-    elif isinstance(nearest_object, Sphere):
-        normal = normalize(intersection_point - nearest_object.center)
-
     for light in scene["lights"]:
-        is_in_shadow = get_is_in_shadow(scene["objects"], light, intersection_point)
-        color += get_diffuse_light(light, nearest_object.material, normal, intersection_point) * (1 - is_in_shadow)
-        color += get_specular_light(light, nearest_object.material, normal, intersection_point, ray) * (
-                1 - is_in_shadow)
+        # The light ray and the intensity are computed once per light, and shared by the shadow test and the shading
+        light_ray = light.get_light_ray(hit.point)
+        is_in_shadow = light_ray.is_occluded(scene["objects"], light.get_distance_from_light(hit.point))
+        if is_in_shadow:
+            continue
+        intensity = light.get_intensity(hit.point)
+        color += compute_diffuse_light(hit.material, hit.normal, light_ray.direction, intensity)
+        color += compute_specular_light(hit.material, hit.normal, light_ray.direction, intensity, -ray.direction)
 
     if not is_in_shadow:
-        color += get_ambient_light(scene["ambient"], nearest_object.material)
+        color += get_ambient_light(scene["ambient"], hit.material)
 
     if depth + 1 > max_depth:
         return color
 
-    reflected_ray = Ray(intersection_point, normalize(reflected(ray.direction, normal)))
+    reflected_ray = Ray(hit.point, normalize(reflected(ray.direction, hit.normal)))
     reflected_color = get_color(scene, reflected_ray, depth + 1, max_depth)
-    color += nearest_object.material['reflection'] * reflected_color
+    color += hit.material['reflection'] * reflected_color
 
     return color
 
@@ -44,52 +46,71 @@ def get_ambient_light(ambient, material):
 def get_is_in_shadow(objects, light, intersection_point):
     light_ray = light.get_light_ray(intersection_point)
     light_distance = light.get_distance_from_light(intersection_point)
-    nearest_object, _, nearest_object_intersection_point = light_ray.nearest_intersected_object(objects)
-    if nearest_object is None:
-        return False
-    else:
-        nearest_object_distance = np.linalg.norm(intersection_point - nearest_object_intersection_point)
-        return nearest_object_distance < light_distance
+    # The light ray's direction is normalized, so any object it hits before light_distance blocks the light
+    return light_ray.is_occluded(objects, light_distance)
 
 
 def get_diffuse_light(light, material, normal, intersection_point):
     light_direction = light.get_light_ray(intersection_point).direction
-    return material['diffuse'] * light.get_intensity(intersection_point) * np.dot(light_direction, normal)
+    return compute_diffuse_light(material, normal, light_direction, light.get_intensity(intersection_point))
 
 
 def get_specular_light(light, material, normal, intersection_point, ray):
     light_direction = light.get_light_ray(intersection_point).direction
+    return compute_specular_light(material, normal, light_direction, light.get_intensity(intersection_point),
+                                  -ray.direction)
+
+
+# The diffuse term, for a light direction and intensity that were already computed at the point
+def compute_diffuse_light(material, normal, light_direction, intensity):
+    return material['diffuse'] * intensity * np.dot(light_direction, normal)
+
+
+# The specular term, for a light direction and intensity that were already computed at the point
+def compute_specular_light(material, normal, light_direction, intensity, view_direction):
     reflection = normalize(reflected(-light_direction, normal))
-    view_direction = -ray.direction
-    return (material['specular'] * light.get_intensity(intersection_point) * np.dot(reflection, view_direction) **
-            material['shininess'])
+    return material['specular'] * intensity * np.dot(reflection, view_direction) ** material['shininess']
 
 
-def render_scene(camera, ambient, lights, objects, screen_size, max_depth):
-    width, height = screen_size
-    ratio = float(width) / height
-    screen = (-1, 1 / ratio, 1, -1 / ratio)  # left, top, right, bottom
+# This function renders the scene. If stats (a RayStats of ray_stats.py) is given, the render also counts its rays
+# and intersection tests into it, and records the cost of every pixel; without it nothing is counted.
+def render_scene(camera, ambient, lights, objects, screen_size, max_depth, stats=None):
+    if stats is not None:
+        # Imported here, since ray_stats is built on this module
+        from ray_stats import render_scene_with_stats
+        return render_scene_with_stats(camera, ambient, lights, objects, screen_size, max_depth, stats)
 
+    width, height = screen_size
     image = np.zeros((height, width, 3))
     scene = {"objects": objects, "ambient": ambient, "lights": lights}
 
-    for i, y in enumerate(np.linspace(screen[1], screen[3], height)):
-        for j, x in enumerate(np.linspace(screen[0], screen[2], width)):
-            # screen is on origin
-            pixel = np.array([x, y, 0])
-            origin = camera
-            direction = normalize(pixel - origin)
-            ray = Ray(origin, direction)
+    for i, j, ray in get_pixel_rays(camera, screen_size):
+        image[i, j] = get_pixel_color(scene, ray, max_depth)
 
-            color = np.zeros(3)
-            closest_object, min_t, intersection_point = ray.nearest_intersected_object(objects)
-            if closest_object is not None:
-                color += get_color(scene, ray, 1, max_depth)
+    return image
 
-            # We clip the values between 0 and 1 so all pixel values will make sense.
-            image[i, j] = np.clip(color, 0, 1)
 
-    return image
+# This function yields the row, the column and the ray from the camera of every pixel, or only of the pixels in
+# rows [top, bottom) and columns [left, right)
+def get_pixel_rays(camera, screen_size, top=0, bottom=None, left=0, right=None):
+    width, height = screen_size
+    # The directions of all the pixels are made at once, and kept for the next render of the same view
+    directions = Camera(camera).get_directions(screen_size).reshape(height, width, 3)
+
+    for i in range(top, height if bottom is None else bottom):
+        for j in range(left, width if right is None else right):
+            yield i, j, Ray(camera, directions[i, j])
+
+
+# This function returns the color of the pixel the ray from the camera goes through
+def get_pixel_color(scene, ray, max_depth):
+    color = np.zeros(3)
+    hit = ray.nearest_hit(scene["objects"])
+    if hit is not None:
+        color += get_color(scene, ray, 1, max_depth, hit)
+
+    # We clip the values between 0 and 1 so all pixel values will make sense.
+    return np.clip(color, 0, 1)
 
 
 # Write your own objects and lights
@@ -0,0 +1,100 @@
+import weakref
+
+import numpy as np
+
+from helper_classes import *
+from mesh import MeshFace, pyramid_to_mesh
+
+# The mesh every instanced Pyramid is turned into, built once per Pyramid and shared by all its instances
+pyramid_meshes = weakref.WeakKeyDictionary()
+
+
+# This function returns a 4x4 affine transform that scales, then rotates (by a 3x3 matrix), then translates
+def make_transform(translation=(0, 0, 0), rotation=None, scale=1.0):
+    transform = np.eye(4)
+    linear = np.eye(3) if rotation is None else np.asarray(rotation, dtype=float)
+    transform[:3, :3] = linear @ np.diag(np.broadcast_to(np.asarray(scale, dtype=float), 3))
+    transform[:3, 3] = translation
+    return transform
+
+
+# This function returns the matrix of a rotation by angle radians around the given axis
+def make_rotation(axis, angle):
+    x, y, z = normalize(np.asarray(axis, dtype=float))
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([
+        [c + x * x * (1 - c), x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+        [y * x * (1 - c) + z * s, c + y * y * (1 - c), y * z * (1 - c) - x * s],
+        [z * x * (1 - c) - y * s, z * y * (1 - c) + x * s, c + z * z * (1 - c)],
+    ])
+
+
+# A copy of shared geometry (a Mesh, or a Pyramid which is turned into a Mesh once) placed in the scene by a 4x4
+# affine transform from object space to world space. Rays are moved into object space and intersected with the
+# geometry's own hierarchy, so thousands of instances share one copy of the faces and one acceleration structure.
+# The instance starts with the geometry's material, and set_material gives it its own.
+class Instance(Object3D):
+    def __init__(self, geometry, transform):
+        super().__init__()
+        if isinstance(geometry, Pyramid):
+            if geometry not in pyramid_meshes:
+                pyramid_meshes[geometry] = pyramid_to_mesh(geometry)
+            geometry = pyramid_meshes[geometry]
+        self.geometry = geometry
+        self.material = geometry.material
+        self.set_transform(transform)
+
+    # This function moves the instance. Only the instance's matrices change; the shared geometry does not.
+    def set_transform(self, transform):
+        self.transform = np.asarray(transform, dtype=float)
+        self.inverse_transform = np.linalg.inv(self.transform)
+        # Normals are transformed by the inverse transpose of the linear part of the transform. A mirroring
+        # transform also swaps the front and back of the faces, like transforming the vertices would.
+        self.normal_matrix = self.inverse_transform[:3, :3].T * np.sign(np.linalg.det(self.transform[:3, :3]))
+
+    # This function moves rays into object space. The directions are not normalized again, so a distance t along
+    # an object space ray is the same distance t along the world space ray. The moved rays keep the dtype of the rays.
+    def to_object_space(self, origins, directions):
+        inverse_transform = self.inverse_transform.astype(directions.dtype)
+        linear = inverse_transform[:3, :3]
+        return origins @ linear.T + inverse_transform[:3, 3], directions @ linear.T
+
+    def get_bounds(self):
+        if self.geometry.get_bounds() is None:
+            return None
+        bounds_min, bounds_max = self.geometry.get_bounds()
+        corners = np.array([[x, y, z] for x in (bounds_min[0], bounds_max[0])
+                            for y in (bounds_min[1], bounds_max[1])
+                            for z in (bounds_min[2], bounds_max[2])])
+        corners = corners @ self.transform[:3, :3].T + self.transform[:3, 3]
+        return corners.min(axis=0), corners.max(axis=0)
+
+    def get_geometry(self):
+        return [self.transform] + self.geometry.get_geometry()
+
+    def intersect(self, ray: Ray):
+        t, faces = self.intersect_faces(np.asarray(ray.origin, dtype=float)[np.newaxis],
+                                        np.asarray(ray.direction, dtype=float)[np.newaxis])
+        if faces[0] < 0:
+            return None, None
+        return t[0], self.get_face(faces[0])
+
+    def is_occluding(self, ray: Ray, max_distance):
+        return self.occluded(np.asarray(ray.origin, dtype=float)[np.newaxis],
+                             np.asarray(ray.direction, dtype=float)[np.newaxis],
+                             np.array([max_distance], dtype=float))[0]
+
+    def intersect_packet(self, origins, directions):
+        return self.intersect_faces(origins, directions)[0]
+
+    def intersect_faces(self, origins, directions):
+        return self.geometry.intersect_faces(*self.to_object_space(origins, directions))
+
+    def occluded(self, origins, directions, max_distances):
+        return self.geometry.occluded(*self.to_object_space(origins, directions), max_distances)
+
+    def get_face(self, face):
+        return MeshFace(self, face)
+
+    def get_face_normals(self, faces):
+        return normalize_rows(self.geometry.get_face_normals(faces) @ self.normal_matrix.T)
@@ -0,0 +1,177 @@
+import numpy as np
+
+from helper_classes import *
+from compiled_scene import MAX_TESTS_PER_BATCH
+from packet_tracer import PACKET_SIZE, get_packet_is_in_shadow, render_scene_packet
+
+# A light is skipped at a point where its attenuated intensity (its brightest channel) is below this
+CULL_THRESHOLD = 1e-3
+
+# A point lit by at most this many lights (after culling) is shaded by all of them. A point lit by more is shaded by
+# LIGHT_SAMPLES of them, picked at random with probabilities proportional to their attenuated intensity there.
+MAX_LIGHTS = 16
+LIGHT_SAMPLES = 8
+
+# What the light set did since the last reset: the shading points, the point-light pairs it looked at, how many of
+# them were culled, the points whose lights were sampled, and the shadow rays it cast
+many_lights_stats = {'points': 0, 'pairs': 0, 'culled': 0, 'sampled_points': 0, 'shadow_rays': 0}
+
+
+def reset_many_lights_stats():
+    many_lights_stats.update({'points': 0, 'pairs': 0, 'culled': 0, 'sampled_points': 0, 'shadow_rays': 0})
+
+
+# The lights of a scene packed into arrays, so a batch of points can be tested against all of them at once.
+# At every point, lights too dim to matter there are culled, and when too many lights remain a few of them are
+# importance sampled and their contributions scaled by the inverse of their probability, so the expected color is
+# the color of all the remaining lights. The light functions are the same as those of DirectionalLight, PointLight
+# and SpotLight.
+class LightSet:
+    def __init__(self, lights, cull_threshold=CULL_THRESHOLD, max_lights=MAX_LIGHTS, samples=LIGHT_SAMPLES, seed=0):
+        self.lights = lights
+        self.cull_threshold = cull_threshold
+        self.max_lights = max_lights
+        self.samples = samples
+        self.rng = np.random.default_rng(seed)
+
+        self.is_directional = np.array([isinstance(light, DirectionalLight) for light in lights], dtype=bool)
+        self.is_spot = np.array([isinstance(light, SpotLight) for light in lights], dtype=bool)
+        for light in lights:
+            if not isinstance(light, (DirectionalLight, PointLight, SpotLight)):
+                raise ValueError(f'Lights of type {type(light).__name__} cannot be put in a LightSet')
+        self.intensities = np.array([light.intensity for light in lights], dtype=float).reshape(-1, 3)
+        self.brightness = np.abs(self.intensities).max(axis=1)
+        self.positions = np.array([np.zeros(3) if isinstance(light, DirectionalLight) else light.position
+                                   for light in lights], dtype=float).reshape(-1, 3)
+        self.coefficients = np.array([(1, 0, 0) if isinstance(light, DirectionalLight) else
+                                      (light.kc, light.kl, light.kq) for light in lights], dtype=float).reshape(-1, 3)
+        # The direction to the light of the lights whose direction does not depend on the point
+        self.fixed_directions = np.array([-light.direction if isinstance(light, DirectionalLight) else
+                                          normalize(light.position - light.direction) if isinstance(light, SpotLight)
+                                          else np.zeros(3) for light in lights], dtype=float).reshape(-1, 3)
+        self.spot_axes = np.array([normalize(light.direction) if isinstance(light, SpotLight) else np.zeros(3)
+                                   for light in lights], dtype=float).reshape(-1, 3)
+
+    # This function returns the (points, lights) matrix of the attenuation of every light at every point
+    def get_attenuation_matrix(self, points):
+        offsets = points[:, np.newaxis, :] - self.positions[np.newaxis, :, :]
+        distances = np.sqrt(np.einsum('plj,plj->pl', offsets, offsets))
+        kc, kl, kq = self.coefficients.T
+        attenuations = 1 / (kc + kl * distances + kq * distances ** 2)
+        spots = np.flatnonzero(self.is_spot)
+        if len(spots):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                attenuations[:, spots] *= (np.einsum('plj,lj->pl', offsets[:, spots], self.spot_axes[spots]) /
+                                           distances[:, spots])
+        return attenuations
+
+    # This function returns, for pairs of a point and a light, the direction from the point to the light and the
+    # distance between them
+    def get_light_rays(self, points, lights):
+        offsets = self.positions[lights] - points
+        distances = np.linalg.norm(offsets, axis=1)
+        directions = self.fixed_directions[lights]
+        is_point = ~(self.is_directional[lights] | self.is_spot[lights])
+        directions[is_point] = offsets[is_point] / distances[is_point, np.newaxis]
+        distances[self.is_directional[lights]] = np.inf
+        return directions, distances
+
+    # This function picks the lights that shade every point. It returns pairs of a point (its index) and a light
+    # (its index), and the factor the light's intensity is scaled by at the point: its attenuation, divided by the
+    # probability of picking it if it was sampled.
+    def select(self, points):
+        attenuations = self.get_attenuation_matrix(points)
+        powers = np.abs(attenuations) * self.brightness
+        # A light of no power at a point adds nothing there, so it is always culled
+        kept = (powers >= self.cull_threshold) & (powers > 0)
+        counts = kept.sum(axis=1)
+        many_lights_stats['pairs'] += kept.size
+        many_lights_stats['culled'] += kept.size - int(counts.sum())
+
+        point_indices, light_indices = np.nonzero(kept & (counts <= self.max_lights)[:, np.newaxis])
+        factors = attenuations[point_indices, light_indices]
+
+        sampled = np.flatnonzero(counts > self.max_lights)
+        if len(sampled):
+            rows, lights, probabilities = self.sample(np.where(kept[sampled], powers[sampled], 0))
+            rows = sampled[rows]
+            point_indices = np.concatenate([point_indices, rows])
+            light_indices = np.concatenate([light_indices, lights])
+            factors = np.concatenate([factors, attenuations[rows, lights] / (self.samples * probabilities)])
+            many_lights_stats['sampled_points'] += len(sampled)
+        return point_indices, light_indices, factors
+
+    # This function samples self.samples lights for every row of the (rows, lights) powers, with probabilities
+    # proportional to the powers. The cumulative distributions of all the rows are laid one after the other, row r
+    # spanning [r, r + 1], so one searchsorted samples every row. Every row is divided by its own last cumulative
+    # value, so it ends at exactly r + 1 and a draw never leaves its row or picks a light of no power.
+    # It returns the row, the light and the probability of every sample.
+    def sample(self, powers):
+        cdf = np.cumsum(powers, axis=1)
+        totals = cdf[:, -1]
+        number_of_rows, number_of_lights = powers.shape
+        cdf = cdf / totals[:, np.newaxis] + np.arange(number_of_rows)[:, np.newaxis]
+        rows = np.repeat(np.arange(number_of_rows), self.samples)
+        draws = rows + self.rng.random(len(rows))
+        lights = np.searchsorted(cdf.ravel(), draws, side='right') - rows * number_of_lights
+        return rows, lights, powers[rows, lights] / totals[rows]
+
+    # This function returns the diffuse and specular light of the lights select picks for every point, each
+    # tested with one shadow ray
+    def get_light_colors(self, compiled_scene, ids, points, normals, directions):
+        materials = compiled_scene.materials
+        point_indices, light_indices, factors = self.select(points)
+        pair_points = points[point_indices]
+        light_directions, light_distances = self.get_light_rays(pair_points, light_indices)
+        lit = ~compiled_scene.occluded(pair_points, light_directions.astype(points.dtype),
+                                       light_distances.astype(points.dtype))
+        many_lights_stats['shadow_rays'] += len(point_indices)
+        point_indices, light_indices, factors = point_indices[lit], light_indices[lit], factors[lit]
+        light_directions = light_directions[lit]
+
+        pair_ids = ids[point_indices]
+        pair_normals = normals[point_indices]
+        intensities = self.intensities[light_indices] * factors[:, np.newaxis]
+        diffuse_light = (materials['diffuse'][pair_ids] * intensities *
+                         np.einsum('ij,ij->i', light_directions, pair_normals)[:, np.newaxis])
+        reflections = reflected_rows(-light_directions, pair_normals)
+        specular_light = (materials['specular'][pair_ids] * intensities *
+                          (np.einsum('ij,ij->i', reflections, -directions[point_indices]) **
+                           materials['shininess'][pair_ids])[:, np.newaxis])
+        pair_colors = diffuse_light + specular_light
+        return np.stack([np.bincount(point_indices, pair_colors[:, channel], minlength=len(points))
+                         for channel in range(3)], axis=1)
+
+    # This function computes the local (non reflected) color of every hit point like get_packet_local_colors, but
+    # only with the lights select picks for it. The points are shaded in chunks, so the (points, lights) matrices
+    # of a chunk stay within MAX_TESTS_PER_BATCH values. Like get_color, the ambient light depends on whether the
+    # point is in the shadow of the last light of the scene, which is tested even if it was culled.
+    # It takes the arguments of get_packet_local_colors, so it can be the shade of render_scene_packet.
+    def shade(self, scene, compiled_scene, ids, points, normals, directions):
+        colors = np.zeros_like(points)
+        many_lights_stats['points'] += len(points)
+        if not self.lights:
+            return colors
+
+        chunk_size = max(1, MAX_TESTS_PER_BATCH // len(self.lights))
+        for start in range(0, len(points), chunk_size):
+            end = start + chunk_size
+            colors[start:end] = self.get_light_colors(compiled_scene, ids[start:end], points[start:end],
+                                                      normals[start:end], directions[start:end])
+
+        is_in_shadow = get_packet_is_in_shadow(compiled_scene, self.lights[-1], points)
+        many_lights_stats['shadow_rays'] += len(points)
+        lit = ~is_in_shadow
+        colors[lit] += scene["ambient"] * compiled_scene.materials['ambient'][ids[lit]]
+        return colors
+
+
+# This function renders the scene like render_scene_packet, but shades every point with the lights a LightSet
+# picks for it: lights whose attenuated intensity there is below cull_threshold are skipped, and where more than
+# max_lights remain, samples of them are importance sampled (seed makes the samples repeatable). With a cull_threshold
+# of 0 and a max_lights of at least the number of lights, the image is the image of render_scene_packet.
+def render_scene_many_lights(camera, ambient, lights, objects, screen_size, max_depth, cull_threshold=CULL_THRESHOLD,
+                             max_lights=MAX_LIGHTS, samples=LIGHT_SAMPLES, seed=0, packet_size=PACKET_SIZE):
+    light_set = LightSet(lights, cull_threshold, max_lights, samples, seed)
+    return render_scene_packet(camera, ambient, lights, objects, screen_size, max_depth, packet_size,
+                               shade=light_set.shade)
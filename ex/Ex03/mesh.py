@@ -0,0 +1,295 @@
+import time
+from array import array
+
+import numpy as np
+
+from helper_classes import *
+from triangle_kernels import intersect_triangles_packet
+
+# The maximum number of faces stored in a leaf of a mesh's hierarchy
+MAX_LEAF_FACES = 8
+
+# What the traversals of the mesh hierarchies did since the last reset: the rays traced, the traversal steps (one per
+# node a packet of rays visited), the ray-box tests and the ray-face tests
+traversal_stats = {'rays': 0, 'steps': 0, 'box_tests': 0, 'face_tests': 0}
+
+
+def reset_traversal_stats():
+    traversal_stats.update({'rays': 0, 'steps': 0, 'box_tests': 0, 'face_tests': 0})
+
+
+# This function returns the distance at which every ray enters the box, or np.inf for the rays that miss it or
+# only reach it after their max_t
+def get_box_entry_distances(bounds_min, bounds_max, origins, inverse_directions, max_t):
+    with np.errstate(invalid='ignore'):
+        t0 = (bounds_min - origins) * inverse_directions
+        t1 = (bounds_max - origins) * inverse_directions
+    # fmin and fmax ignore the nan of a ray that lies exactly on a slab of the box
+    t_near = np.fmin(t0, t1).max(axis=1)
+    t_far = np.fmax(t0, t1).min(axis=1)
+    t_near[(t_near > t_far) | (t_far < epsilon) | (t_near >= max_t)] = np.inf
+    return t_near
+
+
+# A bounding volume hierarchy over the faces of a mesh, stored in flat arrays instead of one object per node or
+# per face. The faces are reordered so every leaf holds a contiguous range of them, and the rays of a packet travel
+# down the hierarchy together, each node only testing the rays that entered its parent.
+class MeshBVH:
+    # The names of the arrays of the hierarchy, which it can be saved as and made from again
+    ARRAY_NAMES = ('bounds_min', 'bounds_max', 'left', 'right', 'start', 'count', 'order', 'faces')
+
+    def __init__(self, vertices, faces, max_leaf_faces=MAX_LEAF_FACES):
+        start_time = time.perf_counter()
+        corners = vertices[faces.T]
+        face_min = corners.min(axis=0)
+        face_max = corners.max(axis=0)
+        centroids = (face_min + face_max) / 2
+
+        # order[i] is the original index of the i-th face of the reordered arrays
+        self.order = np.arange(len(faces), dtype=np.int32)
+        bounds_min, bounds_max, left, right, start, count = [], [], [], [], [], []
+
+        def add_node():
+            for node_list in (bounds_min, bounds_max, left, right, start, count):
+                node_list.append(None)
+            return len(left) - 1
+
+        # A mesh without faces gets no nodes at all, and every ray misses it
+        stack = [(add_node(), 0, len(faces))] if len(faces) else []
+        while stack:
+            node, low, high = stack.pop()
+            node_faces = self.order[low:high]
+            bounds_min[node] = face_min[node_faces].min(axis=0)
+            bounds_max[node] = face_max[node_faces].max(axis=0)
+            if high - low <= max_leaf_faces:
+                left[node], right[node], start[node], count[node] = -1, -1, low, high - low
+                continue
+
+            # Split at the median centroid along the longest axis of the centroids' bounds
+            node_centroids = centroids[node_faces]
+            axis = np.argmax(node_centroids.max(axis=0) - node_centroids.min(axis=0))
+            middle = (high - low) // 2
+            self.order[low:high] = node_faces[np.argpartition(node_centroids[:, axis], middle)]
+            left[node], right[node], start[node], count[node] = add_node(), add_node(), low, 0
+            stack.append((right[node], low + middle, high))
+            stack.append((left[node], low, low + middle))
+
+        self.bounds_min = np.array(bounds_min, dtype=float).reshape(-1, 3)
+        self.bounds_max = np.array(bounds_max, dtype=float).reshape(-1, 3)
+        self.left = np.array(left, dtype=np.int32)
+        self.right = np.array(right, dtype=np.int32)
+        self.start = np.array(start, dtype=np.int32)
+        self.count = np.array(count, dtype=np.int32)
+        # The leaves read their faces' corners from the shared vertex array
+        self.vertices = vertices
+        self.faces = faces[self.order]
+        self.build_time = time.perf_counter() - start_time
+
+    def get_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAY_NAMES}
+
+    # This function returns the hierarchy over the vertices made of arrays that get_arrays returned, instead of
+    # building it again
+    @classmethod
+    def from_arrays(cls, vertices, arrays):
+        bvh = cls.__new__(cls)
+        for name in cls.ARRAY_NAMES:
+            setattr(bvh, name, arrays[name])
+        bvh.vertices = vertices
+        bvh.build_time = 0.0
+        return bvh
+
+    def get_node_count(self):
+        return len(self.left)
+
+    # This function returns the number of bytes the hierarchy takes, besides the shared vertex array
+    def get_memory_footprint(self):
+        return sum(array_.nbytes for array_ in (self.bounds_min, self.bounds_max, self.left, self.right, self.start,
+                                                self.count, self.order, self.faces))
+
+    # This function returns the vertex a and the edges ab and ac of the faces in [low, high) of the reordered faces
+    def get_leaf_triangles(self, low, high):
+        a, b, c = (self.vertices[self.faces[low:high, i]] for i in range(3))
+        return a, b - a, c - a
+
+    # This function returns, for every ray, the distance to the nearest face it hits (np.inf for none) and the
+    # original index of that face (-1 for none)
+    def nearest_intersection(self, origins, directions):
+        nearest_t = np.full(len(origins), np.inf)
+        nearest_faces = np.full(len(origins), -1)
+        with np.errstate(divide='ignore'):
+            inverse_directions = 1.0 / directions
+        traversal_stats['rays'] += len(origins)
+
+        stack = [(0, np.arange(len(origins)))] if self.get_node_count() else []
+        while stack:
+            node, rays = stack.pop()
+            traversal_stats['steps'] += 1
+            traversal_stats['box_tests'] += len(rays)
+            entry = get_box_entry_distances(self.bounds_min[node], self.bounds_max[node], origins[rays],
+                                            inverse_directions[rays], nearest_t[rays])
+            rays = rays[entry < np.inf]
+            if not len(rays):
+                continue
+            if self.left[node] >= 0:
+                stack.append((self.right[node], rays))
+                stack.append((self.left[node], rays))
+                continue
+
+            low, high = self.start[node], self.start[node] + self.count[node]
+            t = intersect_triangles_packet(*self.get_leaf_triangles(low, high), origins[rays], directions[rays],
+                                           get_epsilon(directions.dtype))
+            traversal_stats['face_tests'] += t.size
+            nearest = np.argmin(t, axis=0)
+            t = t[nearest, np.arange(len(rays))]
+            closer = t < nearest_t[rays]
+            nearest_t[rays[closer]] = t[closer]
+            nearest_faces[rays[closer]] = self.order[low + nearest[closer]]
+        return nearest_t, nearest_faces
+
+    # This function returns, for every ray, whether any face blocks it closer than its max_distance.
+    # A ray leaves the traversal as soon as one blocking face is found.
+    def occluded(self, origins, directions, max_distances):
+        occluded = np.zeros(len(origins), dtype=bool)
+        with np.errstate(divide='ignore'):
+            inverse_directions = 1.0 / directions
+        traversal_stats['rays'] += len(origins)
+
+        stack = [(0, np.arange(len(origins)))] if self.get_node_count() else []
+        while stack:
+            node, rays = stack.pop()
+            rays = rays[~occluded[rays]]
+            traversal_stats['steps'] += 1
+            traversal_stats['box_tests'] += len(rays)
+            entry = get_box_entry_distances(self.bounds_min[node], self.bounds_max[node], origins[rays],
+                                            inverse_directions[rays], max_distances[rays])
+            rays = rays[entry < np.inf]
+            if not len(rays):
+                continue
+            if self.left[node] >= 0:
+                stack.append((self.right[node], rays))
+                stack.append((self.left[node], rays))
+                continue
+
+            low, high = self.start[node], self.start[node] + self.count[node]
+            t = intersect_triangles_packet(*self.get_leaf_triangles(low, high), origins[rays], directions[rays],
+                                           get_epsilon(directions.dtype))
+            traversal_stats['face_tests'] += t.size
+            occluded[rays[(t < max_distances[rays]).any(axis=0)]] = True
+        return occluded
+
+
+# One face of a mesh (or of an instance of a mesh) that a ray hit. It has what shading needs (a material and a
+# normal), so single rays can return it like any other hit object, without the mesh keeping an object per face.
+class MeshFace:
+    def __init__(self, mesh, face):
+        self.mesh = mesh
+        self.face = face
+        self.material = mesh.material
+        self.normal = mesh.get_face_normals(np.array([face]))[0]
+
+    def get_normal(self, point):
+        return self.normal
+
+
+# A triangle mesh, stored as a shared (number of vertices, 3) vertex array and a (number of faces, 3) int32 array
+# of vertex indices. Like Triangle, the front face of every face is A -> B -> C.
+# The faces are only intersected through the mesh's MeshBVH, which is built unless the arrays of one built for the
+# same vertices and faces (MeshBVH.get_arrays) are given.
+class Mesh(Object3D):
+    def __init__(self, vertices, faces, max_leaf_faces=MAX_LEAF_FACES, bvh_arrays=None):
+        super().__init__()
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.faces = np.asarray(faces, dtype=np.int32).reshape(-1, 3)
+        a, b, c = (self.vertices[self.faces[:, i]] for i in range(3))
+        self.face_normals = normalize_rows(np.cross(c - b, a - b))
+        if bvh_arrays is None:
+            self.bvh = MeshBVH(self.vertices, self.faces, max_leaf_faces)
+        else:
+            self.bvh = MeshBVH.from_arrays(self.vertices, bvh_arrays)
+
+    # A mesh without faces has no bounds, like the unbounded objects it is kept with: no ray can hit it
+    def get_bounds(self):
+        if not len(self.faces):
+            return None
+        return self.vertices.min(axis=0), self.vertices.max(axis=0)
+
+    def get_geometry(self):
+        return [self.vertices, self.faces]
+
+    # This function returns the number of bytes the mesh arrays and their hierarchy take
+    def get_memory_footprint(self):
+        return (self.vertices.nbytes + self.faces.nbytes + self.face_normals.nbytes +
+                self.bvh.get_memory_footprint())
+
+    def intersect(self, ray: Ray):
+        t, faces = self.intersect_faces(np.asarray(ray.origin, dtype=float)[np.newaxis],
+                                        np.asarray(ray.direction, dtype=float)[np.newaxis])
+        if faces[0] < 0:
+            return None, None
+        return t[0], self.get_face(faces[0])
+
+    def is_occluding(self, ray: Ray, max_distance):
+        return self.occluded(np.asarray(ray.origin, dtype=float)[np.newaxis],
+                             np.asarray(ray.direction, dtype=float)[np.newaxis],
+                             np.array([max_distance], dtype=float))[0]
+
+    # This function intersects a packet of rays, and returns the distance to the nearest face of every ray
+    def intersect_packet(self, origins, directions):
+        return self.bvh.nearest_intersection(origins, directions)[0]
+
+    # This function intersects a packet of rays, and returns the distance to the nearest face of every ray and the
+    # index of that face
+    def intersect_faces(self, origins, directions):
+        return self.bvh.nearest_intersection(origins, directions)
+
+    def occluded(self, origins, directions, max_distances):
+        return self.bvh.occluded(origins, directions, max_distances)
+
+    def get_face(self, face):
+        return MeshFace(self, face)
+
+    def get_face_normals(self, faces):
+        return self.face_normals[faces]
+
+
+# This function returns a Mesh with the vertices, faces and material of a Pyramid
+def pyramid_to_mesh(pyramid):
+    mesh = Mesh(np.array(pyramid.v_list, dtype=float), Pyramid.t_idx)
+    mesh.material = pyramid.material
+    return mesh
+
+
+# This function loads a Wavefront OBJ file into a Mesh. The file is read line by line, and only its vertices
+# ("v" lines) and faces ("f" lines) are used; faces with more than 3 corners are split into a fan of triangles.
+# Vertices and faces are collected into flat typed arrays, so no Python object is built per triangle.
+# The mesh's load_stats report the load time, the sizes and the memory footprint of the mesh.
+def load_obj(path, max_leaf_faces=MAX_LEAF_FACES):
+    start_time = time.perf_counter()
+    vertices = array('d')
+    faces = array('i')
+
+    with open(path) as file:
+        for line in file:
+            if line.startswith('v '):
+                vertices.extend(map(float, line.split()[1:4]))
+            elif line.startswith('f '):
+                # A corner is "v", "v/vt", "v//vn" or "v/vt/vn"; negative indices count back from the last vertex
+                vertex_count = len(vertices) // 3
+                corners = [int(token.split('/')[0]) for token in line.split()[1:]]
+                corners = [corner - 1 if corner > 0 else vertex_count + corner for corner in corners]
+                for i in range(1, len(corners) - 1):
+                    faces.extend((corners[0], corners[i], corners[i + 1]))
+
+    parse_time = time.perf_counter() - start_time
+    mesh = Mesh(np.frombuffer(vertices, dtype=float), np.frombuffer(faces, dtype=np.intc), max_leaf_faces)
+    mesh.load_stats = {
+        'seconds': time.perf_counter() - start_time,
+        'parse_seconds': parse_time,
+        'bvh_build_seconds': mesh.bvh.build_time,
+        'vertices': len(mesh.vertices),
+        'faces': len(mesh.faces),
+        'bvh_nodes': mesh.bvh.get_node_count(),
+        'bytes': mesh.get_memory_footprint(),
+    }
+    return mesh
@@ -0,0 +1,160 @@
+import time
+
+import numpy as np
+
+from helper_classes import *
+from camera import Camera
+from compiled_scene import compile_scene
+from hw3 import render_scene
+
+# The number of rays that are traced together as one packet
+PACKET_SIZE = 65536
+
+# The number of shadow rays traced so far, and the time spent tracing them
+shadow_ray_stats = {'rays': 0, 'seconds': 0.0}
+
+
+# This function returns the direction of the primary ray of every pixel, row by row, as a (height * width, 3) array.
+# The pixels are the same ones render_scene shoots its rays through. The directions come from the ray cache of
+# Camera, so they are read only.
+def get_primary_directions(camera, screen_size, dtype=float):
+    return Camera(camera).get_directions(screen_size).astype(dtype, copy=False)
+
+
+# This function returns the primary ray directions of the pixels in rows [top, bottom) and columns [left, right).
+# Only the tile's directions are computed, so a renderer that streams the image tile by tile (like
+# render_scene_to_file) never holds those of the whole image; renderers that trace the whole image look the tiles up
+# in get_primary_directions instead. They are computed in float64 and then converted to dtype, so float32
+# directions are as accurate as they can be.
+def get_tile_directions(camera, screen_size, top, bottom, left, right, dtype=float):
+    return Camera(camera).get_tile_directions(screen_size, top, bottom, left, right).astype(dtype, copy=False)
+
+
+# This function returns the primary ray directions of the pixels at the given rows and columns, from the ray cache
+# of Camera
+def get_pixel_directions(camera, screen_size, rows, columns):
+    return Camera(camera).get_pixel_directions(screen_size, rows, columns)
+
+
+# This function returns, for each point, whether an object lies between the point and the light
+def get_packet_is_in_shadow(compiled_scene, light, points):
+    light_directions = light.get_light_directions(points)
+    light_distances = light.get_distances_from_light(points)
+    start_time = time.perf_counter()
+    is_in_shadow = compiled_scene.occluded(points, light_directions, light_distances)
+    shadow_ray_stats['seconds'] += time.perf_counter() - start_time
+    shadow_ray_stats['rays'] += len(points)
+    return is_in_shadow
+
+
+# This function returns the number of shadow rays traced since the last reset, and their rays per second
+def get_shadow_ray_stats():
+    seconds = shadow_ray_stats['seconds']
+    return {
+        'rays': shadow_ray_stats['rays'],
+        'seconds': seconds,
+        'rays_per_second': shadow_ray_stats['rays'] / seconds if seconds else 0.0,
+    }
+
+
+def reset_shadow_ray_stats():
+    shadow_ray_stats.update({'rays': 0, 'seconds': 0.0})
+
+
+# This function computes the local (non reflected) color of every hit point, the same way get_color does
+def get_packet_local_colors(scene, compiled_scene, ids, points, normals, directions):
+    materials = compiled_scene.materials
+    colors = np.zeros_like(points)
+    is_in_shadow = np.ones(len(points), dtype=bool)
+    diffuse = materials['diffuse'][ids]
+    specular = materials['specular'][ids]
+    shininess = materials['shininess'][ids]
+
+    for light in scene["lights"]:
+        is_in_shadow = get_packet_is_in_shadow(compiled_scene, light, points)
+        light_directions = light.get_light_directions(points)
+        intensities = light.get_intensities(points)
+        diffuse_light = diffuse * intensities * np.einsum('ij,ij->i', light_directions, normals)[:, np.newaxis]
+        reflections = reflected_rows(-light_directions, normals)
+        specular_light = (specular * intensities *
+                          (np.einsum('ij,ij->i', reflections, -directions) ** shininess)[:, np.newaxis])
+        colors += (diffuse_light + specular_light) * (1 - is_in_shadow)[:, np.newaxis]
+
+    # Like get_color, the ambient light depends on whether the point is in the shadow of the last light
+    lit = ~is_in_shadow
+    colors[lit] += scene["ambient"] * materials['ambient'][ids[lit]]
+    return colors
+
+
+# This function finds the nearest hit of every ray of the packet and shades it with shade, a function that takes
+# the arguments of get_packet_local_colors.
+# It returns which rays hit something, and for those rays the hit primitive IDs, points, normals and local colors.
+def trace_packet(scene, compiled_scene, origins, directions, shade=get_packet_local_colors):
+    faces = np.zeros(len(origins), dtype=int)
+    ids, distances = compiled_scene.nearest_intersection(origins, directions, faces)
+    hit = ids >= 0
+    ids, distances = ids[hit], distances[hit]
+    points = origins[hit] + distances[:, np.newaxis] * directions[hit]
+    normals = compiled_scene.get_normals(ids, points, faces[hit])
+    local_colors = shade(scene, compiled_scene, ids, points, normals, directions[hit])
+    return hit, ids, points, normals, local_colors
+
+
+# This function traces a packet of rays through the scene and returns their colors.
+# Instead of recursing like get_color, each reflection depth is traced as one packet, and the contribution of the
+# deeper rays is scaled by the product of the reflection coefficients along their path.
+# If primary_ids is given, the ID of the primitive each ray hits first (-1 for none) is written into it.
+# The colors have the dtype of directions. shade computes the local colors of the hits (see trace_packet).
+def get_packet_colors(scene, compiled_scene, origins, directions, max_depth, primary_ids=None,
+                      shade=get_packet_local_colors):
+    colors = np.zeros(origins.shape, dtype=directions.dtype)
+    weights = np.ones((len(origins), 1), dtype=directions.dtype)
+    ray_indices = np.arange(len(origins))
+    depth = 1
+
+    while len(ray_indices):
+        hit, ids, points, normals, local_colors = trace_packet(scene, compiled_scene, origins, directions, shade)
+        directions, weights, ray_indices = directions[hit], weights[hit], ray_indices[hit]
+        colors[ray_indices] += weights * local_colors
+        if depth == 1 and primary_ids is not None:
+            primary_ids[:] = -1
+            primary_ids[ray_indices] = ids
+
+        if depth + 1 > max_depth:
+            break
+        weights = weights * compiled_scene.materials['reflection'][ids][:, np.newaxis]
+        origins, directions = points, reflected_rows(directions, normals)
+        depth += 1
+
+    return colors
+
+
+# This function renders the same image as render_scene, but traces the rays in packets of up to packet_size rays.
+# dtype is the precision of the whole pipeline: the rays, the compiled scene, the intersection kernels, the shading
+# and the image. float32 halves the memory the rays and the image take, and the rays leave surfaces by
+# float32_epsilon instead of epsilon so float32 rounding does not make surfaces shadow themselves.
+# shade computes the local colors of the hits (see trace_packet).
+def render_scene_packet(camera, ambient, lights, objects, screen_size, max_depth, packet_size=PACKET_SIZE,
+                        dtype=float, shade=get_packet_local_colors):
+    width, height = screen_size
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    compiled_scene = compile_scene(objects, dtype)
+
+    directions = get_primary_directions(camera, screen_size, dtype)
+    origins = np.broadcast_to(np.asarray(camera, dtype=dtype), directions.shape)
+    image = np.zeros((height * width, 3), dtype=dtype)
+    for start in range(0, len(directions), packet_size):
+        end = start + packet_size
+        image[start:end] = get_packet_colors(scene, compiled_scene, origins[start:end], directions[start:end],
+                                             max_depth, shade=shade)
+
+    # We clip the values between 0 and 1 so all pixel values will make sense.
+    return np.clip(image, 0, 1).reshape(height, width, 3)
+
+
+# This function renders the scene with both render_scene and render_scene_packet.
+# It returns the largest difference between two matching pixel values, which should be within a small tolerance.
+def get_difference_from_reference(camera, ambient, lights, objects, screen_size, max_depth):
+    reference = render_scene(camera, ambient, lights, objects, screen_size, max_depth)
+    image = render_scene_packet(camera, ambient, lights, objects, screen_size, max_depth)
+    return np.max(np.abs(reference - image))
@@ -0,0 +1,103 @@
+import os
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from helper_classes import *
+from hw3 import get_pixel_color, get_pixel_rays
+from compiled_scene import compile_scene
+from packet_tracer import get_packet_colors, get_primary_directions
+
+# The default width and height of a tile, in pixels
+TILE_SIZE = 64
+
+# The state of a worker process, set once by init_worker when the process starts
+worker_state = {}
+
+
+# This function returns the tiles of the image, as (top, bottom, left, right) pixel ranges
+def get_tiles(screen_size, tile_size):
+    width, height = screen_size
+    return [(top, min(top + tile_size, height), left, min(left + tile_size, width))
+            for top in range(0, height, tile_size)
+            for left in range(0, width, tile_size)]
+
+
+# This function runs once in every worker process. The scene arrives here only once per worker, and the
+# framebuffer is attached from shared memory so the tiles are written straight into it.
+def init_worker(shared_memory_name, shape, camera, ambient, lights, objects, screen_size, max_depth, engine):
+    shared_memory = SharedMemory(name=shared_memory_name)
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    worker_state.update({
+        'shared_memory': shared_memory,
+        'image': np.ndarray(shape, dtype=float, buffer=shared_memory.buf),
+        'camera': camera,
+        'scene': scene,
+        'screen_size': screen_size,
+        'max_depth': max_depth,
+        'engine': engine,
+    })
+    if engine == 'packet':
+        worker_state['compiled_scene'] = compile_scene(objects)
+
+
+# This function renders one tile with the scalar path, through the same rays and pixel colors as render_scene
+def render_tile_scalar(top, bottom, left, right):
+    tile = np.zeros((bottom - top, right - left, 3))
+    for i, j, ray in get_pixel_rays(worker_state['camera'], worker_state['screen_size'], top, bottom, left, right):
+        tile[i - top, j - left] = get_pixel_color(worker_state['scene'], ray, worker_state['max_depth'])
+    return tile
+
+
+# This function renders one tile as a single packet of rays
+def render_tile_packet(top, bottom, left, right):
+    camera = worker_state['camera']
+    width, height = worker_state['screen_size']
+    # The worker computes the directions of the whole image once, and every tile it renders looks up its own
+    directions = get_primary_directions(camera, worker_state['screen_size']).reshape(height, width, 3)
+    directions = directions[top:bottom, left:right].reshape(-1, 3)
+    origins = np.broadcast_to(np.asarray(camera, dtype=float), directions.shape)
+    colors = get_packet_colors(worker_state['scene'], worker_state['compiled_scene'], origins, directions,
+                               worker_state['max_depth'])
+    return colors.reshape(bottom - top, right - left, 3)
+
+
+TILE_RENDERERS = {
+    'scalar': render_tile_scalar,
+    'packet': render_tile_packet,
+}
+
+
+# This function renders a tile in a worker, and writes it into the shared framebuffer.
+# Only the tile's coordinates go back to the main process.
+def render_tile(tile):
+    top, bottom, left, right = tile
+    colors = TILE_RENDERERS[worker_state['engine']](top, bottom, left, right)
+    # We clip the values between 0 and 1 so all pixel values will make sense.
+    worker_state['image'][top:bottom, left:right] = np.clip(colors, 0, 1)
+    return tile
+
+
+# This function renders the same image as render_scene, split into tiles of tile_size x tile_size pixels that are
+# rendered by a pool of worker processes (one per core by default). engine selects how the workers trace their
+# tiles: 'scalar' for the per-pixel path of render_scene, or 'packet' for render_scene_packet's batched path.
+def render_scene_parallel(camera, ambient, lights, objects, screen_size, max_depth, tile_size=TILE_SIZE,
+                          workers=None, engine='packet'):
+    if engine not in TILE_RENDERERS:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {list(TILE_RENDERERS)}")
+    width, height = screen_size
+    shape = (height, width, 3)
+    workers = workers or os.cpu_count()
+
+    shared_memory = SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(float).itemsize)
+    try:
+        initargs = (shared_memory.name, shape, camera, ambient, lights, objects, screen_size, max_depth, engine)
+        with Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+            for _ in pool.imap_unordered(render_tile, get_tiles(screen_size, tile_size)):
+                pass
+        image = np.ndarray(shape, dtype=float, buffer=shared_memory.buf).copy()
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+    return image
@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+
+from helper_classes import *
+from compiled_scene import compile_scene
+from packet_tracer import PACKET_SIZE, get_packet_colors, get_pixel_directions
+
+# The pixel strides of the passes: a 1/8 resolution pass first, then each pass doubles the resolution
+STRIDES = (8, 4, 2, 1)
+
+
+# This function renders the scene progressively, and yields a full size image after every pass.
+# The pass with stride s traces the pixels whose row and column are multiples of s, and every other pixel shows
+# the traced sample above and to its left. Pixels traced by an earlier pass are reused and never traced again,
+# so the whole sequence costs the same rays as one full render.
+# The caller can stop iterating at any pass. If deadline (a time.perf_counter() value) is given, the generator
+# stops before yielding a pass that did not finish in time.
+def render_scene_progressive(camera, ambient, lights, objects, screen_size, max_depth, strides=STRIDES,
+                             deadline=None, packet_size=PACKET_SIZE):
+    width, height = screen_size
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    compiled_scene = compile_scene(objects)
+    origin = np.asarray(camera, dtype=float)
+
+    samples = np.zeros((height, width, 3))
+    traced = np.zeros((height, width), dtype=bool)
+    rows, columns = np.indices((height, width))
+
+    for stride in strides:
+        pass_pixels = (rows % stride == 0) & (columns % stride == 0) & ~traced
+        pass_rows, pass_columns = rows[pass_pixels], columns[pass_pixels]
+        directions = get_pixel_directions(camera, screen_size, pass_rows, pass_columns)
+        origins = np.broadcast_to(origin, directions.shape)
+
+        for start in range(0, len(directions), packet_size):
+            if deadline is not None and time.perf_counter() > deadline:
+                return
+            end = start + packet_size
+            colors = get_packet_colors(scene, compiled_scene, origins[start:end], directions[start:end], max_depth)
+            # We clip the values between 0 and 1 so all pixel values will make sense.
+            samples[pass_rows[start:end], pass_columns[start:end]] = np.clip(colors, 0, 1)
+        traced |= pass_pixels
+
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+        yield samples[(rows // stride) * stride, (columns // stride) * stride]
+
+
+# This function returns the best image the progressive renderer finishes within the given number of seconds,
+# or None if not even the first pass finishes in time
+def render_scene_within(camera, ambient, lights, objects, screen_size, max_depth, seconds, strides=STRIDES):
+    deadline = time.perf_counter() + seconds
+    image = None
+    for image in render_scene_progressive(camera, ambient, lights, objects, screen_size, max_depth, strides,
+                                          deadline):
+        pass
+    return image
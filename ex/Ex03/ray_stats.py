@@ -0,0 +1,205 @@
+import copy
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from helper_classes import *
+from hw3 import compute_diffuse_light, compute_specular_light, get_ambient_light, get_pixel_rays
+
+
+# What a render traced: the rays it cast and the seconds its shadow rays took, the intersection tests of every type
+# of object, the bounding volume tests of composite objects and how many rays they rejected, and the cost of every
+# pixel (its intersection tests and seconds, including those of its reflection and shadow rays).
+class RayStats:
+    def __init__(self):
+        self.reset((0, 0))
+
+    # This function clears the counts, for a render of the given size
+    def reset(self, screen_size):
+        width, height = screen_size
+        self.primary_rays = 0
+        self.reflection_rays = 0
+        self.shadow_rays = 0
+        self.shadow_seconds = 0.0
+        self.intersection_tests = {}
+        self.tests = 0
+        self.bounds_tests = 0
+        self.bounds_rejections = 0
+        self.pixel_tests = np.zeros((height, width), dtype=int)
+        self.pixel_seconds = np.zeros((height, width))
+
+    # This function returns the number of rays of every type
+    def get_ray_counts(self):
+        return {
+            'primary': self.primary_rays,
+            'reflection': self.reflection_rays,
+            'shadow': self.shadow_rays,
+        }
+
+    # This function returns the number of shadow rays, the seconds their occlusion queries took and their rays per
+    # second, like get_shadow_ray_stats of packet_tracer.py does for the packet engine
+    def get_shadow_ray_stats(self):
+        return {
+            'rays': self.shadow_rays,
+            'seconds': self.shadow_seconds,
+            'rays_per_second': self.shadow_rays / self.shadow_seconds if self.shadow_seconds else 0.0,
+        }
+
+    def count_test(self, obj):
+        name = type(obj).__name__
+        self.intersection_tests[name] = self.intersection_tests.get(name, 0) + 1
+        self.tests += 1
+
+    # This function returns the fraction of the bounding volume tests that rejected the ray
+    def get_rejection_rate(self):
+        return self.bounds_rejections / self.bounds_tests if self.bounds_tests else 0.0
+
+    # This function returns the cost of every pixel ('tests' or 'seconds') as an RGB image, scaled so the most
+    # expensive pixel has the brightest color of the colormap
+    def get_heatmap(self, metric='tests', colormap='inferno'):
+        costs = self.pixel_tests if metric == 'tests' else self.pixel_seconds
+        highest = costs.max() if costs.size else 0
+        return plt.get_cmap(colormap)(costs / highest if highest else costs * 0.0)[:, :, :3]
+
+    # This function returns a table of the rays and the intersection tests
+    def get_summary(self):
+        rows = [('rays', 'count')]
+        rows.extend((f'{name} rays', count) for name, count in self.get_ray_counts().items())
+        rows.append(('shadow rays per second', f"{self.get_shadow_ray_stats()['rays_per_second']:,.0f}"))
+        rows.append(('intersection tests', self.tests))
+        rows.extend((f'  {name}', count) for name, count in
+                    sorted(self.intersection_tests.items(), key=lambda item: -item[1]))
+        rows.append(('bounding volume tests', self.bounds_tests))
+        rows.append(('  rejected', f'{self.bounds_rejections} ({self.get_rejection_rate():.1%})'))
+        if self.pixel_tests.size:
+            rows.append(('tests per pixel (mean)', f'{self.pixel_tests.mean():.1f}'))
+            rows.append(('tests per pixel (max)', self.pixel_tests.max()))
+            rows.append(('seconds per pixel (max)', f'{self.pixel_seconds.max():.6f}'))
+        width = max(len(name) for name, _ in rows)
+        return '\n'.join(f'{name:<{width}}  {count:>12}' for name, count in rows)
+
+
+# A stand-in for a simple object of the scene, which counts its intersection tests into stats and otherwise
+# behaves like the object
+class CountedObject:
+    def __init__(self, obj, stats):
+        self.object = obj
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.object, name)
+
+    def intersect(self, ray):
+        self.stats.count_test(self.object)
+        return self.object.intersect(ray)
+
+    # Object3D.is_occluding calls the object's own intersect, so an occlusion test is counted once
+    def is_occluding(self, ray, max_distance):
+        self.stats.count_test(self.object)
+        return self.object.is_occluding(ray, max_distance)
+
+
+# This function returns a method of a counted object that counts a test of obj into stats, and then calls method
+def count_tests(stats, obj, method):
+    def counted_method(*arguments):
+        stats.count_test(obj)
+        return method(*arguments)
+    return counted_method
+
+
+# This function returns a hits_bounds that counts the bounding volume tests, and the rays they reject, into stats
+def count_bounds_tests(stats, hits_bounds):
+    def counted_hits_bounds(ray, max_t=np.inf):
+        hit = hits_bounds(ray, max_t)
+        stats.bounds_tests += 1
+        stats.bounds_rejections += not hit
+        return hit
+    return counted_hits_bounds
+
+
+# This function returns a copy of an object of the scene that counts its intersection tests into stats, and those of
+# the primitives it is made of: composite objects, and structures over primitives (like BVH and UniformGrid), are
+# shallow copies whose primitives are counted. The object itself is not changed, so other renders of it (in other
+# threads, or without stats) count nothing and run none of the counting.
+def get_counted_object(obj, stats):
+    if isinstance(obj, CompositeObject3D):
+        counted = copy.copy(obj)
+        primitives = [get_counted_object(primitive, stats) for primitive in obj.get_primitives()]
+        counted.get_primitives = lambda: primitives
+        counted.hits_bounds = count_bounds_tests(stats, counted.hits_bounds)
+    elif isinstance(getattr(obj, 'primitives', None), list):
+        counted = copy.copy(obj)
+        counted.primitives = [get_counted_object(primitive, stats) for primitive in obj.primitives]
+        # The mailboxes of a grid are written by every ray, so the copy has its own
+        if hasattr(obj, 'mailboxes'):
+            counted.mailboxes = list(obj.mailboxes)
+    else:
+        return CountedObject(obj, stats)
+    counted.intersect = count_tests(stats, obj, counted.intersect)
+    counted.is_occluding = count_tests(stats, obj, counted.is_occluding)
+    return counted
+
+
+# This function returns the color seen along the ray, like get_color of hw3.py, and counts the shadow and reflection
+# rays it casts, and the seconds of the shadow rays' occlusion queries, into stats. Only render_scene_with_stats calls
+# it, so get_color itself counts nothing.
+def get_counted_color(scene, ray, depth, max_depth, stats, hit=None):
+    color = np.zeros(3)
+    is_in_shadow = True
+    if hit is None:
+        hit = ray.nearest_hit(scene["objects"])
+
+    if hit is None:
+        return color
+
+    for light in scene["lights"]:
+        light_ray = light.get_light_ray(hit.point)
+        start_time = time.perf_counter()
+        is_in_shadow = light_ray.is_occluded(scene["objects"], light.get_distance_from_light(hit.point))
+        stats.shadow_seconds += time.perf_counter() - start_time
+        stats.shadow_rays += 1
+        if is_in_shadow:
+            continue
+        intensity = light.get_intensity(hit.point)
+        color += compute_diffuse_light(hit.material, hit.normal, light_ray.direction, intensity)
+        color += compute_specular_light(hit.material, hit.normal, light_ray.direction, intensity, -ray.direction)
+
+    if not is_in_shadow:
+        color += get_ambient_light(scene["ambient"], hit.material)
+
+    if depth + 1 > max_depth:
+        return color
+
+    reflected_ray = Ray(hit.point, normalize(reflected(ray.direction, hit.normal)))
+    stats.reflection_rays += 1
+    reflected_color = get_counted_color(scene, reflected_ray, depth + 1, max_depth, stats)
+    color += hit.material['reflection'] * reflected_color
+
+    return color
+
+
+# This function renders the same image as render_scene, and counts its rays and intersection tests into stats.
+# The rays are counted by get_counted_color, and the intersection tests by counted copies of the objects (see
+# get_counted_object), so nothing outside this render is changed while it runs.
+def render_scene_with_stats(camera, ambient, lights, objects, screen_size, max_depth, stats):
+    width, height = screen_size
+    image = np.zeros((height, width, 3))
+    counted_objects = [get_counted_object(obj, stats) for obj in objects]
+    scene = {"objects": counted_objects, "ambient": ambient, "lights": lights}
+    stats.reset(screen_size)
+
+    for i, j, ray in get_pixel_rays(camera, screen_size):
+        tests = stats.tests
+        start_time = time.perf_counter()
+        stats.primary_rays += 1
+        color = np.zeros(3)
+        hit = ray.nearest_hit(counted_objects)
+        if hit is not None:
+            color += get_counted_color(scene, ray, 1, max_depth, stats, hit)
+        # We clip the values between 0 and 1, like get_pixel_color
+        image[i, j] = np.clip(color, 0, 1)
+        stats.pixel_seconds[i, j] = time.perf_counter() - start_time
+        stats.pixel_tests[i, j] = stats.tests - tests
+
+    return image
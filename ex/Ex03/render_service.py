@@ -0,0 +1,533 @@
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from helper_classes import *
+from benchmark import ENGINES
+from scene_file import get_content_hash, make_light, make_object
+
+# The address the service listens on. It only listens on this machine unless another host is given.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# A job that does not give its resolution is rendered at this one; larger resolutions are refused
+DEFAULT_RESOLUTION = (256, 256)
+MAX_RESOLUTION = 4096
+
+# The number of finished images kept, the least recently used ones are dropped first
+RESULT_CACHE_SIZE = 64
+
+# The number of finished jobs whose status (and image) can still be asked for
+JOB_HISTORY = 1000
+
+# Throughput is measured over the jobs finished in the last THROUGHPUT_WINDOW seconds, and the latency percentiles
+# over the last LATENCY_HISTORY jobs
+THROUGHPUT_WINDOW = 60.0
+LATENCY_HISTORY = 1000
+
+# Requests with a larger body are refused
+MAX_REQUEST_BYTES = 64 * 2 ** 20
+
+# The fields of every type of light, object and material of a scene file, with the shape of their values: () is a
+# number, (3,) a vector, (5, 3) five vectors, and str a string
+LIGHT_FIELDS = {
+    'directional': {'intensity': (3,), 'direction': (3,)},
+    'point': {'intensity': (3,), 'position': (3,), 'kc': (), 'kl': (), 'kq': ()},
+    'spot': {'intensity': (3,), 'position': (3,), 'direction': (3,), 'kc': (), 'kl': (), 'kq': ()},
+}
+OBJECT_FIELDS = {
+    'sphere': {'center': (3,), 'radius': ()},
+    'plane': {'normal': (3,), 'point': (3,)},
+    'triangle': {'vertices': (3, 3)},
+    'pyramid': {'vertices': (5, 3)},
+    'mesh': {'path': str},
+}
+MATERIAL_FIELDS = {'ambient': (3,), 'diffuse': (3,), 'specular': (3,), 'shininess': (), 'reflection': ()}
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+# This function runs in a worker process. It makes the scene of a scene file description (see scene_file.py; mesh
+# paths are relative to directory), renders it, and returns the image as a PNG file and the seconds it took.
+def render_job(description, resolution, max_depth, engine, directory):
+    start_time = time.perf_counter()
+    materials = description.get('materials', {})
+    objects = [make_object(obj, index, materials, directory) for index, obj in enumerate(description['objects'])]
+    lights = [make_light(light) for light in description['lights']]
+    camera = np.array(description['camera'], dtype=float)
+    ambient = np.array(description.get('ambient', [0, 0, 0]), dtype=float)
+    image = ENGINES[engine](camera, ambient, lights, objects, tuple(resolution), max_depth)
+
+    buffer = io.BytesIO()
+    plt.imsave(buffer, np.clip(image, 0, 1), format='png')
+    return buffer.getvalue(), time.perf_counter() - start_time
+
+
+# This function returns whether a value of a request is an integer. JSON's true and false arrive as bools, which
+# are ints in Python, so they are excluded.
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# This function returns whether a value of a request is a number, or nested lists of numbers of the given shape
+def has_shape(value, shape):
+    if not shape:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return (isinstance(value, list) and len(value) == shape[0] and
+            all(has_shape(item, shape[1:]) for item in value))
+
+
+# This function checks that an entry of a scene (named name in the errors) has all the given fields, of the right
+# shapes
+def check_fields(entry, fields, name):
+    for field, shape in fields.items():
+        if field not in entry:
+            raise ValueError(f'{name} has no "{field}"')
+        if not (isinstance(entry[field], str) if shape is str else has_shape(entry[field], shape)):
+            kind = 'a string' if shape is str else 'a number' if not shape else f'an array of shape {list(shape)}'
+            raise ValueError(f'"{field}" of {name} must be {kind}')
+
+
+# This function checks that a light or an object of a scene is a JSON object of a known type, with the fields of
+# its type, and returns its type
+def check_entry(entry, types, name):
+    if not isinstance(entry, dict) or entry.get('type') not in types:
+        raise ValueError(f'{name} must be an object whose "type" is one of {sorted(types)}')
+    check_fields(entry, types[entry['type']], name)
+    return entry['type']
+
+
+# This function checks a job's scene description, so a malformed scene is refused when the job is submitted
+# instead of failing in a worker
+def check_scene(scene):
+    for key in ('camera', 'lights', 'objects'):
+        if key not in scene:
+            raise ValueError(f'The scene has no "{key}"')
+    check_fields(scene, {'camera': (3,)}, 'the scene')
+    if 'ambient' in scene:
+        check_fields(scene, {'ambient': (3,)}, 'the scene')
+    materials = scene.get('materials', {})
+    if not isinstance(materials, dict):
+        raise ValueError('"materials" must map names to materials')
+    for name, material in materials.items():
+        if not isinstance(material, dict):
+            raise ValueError(f'material {name!r} must be an object')
+        check_fields(material, MATERIAL_FIELDS, f'material {name!r}')
+    for key in ('lights', 'objects'):
+        if not isinstance(scene[key], list):
+            raise ValueError(f'"{key}" must be an array')
+
+    for index, light in enumerate(scene['lights']):
+        check_entry(light, LIGHT_FIELDS, f'lights[{index}]')
+    for index, obj in enumerate(scene['objects']):
+        check_entry(obj, OBJECT_FIELDS, f'objects[{index}]')
+        material = obj.get('material')
+        if isinstance(material, str):
+            if material not in materials:
+                raise ValueError(f'objects[{index}] has an unknown material {material!r}')
+        elif isinstance(material, dict):
+            check_fields(material, MATERIAL_FIELDS, f'the material of objects[{index}]')
+        else:
+            raise ValueError(f'"material" of objects[{index}] must be the name of a material or a material')
+
+
+# This function checks that the meshes of a scene are inside the scene directory, so a job cannot read any other
+# file: absolute paths, and paths that leave the directory (with .. or through a symbolic link), are refused
+def check_mesh_paths(scene, directory):
+    directory = os.path.realpath(directory)
+    for index, obj in enumerate(scene['objects']):
+        if obj['type'] != 'mesh':
+            continue
+        path = os.path.realpath(os.path.join(directory, obj['path']))
+        if os.path.commonpath([directory, path]) != directory:
+            raise ValueError(f'The mesh of objects[{index}] is outside the scene directory')
+
+
+# This function checks the body of a job request and returns the job's scene description, resolution, max_depth,
+# engine and priority
+def parse_job_request(body):
+    request = json.loads(body)
+    if not isinstance(request, dict) or not isinstance(request.get('scene'), dict):
+        raise ValueError('A job needs a "scene": a scene file description (see scene_file.py)')
+    scene = request['scene']
+    check_scene(scene)
+
+    resolution = request.get('resolution', DEFAULT_RESOLUTION)
+    if (not isinstance(resolution, (list, tuple)) or len(resolution) != 2 or
+            not all(is_integer(size) and 0 < size <= MAX_RESOLUTION for size in resolution)):
+        raise ValueError(f'"resolution" must be [width, height], each between 1 and {MAX_RESOLUTION}')
+    max_depth = request.get('max_depth', scene.get('max_depth', 1))
+    if not is_integer(max_depth) or max_depth < 1:
+        raise ValueError('"max_depth" must be a positive integer')
+    engine = request.get('engine', 'packet')
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine {engine!r}, expected one of {sorted(ENGINES)}')
+    priority = request.get('priority', 0)
+    if not is_integer(priority):
+        raise ValueError('"priority" must be an integer')
+    return scene, tuple(resolution), max_depth, engine, priority
+
+
+class RenderJob:
+    def __init__(self, job_id, key, scene, resolution, max_depth, engine, priority):
+        self.id = job_id
+        self.key = key
+        # The scene is dropped once the job is finished
+        self.scene = scene
+        self.resolution = resolution
+        self.max_depth = max_depth
+        self.engine = engine
+        self.priority = priority
+        self.status = 'queued'
+        self.cached = False
+        self.error = None
+        self.image = None
+        self.submit_time = time.perf_counter()
+        self.start_time = None
+        self.finish_time = None
+        self.render_seconds = None
+        self.finished = asyncio.Event()
+
+    # This function returns the job's status as sent to clients
+    def describe(self):
+        description = {
+            'id': self.id,
+            'key': self.key,
+            'status': self.status,
+            'priority': self.priority,
+            'resolution': list(self.resolution),
+            'max_depth': self.max_depth,
+            'engine': self.engine,
+            'cached': self.cached,
+        }
+        if self.start_time is not None:
+            description['wait_seconds'] = self.start_time - self.submit_time
+        if self.finish_time is not None:
+            description['render_seconds'] = self.render_seconds
+            description['latency_seconds'] = self.finish_time - self.submit_time
+        if self.error is not None:
+            description['error'] = self.error
+        return description
+
+
+# A render service: clients submit render jobs over HTTP, and the service renders them in a pool of worker
+# processes, the jobs of the lowest priority number first (and jobs of the same priority in the order they came).
+# The images are kept by a hash of the scene (with the mesh files it uses) and the job's parameters, so a job that
+# was already rendered finishes at once, and a job whose render is still queued or running waits for that render.
+# The API (all bodies are JSON, except images):
+#     POST /jobs              submit a job: {"scene": {...}, "resolution": [w, h], "max_depth": 3, "priority": 0,
+#                             "engine": "packet"}; everything but the scene is optional. Returns the job.
+#     GET  /jobs              the status of all the jobs the service remembers
+#     GET  /jobs/<id>         the status of a job, with its wait, render and total seconds once it has them
+#     GET  /jobs/<id>/image   the job's image as a PNG file; waits for the job to finish
+#     GET  /stats             queue depth, running jobs, throughput, latencies and cache use (see get_stats)
+class RenderService:
+    def __init__(self, workers=None, scene_directory='.', cache_size=RESULT_CACHE_SIZE):
+        self.workers = workers or os.cpu_count()
+        self.scene_directory = os.path.abspath(scene_directory)
+        self.cache_size = cache_size
+        # The PNG files of the finished renders by their key, the least recently used first
+        self.results = OrderedDict()
+        self.jobs = {}
+        self.finished_jobs = deque()
+        # The jobs waiting for the render of every queued or running key
+        self.waiting = {}
+        self.job_numbers = itertools.count(1)
+        self.submit_numbers = itertools.count()
+        self.queue = None
+        self.executor = None
+        self.dispatchers = []
+        self.server = None
+        self.running = 0
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'cache_hits': 0, 'deduplicated': 0}
+        # The finish time and the pixels of every job finished in the last THROUGHPUT_WINDOW seconds
+        self.recent_jobs = deque()
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.start_time = time.perf_counter()
+
+    # This function starts the worker processes and the server, and returns the server
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.queue = asyncio.PriorityQueue()
+        # The pool starts its workers on the first job, once the server is listening. Forked workers would inherit
+        # the listening socket and the open connections, and a connection the service closed would stay open until
+        # the worker exits, so the workers are spawned as new processes instead (which import the script that
+        # started the service, so a script must start it under if __name__ == '__main__').
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        # There is one dispatcher per worker, and a dispatcher only takes the next job once its render is done, so
+        # the jobs wait in the priority queue instead of in the first come first served queue of the pool
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        self.start_time = time.perf_counter()
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        if self.executor is not None:
+            # Shutting the pool down waits for the renders that are running, so it is done off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, partial(self.executor.shutdown,
+                                                                           cancel_futures=True))
+
+    # This function adds a job, and returns it. A job whose image is cached is finished at once, and a job whose
+    # key is already queued or running waits for that render instead of being queued again.
+    async def submit(self, scene, resolution, max_depth, engine='packet', priority=0):
+        check_mesh_paths(scene, self.scene_directory)
+        parameters = json.dumps({'scene': scene, 'resolution': resolution, 'max_depth': max_depth, 'engine': engine},
+                                sort_keys=True)
+        try:
+            # Hashing reads the mesh files of the scene, so it is done off the event loop
+            key = await asyncio.get_running_loop().run_in_executor(
+                None, get_content_hash, parameters.encode(), scene, self.scene_directory)
+        except OSError as error:
+            raise ValueError(f'Cannot read a mesh of the scene: {error}')
+
+        job = RenderJob(str(next(self.job_numbers)), key, scene, resolution, max_depth, engine, priority)
+        self.jobs[job.id] = job
+        self.counters['submitted'] += 1
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.counters['cache_hits'] += 1
+            job.cached = True
+            job.start_time = job.submit_time
+            self.finish_job(job, self.results[key], 0.0)
+        elif key in self.waiting:
+            self.counters['deduplicated'] += 1
+            jobs = self.waiting[key]
+            job.status = jobs[0].status
+            if jobs[0].start_time is not None:
+                # The render may have started before this job came, but this job did not wait for it
+                job.start_time = max(jobs[0].start_time, job.submit_time)
+            elif priority < min(waiting_job.priority for waiting_job in jobs):
+                # A more urgent job joins a queued render: the render is queued again with the job's priority, and
+                # the dispatcher skips the entry it leaves behind
+                self.queue.put_nowait((priority, next(self.submit_numbers), key))
+            jobs.append(job)
+        else:
+            self.waiting[key] = [job]
+            self.queue.put_nowait((priority, next(self.submit_numbers), key))
+        return job
+
+    # This function returns the number of renders waiting for a worker. A render queued again with a more urgent
+    # priority leaves a stale entry in the queue, so the queue's size is not the queue depth.
+    def get_queue_depth(self):
+        return sum(1 for jobs in self.waiting.values() if jobs[0].status == 'queued')
+
+    # This function renders the queued keys one after the other, in one worker process
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, key = await self.queue.get()
+            if key not in self.waiting or self.waiting[key][0].status != 'queued':
+                continue
+            jobs = self.waiting[key]
+            job = jobs[0]
+            start_time = time.perf_counter()
+            for waiting_job in jobs:
+                waiting_job.status = 'running'
+                waiting_job.start_time = start_time
+            self.running += 1
+            try:
+                image, render_seconds = await loop.run_in_executor(
+                    self.executor, render_job, job.scene, job.resolution, job.max_depth, job.engine,
+                    self.scene_directory)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                image, render_seconds = None, None
+                job.error = f'{type(error).__name__}: {error}'
+            finally:
+                self.running -= 1
+
+            # Jobs may have joined the key while it was rendering
+            jobs = self.waiting.pop(key)
+            if image is not None:
+                self.results[key] = image
+                while len(self.results) > self.cache_size:
+                    self.results.popitem(last=False)
+            for waiting_job in jobs:
+                waiting_job.error = job.error
+                self.finish_job(waiting_job, image, render_seconds)
+
+    def finish_job(self, job, image, render_seconds):
+        job.finish_time = time.perf_counter()
+        job.render_seconds = render_seconds
+        job.image = image
+        job.scene = None
+        job.status = 'done' if image is not None else 'failed'
+        self.counters['completed' if image is not None else 'failed'] += 1
+        self.recent_jobs.append((job.finish_time, job.resolution[0] * job.resolution[1]))
+        self.latencies.append(job.finish_time - job.submit_time)
+        job.finished.set()
+
+        self.finished_jobs.append(job.id)
+        while len(self.finished_jobs) > JOB_HISTORY:
+            self.jobs.pop(self.finished_jobs.popleft(), None)
+
+    # This function returns the queue depth (the renders waiting for a worker), the running renders, the jobs and
+    # pixels finished per second over the last THROUGHPUT_WINDOW seconds, the latency (from submission to the
+    # finished image) of the last LATENCY_HISTORY jobs, and how the image cache was used
+    def get_stats(self):
+        now = time.perf_counter()
+        while self.recent_jobs and self.recent_jobs[0][0] < now - THROUGHPUT_WINDOW:
+            self.recent_jobs.popleft()
+        window = max(min(THROUGHPUT_WINDOW, now - self.start_time), 1e-9)
+        latencies = np.array(self.latencies)
+        return {
+            'queue_depth': self.get_queue_depth(),
+            'running': self.running,
+            'workers': self.workers,
+            **self.counters,
+            'cached_images': len(self.results),
+            'jobs_per_second': len(self.recent_jobs) / window,
+            'pixels_per_second': sum(pixels for _, pixels in self.recent_jobs) / window,
+            'latency_seconds': {
+                'mean': float(latencies.mean()) if len(latencies) else None,
+                'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+                'max': float(latencies.max()) if len(latencies) else None,
+            },
+            'uptime_seconds': now - self.start_time,
+        }
+
+    def get_job(self, job_id):
+        if job_id not in self.jobs:
+            raise LookupError(f'No job {job_id}')
+        return self.jobs[job_id]
+
+    # This function answers a request, and returns its status code, content type and body
+    async def route(self, method, path, body):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['jobs'] and method == 'POST':
+            job = await self.submit(*parse_job_request(body))
+            return 202, 'application/json', json.dumps(job.describe()).encode()
+        if method != 'GET':
+            return 405, 'application/json', json.dumps({'error': f'{method} is not allowed'}).encode()
+        if parts == ['stats']:
+            return 200, 'application/json', json.dumps(self.get_stats()).encode()
+        if parts == ['jobs']:
+            return 200, 'application/json', json.dumps([job.describe() for job in self.jobs.values()]).encode()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            return 200, 'application/json', json.dumps(self.get_job(parts[1]).describe()).encode()
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'image':
+            job = self.get_job(parts[1])
+            await job.finished.wait()
+            if job.image is None:
+                return 500, 'application/json', json.dumps(job.describe()).encode()
+            return 200, 'image/png', job.image
+        raise LookupError(f'No such resource: {path}')
+
+    # This function reads one HTTP request from a connection, answers it and closes the connection
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            if len(request_line) != 3:
+                raise ValueError('Malformed request line')
+            method, target, _ = request_line
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_REQUEST_BYTES:
+                status, content_type, payload = 413, 'application/json', json.dumps(
+                    {'error': f'The body is larger than {MAX_REQUEST_BYTES} bytes'}).encode()
+            else:
+                body = await reader.readexactly(length) if length else b''
+                status, content_type, payload = await self.route(method, urlsplit(target).path, body)
+        except ValueError as error:
+            status, content_type, payload = 400, 'application/json', json.dumps({'error': str(error)}).encode()
+        except LookupError as error:
+            status, content_type, payload = 404, 'application/json', json.dumps({'error': str(error)}).encode()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        except Exception as error:
+            status, content_type, payload = 500, 'application/json', json.dumps(
+                {'error': f'{type(error).__name__}: {error}'}).encode()
+
+        writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: {content_type}\r\n'
+                     f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+# This function sends a job to a running service, and returns the job's status. scene is a scene file description,
+# or the path of a scene file; a scene defined in Python can be described with scene_file.describe_scene.
+def submit_render(scene, resolution=DEFAULT_RESOLUTION, max_depth=None, priority=0, engine='packet',
+                  url=f'http://{DEFAULT_HOST}:{DEFAULT_PORT}'):
+    if isinstance(scene, str):
+        with open(scene) as file:
+            scene = json.load(file)
+    request = {'scene': scene, 'resolution': list(resolution), 'priority': priority, 'engine': engine}
+    if max_depth is not None:
+        request['max_depth'] = max_depth
+    http_request = urllib.request.Request(f'{url}/jobs', data=json.dumps(request).encode(), method='POST',
+                                          headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(http_request) as response:
+        return json.load(response)
+
+
+# This function waits for a job of a running service to finish, and returns its image
+def fetch_render(job_id, url=f'http://{DEFAULT_HOST}:{DEFAULT_PORT}'):
+    with urllib.request.urlopen(f'{url}/jobs/{job_id}/image') as response:
+        return plt.imread(io.BytesIO(response.read()), format='png')[:, :, :3]
+
+
+async def serve(host, port, workers, scene_directory, cache_size):
+    service = RenderService(workers, scene_directory, cache_size)
+    server = await service.start(host, port)
+    print(f'Rendering with {service.workers} workers on http://{host}:{port}')
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+# Run the service from the command line, e.g.
+#   python render_service.py --port 8765 --workers 4 --scene-directory scenes
+# and submit jobs with submit_render, or with any HTTP client:
+#   curl -X POST localhost:8765/jobs -d '{"scene": ..., "resolution": [512, 512]}'
+#   curl localhost:8765/jobs/1/image -o image.png
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Render scenes for clients over HTTP')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help='the worker processes (default: one per core)')
+    parser.add_argument('--scene-directory', default='.', help='the directory mesh paths are relative to')
+    parser.add_argument('--cache-size', type=int, default=RESULT_CACHE_SIZE, help='the finished images kept')
+    arguments = parser.parse_args(arguments)
+    try:
+        asyncio.run(serve(arguments.host, arguments.port, arguments.workers, arguments.scene_directory,
+                          arguments.cache_size))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
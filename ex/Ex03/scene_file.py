@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import time
+import zipfile
+from functools import partial
+
+import numpy as np
+
+from helper_classes import *
+from compiled_scene import CompiledScene, compile_scene, get_scene_primitives
+from mesh import Mesh, load_obj
+
+# Scene files are JSON files like this one:
+#   {
+#     "camera": [0, 0, 1],
+#     "ambient": [0.1, 0.1, 0.1],
+#     "max_depth": 3,
+#     "materials": {
+#       "red": {"ambient": [1, 0, 0], "diffuse": [1, 0, 0], "specular": [0.3, 0.3, 0.3], "shininess": 100,
+#               "reflection": 0.5}
+#     },
+#     "lights": [
+#       {"type": "directional", "intensity": [1, 1, 1], "direction": [-1, -1, -1]},
+#       {"type": "point", "intensity": [1, 1, 1], "position": [1, 1, 1], "kc": 0.1, "kl": 0.1, "kq": 0.1},
+#       {"type": "spot", "intensity": [1, 1, 1], "position": [0, 1, 0], "direction": [0, 0, -1],
+#        "kc": 0.1, "kl": 0.1, "kq": 0.1}
+#     ],
+#     "objects": [
+#       {"type": "sphere", "center": [0, 0, -1], "radius": 0.5, "material": "red"},
+#       {"type": "plane", "normal": [0, 1, 0], "point": [0, -1, 0], "material": {"ambient": ...}},
+#       {"type": "triangle", "vertices": [[-1, 0, -1], [1, 0, -1], [0, 1.5, -1.5]], "material": "red"},
+#       {"type": "pyramid", "vertices": [[...], [...], [...], [...], [...]], "material": "red"},
+#       {"type": "mesh", "path": "bunny.obj", "material": "red"}
+#     ]
+#   }
+# A material is the name of one of the scene's materials, or the material itself. Mesh paths are relative to the
+# scene file.
+
+# Bump this when the cached arrays change, so caches of older versions are not used
+CACHE_VERSION = 1
+
+# The directory, next to the scene file, that the caches of its compiled scene are kept in
+CACHE_DIRECTORY = '.scene_cache'
+
+# What the last load_scene did: whether the compiled scene came from the cache, and the seconds it took
+scene_cache_stats = {'cache_hit': False, 'seconds': 0.0}
+
+
+# This function returns a hash of the scene file and of the mesh files it uses
+def get_content_hash(text, description, directory):
+    digest = hashlib.sha1(f'version {CACHE_VERSION}\n'.encode())
+    digest.update(text)
+    for obj in description['objects']:
+        if obj['type'] == 'mesh':
+            with open(os.path.join(directory, obj['path']), 'rb') as file:
+                for block in iter(lambda: file.read(2 ** 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def make_light(light):
+    if light['type'] == 'directional':
+        return DirectionalLight(np.array(light['intensity']), np.array(light['direction']))
+    if light['type'] == 'point':
+        return PointLight(np.array(light['intensity']), np.array(light['position']), light['kc'], light['kl'],
+                          light['kq'])
+    if light['type'] == 'spot':
+        return SpotLight(np.array(light['intensity']), np.array(light['position']), np.array(light['direction']),
+                         light['kc'], light['kl'], light['kq'])
+    raise ValueError(f"Unknown light type: {light['type']}")
+
+
+# This function returns the object of an entry of the scene file's objects. A mesh is made of the cached arrays
+# (prefixed by the index of its entry) if they are given, and loaded from its file otherwise.
+def make_object(obj, index, materials, directory, arrays=None):
+    if obj['type'] == 'sphere':
+        result = Sphere(np.array(obj['center'], dtype=float), obj['radius'])
+    elif obj['type'] == 'plane':
+        result = Plane(np.array(obj['normal'], dtype=float), np.array(obj['point'], dtype=float))
+    elif obj['type'] == 'triangle':
+        result = Triangle(*np.array(obj['vertices'], dtype=float))
+    elif obj['type'] == 'pyramid':
+        result = Pyramid(np.array(obj['vertices'], dtype=float))
+    elif obj['type'] == 'mesh' and arrays is not None:
+        prefix = f'object{index}_'
+        bvh_arrays = {name[len(prefix) + len('bvh_'):]: array_ for name, array_ in arrays.items()
+                      if name.startswith(prefix + 'bvh_')}
+        result = Mesh(arrays[prefix + 'vertices'], arrays[prefix + 'faces'], bvh_arrays=bvh_arrays)
+    elif obj['type'] == 'mesh':
+        result = load_obj(os.path.join(directory, obj['path']))
+    else:
+        raise ValueError(f"Unknown object type: {obj['type']}")
+
+    material = obj['material']
+    if isinstance(material, str):
+        material = materials[material]
+    result.set_material(material['ambient'], material['diffuse'], material['specular'], material['shininess'],
+                        material['reflection'])
+    if isinstance(result, Pyramid):
+        result.apply_materials_to_triangles()
+    return result
+
+
+# This function returns the primitives of the objects of a scene file, in the order of get_scene_primitives. The
+# objects of made_objects (by the index of their entry) are used as they are, and the others are made.
+def make_scene_primitives(description, directory, made_objects):
+    materials = description.get('materials', {})
+    objects = [made_objects[index] if index in made_objects else make_object(obj, index, materials, directory)
+               for index, obj in enumerate(description['objects'])]
+    return get_scene_primitives(objects)
+
+
+# This function returns the arrays to cache for a scene: the packed arrays of its compiled scene, and the vertices,
+# faces and hierarchy of its meshes
+def get_cache_arrays(compiled_scene, objects):
+    arrays = compiled_scene.get_arrays()
+    for index, obj in enumerate(objects):
+        if isinstance(obj, Mesh):
+            arrays[f'object{index}_vertices'] = obj.vertices
+            arrays[f'object{index}_faces'] = obj.faces
+            arrays.update({f'object{index}_bvh_{name}': array_ for name, array_ in obj.bvh.get_arrays().items()})
+    return arrays
+
+
+# This function writes arrays into an uncompressed .npz file. It is written under another name first and then
+# renamed, so a reader never sees half a file.
+def save_npz(path, arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(temporary_path, path)
+
+
+# This function returns the arrays of an uncompressed .npz file, memory mapped instead of read.
+# np.load does not memory map the arrays of an .npz file, but an uncompressed .npz file is a zip of .npy files
+# stored as they are, so every array is mapped at the offset of its data inside the file.
+def load_npz_memmap(path):
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            # The data of a member follows its local header, whose name and extra field lengths are at offset 26
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(file.read(4), dtype='<u2')
+            file.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            if np.lib.format.read_magic(file) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-len('.npy')]
+            if not np.prod(shape):
+                arrays[name] = np.zeros(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays
+
+
+# This function loads a scene file, and returns its camera, ambient light, lights, objects and max_depth, in the
+# order render_scene takes them. The objects are one CompiledScene, which all the renderers accept.
+# The packed arrays of the compiled scene, and the vertices, faces and hierarchies of its meshes, are cached in a
+# .npz file named after the hash of the scene's content. Loading an unchanged scene again memory maps them from the
+# cache instead of making and packing the objects, reading the mesh files and building their hierarchies.
+def load_scene(path, cache_directory=None):
+    start_time = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, 'rb') as file:
+        text = file.read()
+    description = json.loads(text)
+    if cache_directory is None:
+        cache_directory = os.path.join(directory, CACHE_DIRECTORY)
+    cache_path = os.path.join(cache_directory, get_content_hash(text, description, directory) + '.npz')
+
+    arrays = load_npz_memmap(cache_path) if os.path.exists(cache_path) else None
+    materials = description.get('materials', {})
+    if arrays is None:
+        objects = [make_object(obj, index, materials, directory) for index, obj in enumerate(description['objects'])]
+        compiled_scene = compile_scene(objects)
+        save_npz(cache_path, get_cache_arrays(compiled_scene, objects))
+    else:
+        # The meshes are the only primitives the compiled scene keeps as objects, and they are made of their cached
+        # arrays. The other objects are only made if something asks the compiled scene for its primitives.
+        meshes = {index: make_object(obj, index, materials, directory, arrays)
+                  for index, obj in enumerate(description['objects']) if obj['type'] == 'mesh'}
+        compiled_scene = CompiledScene.from_arrays(arrays, list(meshes.values()),
+                                                   partial(make_scene_primitives, description, directory, meshes))
+
+    lights = [make_light(light) for light in description['lights']]
+    scene_cache_stats.update({'cache_hit': arrays is not None, 'seconds': time.perf_counter() - start_time})
+    return (np.array(description['camera'], dtype=float), np.array(description.get('ambient', [0, 0, 0]), dtype=float),
+            lights, [compiled_scene], description.get('max_depth', 1))
+
+
+# This function returns the scene file entry of a light
+def describe_light(light):
+    if isinstance(light, DirectionalLight):
+        return {'type': 'directional', 'intensity': np.asarray(light.intensity).tolist(),
+                'direction': np.asarray(light.direction).tolist()}
+    if isinstance(light, PointLight):
+        return {'type': 'point', 'intensity': np.asarray(light.intensity).tolist(),
+                'position': np.asarray(light.position).tolist(), 'kc': light.kc, 'kl': light.kl, 'kq': light.kq}
+    if isinstance(light, SpotLight):
+        return {'type': 'spot', 'intensity': np.asarray(light.intensity).tolist(),
+                'position': np.asarray(light.position).tolist(), 'direction': np.asarray(light.direction).tolist(),
+                'kc': light.kc, 'kl': light.kl, 'kq': light.kq}
+    raise ValueError(f'Lights of type {type(light).__name__} cannot be saved')
+
+
+# This function returns the scene file entry of an object
+def describe_object(obj):
+    if isinstance(obj, Sphere):
+        description = {'type': 'sphere', 'center': np.asarray(obj.center).tolist(), 'radius': float(obj.radius)}
+    elif isinstance(obj, Plane):
+        description = {'type': 'plane', 'normal': np.asarray(obj.normal).tolist(),
+                       'point': np.asarray(obj.point).tolist()}
+    elif isinstance(obj, Triangle):
+        description = {'type': 'triangle', 'vertices': np.array([obj.a, obj.b, obj.c]).tolist()}
+    elif isinstance(obj, Pyramid):
+        description = {'type': 'pyramid', 'vertices': np.asarray(obj.v_list).tolist()}
+    else:
+        raise ValueError(f'Objects of type {type(obj).__name__} cannot be saved')
+    description['material'] = {key: np.asarray(value).tolist() for key, value in obj.material.items()}
+    return description
+
+
+# This function returns the scene file description of a scene defined in Python (like the one of your_own_scene)
+def describe_scene(camera, ambient, lights, objects, max_depth):
+    return {
+        'camera': np.asarray(camera).tolist(),
+        'ambient': np.asarray(ambient).tolist(),
+        'max_depth': max_depth,
+        'lights': [describe_light(light) for light in lights],
+        'objects': [describe_object(obj) for obj in objects],
+    }
+
+
+# This function writes a scene defined in Python (like the one of your_own_scene) as a scene file
+def save_scene(path, camera, ambient, lights, objects, max_depth):
+    description = describe_scene(camera, ambient, lights, objects, max_depth)
+    # Every light and object is written on a line of its own
+    entries = []
+    for key, value in description.items():
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            items = ',\n'.join(f'    {json.dumps(item)}' for item in value)
+            entries.append(f'  {json.dumps(key)}: [\n{items}\n  ]')
+        else:
+            entries.append(f'  {json.dumps(key)}: {json.dumps(value)}')
+    with open(path, 'w') as file:
+        file.write('{\n' + ',\n'.join(entries) + '\n}\n')
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from helper_classes import *
+from compiled_scene import compile_scene
+from packet_tracer import PACKET_SIZE, get_packet_colors, get_tile_directions
+
+# The default height of a band, in rows of pixels
+BAND_HEIGHT = 64
+
+# What the last streamed render did: the bands it rendered, and the rows a resumed render found already finished
+stream_stats = {'bands': 0, 'resumed_rows': 0}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The 2 byte header of a zlib stream of deflate data with a 32K window
+ZLIB_HEADER = b'\x78\x9c'
+
+
+# The image is written into a memory-mapped .npy file, so only the pages of the band being written are in memory
+class NpySink:
+    def __init__(self, path, screen_size, state=None, dtype=float):
+        width, height = screen_size
+        if state is None:
+            self.image = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(height, width, 3))
+        else:
+            self.image = np.lib.format.open_memmap(path, mode='r+')
+
+    def write_band(self, top, band):
+        self.image[top:top + len(band)] = band
+        self.image.flush()
+
+    # This function returns what a resumed render needs to continue writing the file
+    def get_state(self):
+        return {}
+
+    def close(self):
+        self.image.flush()
+        del self.image
+
+
+# The image is written as an 8 bit RGB PNG file, one IDAT chunk per band.
+# The pixel rows are compressed as raw deflate data that is fully flushed after every band, so a resumed render can
+# cut the file after the last finished band and continue it with a new compressor. The zlib header and the Adler-32
+# checksum that wrap the deflate data are written by the sink itself, and the checksum is kept in the state.
+class PngSink:
+    def __init__(self, path, screen_size, state=None, level=6):
+        width, height = screen_size
+        if state is None:
+            self.file = open(path, 'wb')
+            self.file.write(PNG_SIGNATURE)
+            write_png_chunk(self.file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            self.checksum = zlib.adler32(b'')
+            self.started = False
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(state['offset'])
+            self.file.seek(state['offset'])
+            self.checksum = state['checksum']
+            self.started = True
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    def write_band(self, top, band):
+        pixels = np.round(np.clip(band, 0, 1) * 255).astype(np.uint8).reshape(len(band), -1)
+        # Every row starts with its filter type, 0 for none
+        rows = np.concatenate([np.zeros((len(band), 1), dtype=np.uint8), pixels], axis=1).tobytes()
+        self.checksum = zlib.adler32(rows, self.checksum)
+        data = self.compressor.compress(rows) + self.compressor.flush(zlib.Z_FULL_FLUSH)
+        if not self.started:
+            data = ZLIB_HEADER + data
+            self.started = True
+        write_png_chunk(self.file, b'IDAT', data)
+        self.file.flush()
+
+    def get_state(self):
+        return {'offset': self.file.tell(), 'checksum': self.checksum}
+
+    def close(self):
+        write_png_chunk(self.file, b'IDAT', self.compressor.flush(zlib.Z_FINISH) + struct.pack('>I', self.checksum))
+        write_png_chunk(self.file, b'IEND', b'')
+        self.file.close()
+
+
+def write_png_chunk(file, chunk_type, data):
+    file.write(struct.pack('>I', len(data)) + chunk_type + data)
+    file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+# The sink of every supported file extension
+SINKS = {
+    '.npy': NpySink,
+    '.png': PngSink,
+}
+
+
+# This function returns a hash of everything the image depends on, so a render only resumes the file of the same
+# image
+def get_render_key(camera, ambient, lights, compiled_scene, screen_size, max_depth):
+    digest = hashlib.sha1(f'{tuple(screen_size)} {max_depth}\n'.encode())
+    digest.update(compiled_scene.get_geometry_hash().encode())
+    arrays = [camera, ambient] + list(compiled_scene.materials.values())
+    for light in lights:
+        digest.update(type(light).__name__.encode())
+        arrays.extend(value for _, value in sorted(vars(light).items()))
+    for array_ in arrays:
+        digest.update(np.ascontiguousarray(array_, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+# This function returns the progress saved by an interrupted render, or None if there is none
+def read_progress(progress_path):
+    if not os.path.exists(progress_path):
+        return None
+    with open(progress_path) as file:
+        return json.load(file)
+
+
+# The progress is written under another name first and then renamed, so it is never seen half written
+def write_progress(progress_path, progress):
+    temporary_path = progress_path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(progress, file)
+    os.replace(temporary_path, progress_path)
+
+
+# This function renders the rows [top, bottom) of the image with the packet tracer, packet_size rays at a time
+def render_band(scene, compiled_scene, camera, screen_size, max_depth, top, bottom, packet_size):
+    width, _ = screen_size
+    directions = get_tile_directions(camera, screen_size, top, bottom, 0, width)
+    origins = np.broadcast_to(np.asarray(camera, dtype=float), directions.shape)
+    colors = np.zeros(directions.shape)
+    for start in range(0, len(directions), packet_size):
+        end = start + packet_size
+        colors[start:end] = get_packet_colors(scene, compiled_scene, origins[start:end], directions[start:end],
+                                              max_depth)
+    # We clip the values between 0 and 1 so all pixel values will make sense.
+    return np.clip(colors, 0, 1).reshape(bottom - top, width, 3)
+
+
+# This function renders the same image as render_scene_packet, but never holds more than one band of band_height
+# rows of it: every finished band is written straight to the file at path, a .npy file (memory mapped) or a .png
+# file (8 bits per channel).
+# After every band the progress is saved next to the file (path + '.progress'). If a render of the same image was
+# interrupted, it resumes from its last finished band, unless resume is False. The progress file is removed when
+# the image is complete.
+def render_scene_to_file(camera, ambient, lights, objects, screen_size, max_depth, path, band_height=BAND_HEIGHT,
+                         resume=True, packet_size=PACKET_SIZE):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f"Unknown image file extension {extension!r}, expected one of {list(SINKS)}")
+    width, height = screen_size
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    compiled_scene = compile_scene(objects)
+
+    key = get_render_key(camera, ambient, lights, compiled_scene, screen_size, max_depth)
+    progress_path = path + '.progress'
+    progress = read_progress(progress_path) if resume else None
+    if progress is not None and (progress['key'] != key or not os.path.exists(path)):
+        progress = None
+    first_row = progress['rows'] if progress is not None else 0
+    stream_stats.update({'bands': 0, 'resumed_rows': first_row})
+
+    sink = SINKS[extension](path, screen_size, progress['sink'] if progress is not None else None)
+    for top in range(first_row, height, band_height):
+        bottom = min(top + band_height, height)
+        sink.write_band(top, render_band(scene, compiled_scene, camera, screen_size, max_depth, top, bottom,
+                                         packet_size))
+        write_progress(progress_path, {'key': key, 'rows': bottom, 'sink': sink.get_state()})
+        stream_stats['bands'] += 1
+    sink.close()
+
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return path
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules of the ray tracer are imported by name, like the notebook imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper_classes import *
+from hw3 import render_scene
+from benchmark import get_notebook_scenes, make_lights_scene, make_spheres_scene, make_triangles_scene
+from instancing import Instance
+from mesh import pyramid_to_mesh
+
+# The scenes are rendered this small, so the scalar render_scene they are compared with stays fast
+SCREEN_SIZE = (24, 18)
+MAX_DEPTH = 3
+
+# The largest difference allowed between a pixel value of an engine that promises the image of render_scene and
+# the one of render_scene
+TOLERANCE = 1e-9
+
+# The random scenes the accelerators are compared with a linear scan on, and the rays shot into each
+SEEDS = range(8)
+RAYS_PER_SCENE = 200
+
+
+# This function returns random spheres, triangles and pyramids of every size, from specks to objects larger than a
+# leaf of a hierarchy, and a plane, which the hierarchies leave out
+def make_random_objects(rng, number_of_objects=40):
+    objects = [Plane(rng.normal(size=3), rng.uniform(-3, 3, 3))]
+    for _ in range(number_of_objects):
+        center = rng.uniform(-3, 3, 3)
+        size = rng.choice([0.01, 0.2, 1.0, 3.0])
+        kind = rng.integers(3)
+        if kind == 0:
+            objects.append(Sphere(center, size * rng.uniform(0.1, 1)))
+        elif kind == 1:
+            objects.append(Triangle(*(center + size * rng.uniform(-1, 1, (3, 3)))))
+        else:
+            objects.append(Pyramid(center + size * rng.uniform(-1, 1, (5, 3))))
+    return objects
+
+
+# This function returns random rays, most from inside the scene and some from outside it, some of them along an axis
+# plane
+def make_random_rays(rng, number_of_rays=RAYS_PER_SCENE):
+    rays = []
+    for index in range(number_of_rays):
+        origin = rng.uniform(-6, 6, 3) if index % 4 == 0 else rng.uniform(-3, 3, 3)
+        direction = rng.normal(size=3)
+        if index % 10 == 0:
+            direction[rng.integers(3)] = 0
+        rays.append(Ray(origin, normalize(direction)))
+    return rays
+
+
+# This function returns a scene of a mesh and two instances of it (one mirrored), over a plane
+def make_mesh_scene():
+    pyramid = Pyramid(np.array([[-0.5, -0.5, -2], [0.5, -0.5, -2], [0.5, -0.5, -3], [-0.5, -0.5, -3], [0, 0.5, -2.5]]))
+    pyramid.set_material([0.1, 0.2, 0.3], [0.3, 0.5, 0.8], [0.5, 0.5, 0.5], 50, 0.4)
+    mesh = pyramid_to_mesh(pyramid)
+    mirrored = np.diag([-1.0, 1.0, 1.0, 1.0])
+    mirrored[:3, 3] = [1.2, 0, 0]
+    moved = np.eye(4)
+    moved[:3, 3] = [-1.2, 0.3, -0.5]
+    floor = Plane([0, 1, 0], [0, -0.6, 0])
+    floor.set_material([0.1, 0.1, 0.1], [0.5, 0.5, 0.5], [1, 1, 1], 100, 0.5)
+    lights = [PointLight(np.array([1, 1, 1]), np.array([1, 1.5, 0]), 0.1, 0.1, 0.1),
+              DirectionalLight(np.array([0.3, 0.3, 0.3]), np.array([0.5, -1, -1]))]
+    return np.array([0, 0, 1]), np.array([0.1, 0.1, 0.1]), lights, [mesh, Instance(mesh, mirrored),
+                                                                     Instance(mesh, moved), floor]
+
+
+# The scenes every engine is compared on, as name -> (camera, ambient, lights, objects)
+def get_test_scenes():
+    scenes = get_notebook_scenes()
+    scenes['spheres'] = make_spheres_scene(12)
+    scenes['triangles'] = make_triangles_scene(12)
+    scenes['lights'] = make_lights_scene(6)
+    scenes['mesh'] = make_mesh_scene()
+    return scenes
+
+
+TEST_SCENES = get_test_scenes()
+
+
+@pytest.fixture(params=sorted(TEST_SCENES))
+def scene(request):
+    return TEST_SCENES[request.param]
+
+
+# The images of render_scene, rendered once per scene
+reference_images = {}
+
+
+@pytest.fixture
+def reference(scene):
+    key = id(scene)
+    if key not in reference_images:
+        camera, ambient, lights, objects = scene
+        reference_images[key] = render_scene(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH)
+    return reference_images[key]
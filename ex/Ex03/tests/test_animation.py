@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE, make_mesh_scene
+from hw3 import render_scene
+from animation import render_animation
+
+
+@pytest.mark.parametrize('engine', ['packet', 'scalar'])
+def test_animation_frames_match_render_scene(engine):
+    camera, ambient, lights, objects = make_mesh_scene()
+    cameras = [camera, camera + np.array([0.2, 0.1, 0.0]), camera + np.array([-0.1, 0.0, 0.5])]
+    start = objects[2].transform
+    moved = np.eye(4)
+    moved[:3, 3] = [-1.0, 0.5, -0.8]
+    frames = list(render_animation(cameras, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, [{}, {2: moved}, {}],
+                                   workers=1, engine=engine))
+
+    assert len(frames) == len(cameras)
+    # The transform of the second frame stays for the third
+    for frame, frame_camera, transform in zip(frames, cameras, (start, moved, moved)):
+        objects[2].set_transform(transform)
+        reference = render_scene(frame_camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH)
+        np.testing.assert_allclose(frame, reference, rtol=0, atol=TOLERANCE)
+
+
+def test_animation_in_this_process_keeps_the_transforms_of_the_objects():
+    camera, ambient, lights, objects = make_mesh_scene()
+    start = objects[2].transform.copy()
+    moved = np.eye(4)
+    moved[:3, 3] = [-1.0, 0.5, -0.8]
+    frames = render_animation([camera, camera], ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, [{}, {2: moved}],
+                              workers=1)
+    next(frames)
+    # Stopping the animation early puts the objects back too
+    next(frames)
+    frames.close()
+    np.testing.assert_array_equal(objects[2].transform, start)
+
+    list(render_animation([camera, camera], ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, [{}, {2: moved}],
+                          workers=1))
+    np.testing.assert_array_equal(objects[2].transform, start)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TEST_SCENES, TOLERANCE
+from antialiasing import antialiasing_stats, get_edge_contrast, render_scene_adaptive
+
+
+# No pixel differs from a neighbour by more than an infinite threshold, so nothing is supersampled
+def test_without_edges_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_adaptive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, color_threshold=np.inf)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+    assert antialiasing_stats == {'edge_pixels': 0, 'refined_pixels': 0, 'extra_rays': 0}
+
+
+# The only sample of a 1 x 1 subpixel grid is the pixel center, so refining a pixel averages its color with itself
+def test_single_subpixel_sample_is_the_pixel_center(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_adaptive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, color_threshold=0,
+                                  subpixel_grid=1)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+    assert antialiasing_stats['extra_rays'] == antialiasing_stats['refined_pixels']
+
+
+@pytest.mark.parametrize('scene_name', ['scene3', 'scene4'])
+def test_only_edge_pixels_are_refined(scene_name):
+    camera, ambient, lights, objects = TEST_SCENES[scene_name]
+    reference = render_scene_adaptive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH,
+                                      color_threshold=np.inf)
+    image = render_scene_adaptive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, subpixel_grid=3)
+
+    changed = np.abs(image - reference).max(axis=2) > 0
+    assert 0 < antialiasing_stats['refined_pixels'] == antialiasing_stats['edge_pixels']
+    assert antialiasing_stats['extra_rays'] == 9 * antialiasing_stats['refined_pixels']
+    assert changed.sum() <= antialiasing_stats['refined_pixels']
+
+
+# A budget of 43 extra rays refines 10 pixels with the 4 samples of the default grid
+def test_extra_rays_are_capped():
+    camera, ambient, lights, objects = TEST_SCENES['scene4']
+    render_scene_adaptive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH)
+    edge_pixels = antialiasing_stats['edge_pixels']
+    image = render_scene_adaptive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, max_extra_rays=43)
+
+    assert antialiasing_stats['edge_pixels'] == edge_pixels > 10
+    assert antialiasing_stats['refined_pixels'] == 10
+    assert antialiasing_stats['extra_rays'] == 40
+    assert image.shape == (SCREEN_SIZE[1], SCREEN_SIZE[0], 3)
+
+
+def test_edge_contrast():
+    image = np.zeros((3, 4, 3))
+    image[1, 1] = [0.5, 0, 0]
+    ids = np.zeros((3, 4), dtype=int)
+    ids[:, 3] = 1
+    contrast = get_edge_contrast(image, ids)
+
+    # The bright pixel and its 4 neighbours differ by 0.5, and the pixels on both sides of the object border by
+    # infinity
+    assert contrast[1, 1] == contrast[0, 1] == contrast[2, 1] == contrast[1, 0] == 0.5
+    assert contrast[1, 2] == np.inf and np.all(contrast[:, 3] == np.inf)
+    assert contrast[0, 0] == 0
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import benchmark
+from benchmark import compare_with_baseline, main
+
+
+def make_results(engine='packet', **cases):
+    return {'engine': engine, 'results': {case: {'seconds': seconds, 'pixels_per_second': 1 / seconds,
+                                                 'peak_memory_bytes': memory}
+                                          for case, (seconds, memory) in cases.items()}}
+
+
+def test_regressions_above_the_threshold_are_reported():
+    baseline = make_results(slow=(1.0, 1000), fast=(1.0, 1000), fat=(1.0, 1000))
+    results = make_results(slow=(1.2, 1000), fast=(1.05, 1000), fat=(1.0, 1200), new=(9.0, 9000))
+    # A case missing from the baseline is not a regression
+    assert compare_with_baseline(results, baseline, threshold=0.1) == [
+        ('slow', 'seconds', 1.0, 1.2), ('fat', 'peak_memory_bytes', 1000, 1200)]
+    assert compare_with_baseline(results, baseline, threshold=0.25) == []
+
+
+def test_short_times_are_not_compared():
+    baseline = make_results(tiny=(0.006, 1000), grown=(0.01, 1000))
+    results = make_results(tiny=(0.009, 1000), grown=(0.2, 1000))
+    assert compare_with_baseline(results, baseline, min_seconds=0.05) == [('grown', 'seconds', 0.01, 0.2)]
+    assert len(compare_with_baseline(results, baseline, min_seconds=0)) == 2
+
+
+def test_baselines_of_other_engines_or_runs_are_rejected():
+    with pytest.raises(ValueError):
+        compare_with_baseline(make_results('packet', a=(1, 1)), make_results('scalar', a=(1, 1)))
+    with pytest.raises(ValueError):
+        compare_with_baseline(make_results(a=(1, 1)), {'engine': 'packet', 'precisions': {}})
+
+
+def test_saved_baseline_is_compared_with(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(benchmark, 'BASELINE_DIRECTORY', str(tmp_path / 'baselines'))
+    arguments = ['--scenes', 'scene1', '--resolutions', '8', '8', '--depths', '1', '--repeat', '2']
+    with pytest.raises(SystemExit):
+        main(arguments + ['--baseline'])
+    assert 'record one with --save-baseline' in capsys.readouterr().err
+
+    assert main(arguments + ['--save-baseline', '--output', str(tmp_path / 'results.json')]) == 0
+    with open(tmp_path / 'baselines' / 'packet.json') as file:
+        baseline = json.load(file)
+    assert baseline == json.loads((tmp_path / 'results.json').read_text())
+    assert list(baseline['results']) == ['scene1@8x8/depth1']
+    # A render of 64 pixels is far below the time floor, and allocates as much memory every time
+    assert main(arguments + ['--baseline']) == 0
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, SEEDS, TOLERANCE, make_random_objects, make_random_rays
+from helper_classes import *
+from hw3 import render_scene
+from bvh import BVH, build_scene_bvh
+
+
+def test_render_over_bvh_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene(camera, ambient, lights, build_scene_bvh(objects), SCREEN_SIZE, MAX_DEPTH)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_nearest_hit_matches_linear_scan(seed):
+    rng = np.random.default_rng(seed)
+    objects = make_random_objects(rng)
+    bvh_objects = build_scene_bvh(objects)
+    assert isinstance(bvh_objects[0], BVH)
+    for ray in make_random_rays(rng):
+        nearest_object, min_t, _ = ray.nearest_intersected_object(objects)
+        bvh_object, bvh_t, _ = ray.nearest_intersected_object(bvh_objects)
+        assert bvh_t == min_t
+        # Two primitives may be hit at the same distance (like the faces of a pyramid at an edge), so only the
+        # distance has to match then
+        if bvh_object is not nearest_object:
+            assert bvh_object.intersect(ray)[0] == min_t
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_occlusion_matches_linear_scan(seed):
+    rng = np.random.default_rng(seed)
+    objects = make_random_objects(rng)
+    bvh_objects = build_scene_bvh(objects)
+    for ray in make_random_rays(rng):
+        max_distance = rng.choice([rng.uniform(0, 8), np.inf])
+        assert ray.is_occluded(bvh_objects, max_distance) == ray.is_occluded(objects, max_distance)
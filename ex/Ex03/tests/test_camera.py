@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from conftest import SCREEN_SIZE
+from helper_classes import *
+from camera import RAY_CACHE_SIZE, Camera, camera_stats, clear_ray_cache, get_pixel_size, get_screen, ray_cache
+
+CAMERA = np.array([0.1, -0.2, 1.0])
+
+
+# The directions are exactly those render_scene computed pixel by pixel before they were cached
+def test_directions_match_the_rays_through_the_pixels():
+    width, height = SCREEN_SIZE
+    directions = Camera(CAMERA).get_directions(SCREEN_SIZE)
+    assert directions.shape == (width * height, 3)
+    screen = get_screen(SCREEN_SIZE)
+    for i, y in enumerate(np.linspace(screen[1], screen[3], height)):
+        for j, x in enumerate(np.linspace(screen[0], screen[2], width)):
+            np.testing.assert_array_equal(directions[i * width + j], normalize(np.array([x, y, 0]) - CAMERA))
+
+
+def test_cache_keeps_the_most_recently_used_views():
+    clear_ray_cache()
+    directions = Camera(CAMERA).get_directions(SCREEN_SIZE)
+    assert Camera(CAMERA.copy()).get_directions(SCREEN_SIZE) is directions
+    assert camera_stats == {'hits': 1, 'misses': 1}
+    with pytest.raises(ValueError):
+        directions[0] = 0
+
+    # Using the first view keeps it while the views after it push out the older ones
+    for size in range(1, RAY_CACHE_SIZE + 1):
+        Camera(CAMERA).get_directions((size, size))
+        Camera(CAMERA).get_directions(SCREEN_SIZE)
+    assert len(ray_cache) == RAY_CACHE_SIZE
+    assert Camera(CAMERA).get_directions(SCREEN_SIZE) is directions
+    Camera(CAMERA).get_directions((1, 1))
+    assert camera_stats['misses'] == 1 + RAY_CACHE_SIZE + 1
+
+    # Another position is another view
+    assert Camera(CAMERA + 0.5).get_directions(SCREEN_SIZE) is not directions
+    clear_ray_cache()
+    assert not ray_cache and camera_stats == {'hits': 0, 'misses': 0}
+
+
+def test_pixels_and_tiles_are_the_cached_directions():
+    width, height = SCREEN_SIZE
+    camera = Camera(CAMERA)
+    directions = camera.get_directions(SCREEN_SIZE).reshape(height, width, 3)
+    rows, columns = np.array([0, 3, height - 1]), np.array([width - 1, 0, 5])
+    np.testing.assert_array_equal(camera.get_pixel_directions(SCREEN_SIZE, rows, columns), directions[rows, columns])
+
+    clear_ray_cache()
+    tile = camera.get_tile_directions(SCREEN_SIZE, 2, 7, 4, 11)
+    np.testing.assert_array_equal(tile, directions[2:7, 4:11].reshape(-1, 3))
+    # A tile is computed on its own, without the directions of the whole image
+    assert not ray_cache
+
+
+def test_jittered_directions_stay_inside_their_pixels():
+    width, height = SCREEN_SIZE
+    camera = Camera(CAMERA)
+    centers = camera.get_pixels(SCREEN_SIZE)
+    pixel_size = np.abs(get_pixel_size(SCREEN_SIZE))
+    rng = np.random.default_rng(0)
+    directions = camera.get_jittered_directions(SCREEN_SIZE, rng)
+    offsets = np.zeros((width * height, 2))
+    for _ in range(200):
+        assert camera.get_jittered_directions(SCREEN_SIZE, rng) is directions
+        np.testing.assert_allclose(np.linalg.norm(directions, axis=1), 1)
+        # Where the ray crosses the screen, at z = 0
+        points = CAMERA + directions * (-CAMERA[2] / directions[:, 2:3])
+        offset = points[:, :2] - centers[:, :2]
+        assert np.all(np.abs(offset) <= pixel_size / 2 + 1e-12)
+        offsets += offset
+    # The points are spread evenly around the pixel centers
+    np.testing.assert_allclose(offsets / 200, 0, atol=pixel_size.max() * 0.15)
+
+
+def test_jittered_directions_are_repeatable():
+    first = Camera(CAMERA).get_jittered_directions(SCREEN_SIZE, np.random.default_rng(3)).copy()
+    second = Camera(CAMERA).get_jittered_directions(SCREEN_SIZE, np.random.default_rng(3))
+    np.testing.assert_array_equal(first, second)
+    assert not np.array_equal(first, Camera(CAMERA).get_directions(SCREEN_SIZE))
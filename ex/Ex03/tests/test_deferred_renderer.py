@@ -0,0 +1,10 @@
+import numpy as np
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+from deferred_renderer import render_scene_deferred
+
+
+def test_deferred_engine_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_deferred(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, SEEDS, TOLERANCE, make_random_objects, make_random_rays
+from helper_classes import *
+from hw3 import render_scene
+from grid import UniformGrid, build_scene_grid
+
+
+def test_render_over_grid_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene(camera, ambient, lights, build_scene_grid(objects), SCREEN_SIZE, MAX_DEPTH)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_nearest_hit_matches_linear_scan(seed):
+    rng = np.random.default_rng(seed)
+    objects = make_random_objects(rng)
+    grid_objects = build_scene_grid(objects)
+    assert isinstance(grid_objects[0], UniformGrid)
+    for ray in make_random_rays(rng):
+        nearest_object, min_t, _ = ray.nearest_intersected_object(objects)
+        grid_object, grid_t, _ = ray.nearest_intersected_object(grid_objects)
+        assert grid_t == min_t
+        # Two primitives may be hit at the same distance (like the faces of a pyramid at an edge), so only the
+        # distance has to match then
+        if grid_object is not nearest_object:
+            assert grid_object.intersect(ray)[0] == min_t
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_occlusion_matches_linear_scan(seed):
+    rng = np.random.default_rng(seed)
+    objects = make_random_objects(rng)
+    grid_objects = build_scene_grid(objects)
+    for ray in make_random_rays(rng):
+        max_distance = rng.choice([rng.uniform(0, 8), np.inf])
+        assert ray.is_occluded(grid_objects, max_distance) == ray.is_occluded(objects, max_distance)
+
+
+def test_mailboxes_do_not_leak_between_rays():
+    rng = np.random.default_rng(0)
+    grid = build_scene_grid(make_random_objects(rng))[0]
+    rays = make_random_rays(rng)
+    first = [grid.intersect(ray)[0] for ray in rays]
+    # Occlusion tests between the same rays use the mailboxes too
+    for ray in rays:
+        grid.is_occluding(ray, 1.0)
+    assert [grid.intersect(ray)[0] for ray in rays] == first
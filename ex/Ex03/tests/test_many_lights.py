@@ -0,0 +1,89 @@
+import numpy as np
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+from helper_classes import *
+from many_lights import LightSet, many_lights_stats, render_scene_many_lights, reset_many_lights_stats
+
+
+# Without culling, and with every light selected, every light is shaded exactly
+def test_exact_configuration_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_many_lights(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, cull_threshold=0,
+                                     max_lights=len(lights))
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+
+
+# This function returns point lights on a line, each dimmer and further from the origin than the one before it
+def make_row_of_lights(number_of_lights):
+    return [PointLight(np.full(3, 1.0 / (index + 1)), np.array([2.0 * index, 0, 0]), 1, 0, 1)
+            for index in range(number_of_lights)]
+
+
+def test_lights_too_dim_at_a_point_are_culled():
+    lights = make_row_of_lights(4)
+    points = np.array([[0.0, 1, 0], [6.0, 1, 0]])
+    light_set = LightSet(lights, cull_threshold=0.05)
+    attenuations = light_set.get_attenuation_matrix(points)
+    bright_enough = attenuations * light_set.brightness >= 0.05
+
+    reset_many_lights_stats()
+    point_indices, light_indices, factors = light_set.select(points)
+    assert sorted(zip(point_indices, light_indices)) == sorted(zip(*np.nonzero(bright_enough)))
+    np.testing.assert_allclose(factors, attenuations[point_indices, light_indices])
+    assert many_lights_stats['pairs'] == len(points) * len(lights)
+    assert many_lights_stats['culled'] == np.count_nonzero(~bright_enough) > 0
+    assert many_lights_stats['sampled_points'] == 0
+
+
+def test_sampled_lights_follow_their_power():
+    powers = np.array([[1.0, 0, 3, 0], [0, 0, 0, 2], [0.5, 0.5, 0.5, 0.5]])
+    light_set = LightSet([], samples=20000, seed=1)
+    rows, lights, probabilities = light_set.sample(powers)
+
+    # Every row keeps its own samples, and never picks a light of no power
+    np.testing.assert_array_equal(rows, np.repeat(np.arange(len(powers)), 20000))
+    assert np.all(powers[rows, lights] > 0)
+    expected = powers / powers.sum(axis=1, keepdims=True)
+    np.testing.assert_allclose(probabilities, expected[rows, lights])
+    for row in range(len(powers)):
+        frequencies = np.bincount(lights[rows == row], minlength=powers.shape[1]) / 20000
+        np.testing.assert_allclose(frequencies, expected[row], atol=0.02)
+
+
+# Sampling scales the lights it picks by the inverse of their probability, so on average it adds up to all the
+# lights that were not culled
+def test_sampled_light_is_unbiased():
+    lights = make_row_of_lights(6)
+    points = np.array([[1.0, 0.5, 0], [5.0, -0.5, 1]])
+    exact = LightSet(lights, cull_threshold=0)
+    point_indices, light_indices, factors = exact.select(points)
+    expected = np.bincount(point_indices, factors * exact.brightness[light_indices], minlength=len(points))
+
+    reset_many_lights_stats()
+    light_set = LightSet(lights, cull_threshold=0, max_lights=2, samples=4, seed=2)
+    totals = np.zeros(len(points))
+    for _ in range(5000):
+        point_indices, light_indices, factors = light_set.select(points)
+        assert np.all(np.bincount(point_indices, minlength=len(points)) == 4)
+        totals += np.bincount(point_indices, factors * light_set.brightness[light_indices], minlength=len(points))
+    np.testing.assert_allclose(totals / 5000, expected, rtol=0.02)
+    assert many_lights_stats['sampled_points'] == 5000 * len(points)
+
+
+def test_culling_and_sampling_cast_fewer_shadow_rays(scene):
+    camera, ambient, lights, objects = scene
+    reset_many_lights_stats()
+    render_scene_many_lights(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, cull_threshold=0,
+                             max_lights=len(lights))
+    exact = dict(many_lights_stats)
+    assert exact['pairs'] == exact['points'] * len(lights)
+    assert exact['culled'] <= exact['pairs'] and exact['sampled_points'] == 0
+
+    reset_many_lights_stats()
+    render_scene_many_lights(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, cull_threshold=0.05,
+                             max_lights=1, samples=1)
+    assert many_lights_stats['points'] == exact['points']
+    assert many_lights_stats['culled'] >= exact['culled']
+    assert many_lights_stats['shadow_rays'] <= exact['shadow_rays']
+    if len(lights) > 1:
+        assert many_lights_stats['sampled_points'] > 0 or many_lights_stats['culled'] > exact['culled']
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from conftest import SEEDS, make_random_rays
+from helper_classes import *
+from mesh import Mesh, load_obj
+
+OBJ_FILE = '''# A square, a pentagon and a triangle given with negative indices
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vn 0 0 1
+f 1//1 2//1 3//1 4//1
+v 2 0 0
+v 3 0 0
+v 3.5 1 0
+v 2.5 1.5 0
+v 2 1 0
+f 5/1/1 6/1/1 7/1/1 8/1/1 9/1/1
+v 0 2 0
+v 1 2 0
+v 0 3 0
+f -3 -2 -1
+'''
+
+
+def test_load_obj(tmp_path):
+    path = tmp_path / 'shapes.obj'
+    path.write_text(OBJ_FILE)
+    mesh = load_obj(str(path))
+
+    assert mesh.vertices.shape == (12, 3)
+    np.testing.assert_array_equal(mesh.vertices[6], [3.5, 1, 0])
+    # Polygons are split into a fan of triangles around their first corner
+    np.testing.assert_array_equal(mesh.faces, [[0, 1, 2], [0, 2, 3], [4, 5, 6], [4, 6, 7], [4, 7, 8], [9, 10, 11]])
+    assert mesh.load_stats['vertices'] == 12 and mesh.load_stats['faces'] == 6
+    np.testing.assert_allclose(mesh.face_normals, np.tile([0, 0, 1], (6, 1)))
+
+
+def test_obj_without_faces(tmp_path):
+    path = tmp_path / 'points.obj'
+    path.write_text('v 0 0 0\nv 1 0 0\n')
+    mesh = load_obj(str(path))
+
+    assert len(mesh.faces) == 0 and mesh.get_bounds() is None
+    assert mesh.intersect(Ray(np.array([0.5, 0, 1]), np.array([0, 0, -1]))) == (None, None)
+    assert not mesh.is_occluding(Ray(np.array([0.5, 0, 1]), np.array([0, 0, -1])), np.inf)
+
+
+# A mesh of random triangles, small leaves so the hierarchy is deep, against the same triangles as Triangle objects
+@pytest.mark.parametrize('seed', SEEDS)
+def test_mesh_matches_its_triangles(seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-3, 3, (60, 1, 3))
+    vertices = (centers + rng.uniform(-0.8, 0.8, (60, 3, 3))).reshape(-1, 3)
+    faces = np.arange(len(vertices)).reshape(-1, 3)
+    mesh = Mesh(vertices, faces, max_leaf_faces=2)
+    triangles = [Triangle(*vertices[face]) for face in faces]
+
+    for ray in make_random_rays(rng):
+        triangle, min_t, _ = ray.nearest_intersected_object(triangles)
+        face, mesh_t, _ = ray.nearest_intersected_object([mesh])
+        if triangle is None:
+            assert face is None
+            continue
+        assert mesh_t == pytest.approx(min_t, rel=1e-9)
+        np.testing.assert_allclose(face.get_normal(None), triangle.normal, atol=1e-9)
+        max_distance = rng.uniform(0, 2 * min_t)
+        assert ray.is_occluded([mesh], max_distance) == ray.is_occluded(triangles, max_distance)
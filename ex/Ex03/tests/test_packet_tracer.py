@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+from benchmark import PIXEL_TOLERANCE
+from packet_tracer import PACKET_SIZE, render_scene_packet
+
+
+# A packet size that does not divide the image, so the last packet is a partial one
+@pytest.mark.parametrize('packet_size', [PACKET_SIZE, 37])
+def test_packet_engine_matches_render_scene(packet_size, scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_packet(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, packet_size=packet_size)
+    assert image.shape == reference.shape
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+
+
+def test_float32_is_close_to_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_packet(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, dtype=np.float32)
+    assert image.dtype == np.float32
+    wrong_pixels = (np.abs(image - reference).max(axis=2) > PIXEL_TOLERANCE).mean()
+    assert wrong_pixels < 0.01
@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+from parallel_renderer import render_scene_parallel
+
+
+# Tiles of 8 pixels do not divide the image, so the last row and column of tiles are partial ones
+@pytest.mark.parametrize('engine', ['packet', 'scalar'])
+def test_parallel_engine_matches_render_scene(engine, scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_parallel(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, tile_size=8, workers=2,
+                                  engine=engine)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
@@ -0,0 +1,11 @@
+import numpy as np
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+from progressive_renderer import render_scene_progressive
+
+
+# The last pass traces every pixel, so it is the full image
+def test_last_pass_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    passes = list(render_scene_progressive(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH))
+    np.testing.assert_allclose(passes[-1], reference, rtol=0, atol=TOLERANCE)
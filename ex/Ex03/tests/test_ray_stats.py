@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, SEEDS, TEST_SCENES, TOLERANCE, make_random_objects, make_random_rays
+from helper_classes import *
+from hw3 import render_scene
+from bvh import build_scene_bvh
+from grid import build_scene_grid
+from packet_tracer import get_shadow_ray_stats, render_scene_packet, reset_shadow_ray_stats
+from ray_stats import RayStats, get_counted_object
+
+
+# Counting rays must not change what is rendered
+def test_render_with_stats_matches_render_scene(scene, reference):
+    camera, ambient, lights, objects = scene
+    stats = RayStats()
+    image = render_scene(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, stats=stats)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+    assert stats.primary_rays == SCREEN_SIZE[0] * SCREEN_SIZE[1]
+
+
+def test_stats_count_one_shadow_ray_per_light_and_hit():
+    camera, ambient, lights, objects = TEST_SCENES['scene3']
+    results = []
+    for scene_objects in (objects, build_scene_bvh(objects), build_scene_grid(objects)):
+        stats = RayStats()
+        render_scene(camera, ambient, lights, scene_objects, SCREEN_SIZE, 1, stats=stats)
+        results.append(stats.get_ray_counts())
+    # Composite objects test their primitives with rays of their own, which must not count as more shadow rays
+    assert results[0] == results[1] == results[2]
+    assert results[0]['shadow'] % len(lights) == 0
+    assert results[0]['shadow'] <= results[0]['primary'] * len(lights)
+
+
+# The scalar engine reports its shadow rays per second the way the packet engine does
+def test_shadow_ray_stats_match_the_packet_engine_report():
+    camera, ambient, lights, objects = TEST_SCENES['scene4']
+    reset_shadow_ray_stats()
+    render_scene_packet(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH)
+    packet_report = get_shadow_ray_stats()
+    stats = RayStats()
+    render_scene(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, stats=stats)
+    scalar_report = stats.get_shadow_ray_stats()
+
+    assert scalar_report.keys() == packet_report.keys()
+    assert scalar_report['rays'] == stats.shadow_rays > 0
+    assert scalar_report['seconds'] > 0
+    assert scalar_report['rays_per_second'] == scalar_report['rays'] / scalar_report['seconds']
+    assert 'shadow rays per second' in stats.get_summary()
+
+
+def make_pyramid():
+    return Pyramid(np.array([[-0.5, -0.5, -2], [0.5, -0.5, -2], [0.5, -0.5, -3], [-0.5, -0.5, -3], [0, 0.5, -2.5]]))
+
+
+# A ray that misses the box of a composite object costs one bounding volume test, which rejects it
+def test_rejected_ray_tests_no_primitives():
+    stats = RayStats()
+    pyramid = get_counted_object(make_pyramid(), stats)
+    assert pyramid.intersect(Ray(np.array([0, 2, 0]), normalize(np.array([0, 0, -1])))) == (None, None)
+    assert (stats.bounds_tests, stats.bounds_rejections) == (1, 1)
+    assert stats.intersection_tests == {'Pyramid': 1}
+    assert stats.get_rejection_rate() == 1.0
+
+    t, _ = pyramid.intersect(Ray(np.array([0, 0, 0]), normalize(np.array([0, -0.2, -2.5]))))
+    assert t is not None
+    assert (stats.bounds_tests, stats.bounds_rejections) == (2, 1)
+    assert stats.intersection_tests['Triangle'] == len(pyramid.get_primitives())
+    assert stats.get_rejection_rate() == 0.5
+
+
+# The box only rejects rays that hit none of the primitives, before max_distance for an occlusion test
+@pytest.mark.parametrize('seed', SEEDS)
+def test_bounds_never_reject_a_hit(seed):
+    rng = np.random.default_rng(seed)
+    composites = [obj for obj in make_random_objects(rng) if isinstance(obj, CompositeObject3D)]
+    for ray in make_random_rays(rng):
+        max_distance = rng.uniform(0.1, 5)
+        for obj in composites:
+            stats = RayStats()
+            counted = get_counted_object(obj, stats)
+            _, min_t, _ = ray.nearest_intersected_object(obj.get_primitives())
+            t, _ = counted.intersect(ray)
+            assert (t is None and min_t == np.inf) or t == min_t
+            assert counted.is_occluding(ray, max_distance) == ray.is_occluded(obj.get_primitives(), max_distance)
+            assert stats.bounds_tests == 2
+            if stats.bounds_rejections:
+                assert min_t == np.inf or (stats.bounds_rejections == 1 and min_t >= max_distance - epsilon)
+
+
+def test_render_counts_bounds_tests_of_composite_objects():
+    camera, ambient, lights, objects = TEST_SCENES['scene3']
+    stats = RayStats()
+    render_scene(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, stats=stats)
+    # Every primary, reflection and shadow ray meets the diamond's box once
+    assert stats.bounds_tests == sum(stats.get_ray_counts().values())
+    assert 0 < stats.bounds_rejections < stats.bounds_tests
+    # Only the rays the box lets through test the triangles, and an occlusion test stops at the first one hit
+    assert 0 < stats.intersection_tests['Triangle'] <= (stats.bounds_tests - stats.bounds_rejections) * 6
+    assert f'{stats.bounds_rejections} ({stats.get_rejection_rate():.1%})' in stats.get_summary()
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from conftest import TEST_SCENES
+from hw3 import render_scene
+from benchmark import PIXEL_TOLERANCE
+from render_service import RenderService, fetch_render, submit_render
+from scene_file import describe_scene
+
+SCREEN_SIZE = (32, 24)
+MAX_DEPTH = 2
+
+
+# This function starts a service with one worker on a free port, runs client(url) in a thread while the service
+# serves, and returns what client returned
+def run_with_service(client, scene_directory='.'):
+    async def run():
+        service = RenderService(workers=1, scene_directory=scene_directory)
+        server = await service.start(port=0)
+        host, port = server.sockets[0].getsockname()[:2]
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, client, f'http://{host}:{port}')
+        finally:
+            await service.close()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('engine', ['packet', 'scalar'])
+def test_service_image_matches_render_scene(engine):
+    camera, ambient, lights, objects = TEST_SCENES['scene4']
+    description = describe_scene(camera, ambient, lights, objects, MAX_DEPTH)
+
+    def client(url):
+        job = submit_render(description, SCREEN_SIZE, engine=engine, url=url)
+        duplicate = submit_render(description, SCREEN_SIZE, engine=engine, url=url)
+        image = fetch_render(job['id'], url)
+        cached = submit_render(description, SCREEN_SIZE, engine=engine, url=url)
+        return image, fetch_render(duplicate['id'], url), cached
+
+    image, duplicate_image, cached = run_with_service(client)
+    reference = render_scene(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH)
+    # The service sends PNG files, which keep 8 bits per channel
+    np.testing.assert_allclose(image, reference, rtol=0, atol=PIXEL_TOLERANCE)
+    np.testing.assert_array_equal(duplicate_image, image)
+    assert cached['cached'] and cached['status'] == 'done'
+
+
+# This function posts a job request to a service, and returns the status code of the answer and its body
+def post_job(url, request):
+    http_request = urllib.request.Request(f'{url}/jobs', data=json.dumps(request).encode(), method='POST')
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def make_scene_request(**scene):
+    camera, ambient, lights, objects = TEST_SCENES['scene4']
+    description = describe_scene(camera, ambient, lights, objects, MAX_DEPTH)
+    description.update(scene)
+    return {'scene': description, 'resolution': [4, 3]}
+
+
+MATERIAL = {'ambient': [1, 0, 0], 'diffuse': [1, 0, 0], 'specular': [1, 1, 1], 'shininess': 10, 'reflection': 0.5}
+
+MALFORMED_SCENES = [
+    {'objects': [{}]},
+    {'objects': [1]},
+    {'objects': {}},
+    {'objects': [{'type': 'cube', 'material': MATERIAL}]},
+    {'objects': [{'type': 'sphere', 'center': [0, 0, -1], 'material': MATERIAL}]},
+    {'objects': [{'type': 'sphere', 'center': [0, 0], 'radius': 1, 'material': MATERIAL}]},
+    {'objects': [{'type': 'sphere', 'center': [0, 0, -1], 'radius': '1', 'material': MATERIAL}]},
+    {'objects': [{'type': 'triangle', 'vertices': [[0, 0, 0], [1, 0, 0]], 'material': MATERIAL}]},
+    {'objects': [{'type': 'sphere', 'center': [0, 0, -1], 'radius': 1, 'material': 'red'}]},
+    {'objects': [{'type': 'sphere', 'center': [0, 0, -1], 'radius': 1, 'material': {'ambient': [1, 0, 0]}}]},
+    {'objects': [{'type': 'mesh', 'path': 3, 'material': MATERIAL}]},
+    {'lights': [1]},
+    {'lights': [{'type': 'point', 'intensity': [1, 1, 1], 'position': [0, 1, 0]}]},
+    {'lights': [{'type': 'directional', 'intensity': [1, 1, 1], 'direction': None}]},
+    {'camera': [0, 0]},
+    {'ambient': 'dark'},
+    {'materials': {'red': 1}},
+]
+
+
+# A malformed scene is a bad request, whatever is wrong with it
+def test_malformed_scenes_are_bad_requests():
+    def client(url):
+        return [post_job(url, make_scene_request(**scene)) for scene in MALFORMED_SCENES]
+
+    for scene, (status, body) in zip(MALFORMED_SCENES, run_with_service(client)):
+        assert status == 400, (scene, body)
+        assert 'error' in body
+
+
+# A job can only read meshes inside the scene directory
+def test_meshes_outside_the_scene_directory_are_refused(tmp_path):
+    scene_directory = tmp_path / 'scenes'
+    scene_directory.mkdir()
+    (scene_directory / 'triangle.obj').write_text('v -0.5 -0.5 -2\nv 0.5 -0.5 -2\nv 0 0.5 -2.5\nf 1 2 3\n')
+    (tmp_path / 'secret.obj').write_text('v 0 0 0\n')
+    os.symlink(tmp_path / 'secret.obj', scene_directory / 'link.obj')
+    paths = ['../secret.obj', str(tmp_path / 'secret.obj'), 'link.obj', 'triangle.obj']
+
+    def client(url):
+        return [post_job(url, make_scene_request(objects=[{'type': 'mesh', 'path': path, 'material': MATERIAL}]))
+                for path in paths]
+
+    answers = run_with_service(client, str(scene_directory))
+    assert [status for status, _ in answers] == [400, 400, 400, 202]
+    assert all('outside the scene directory' in body['error'] for _, body in answers[:3])
+
+
+# Closing the service waits for the running render without blocking the event loop
+def test_close_does_not_block_the_event_loop():
+    camera, ambient, lights, objects = TEST_SCENES['scene4']
+    description = describe_scene(camera, ambient, lights, objects, MAX_DEPTH)
+
+    async def run():
+        service = RenderService(workers=1)
+        await service.start(port=0)
+        job = await service.submit(description, (64, 48), MAX_DEPTH, 'scalar')
+        while job.status != 'running':
+            await asyncio.sleep(0.01)
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0.01)
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0)
+        await service.close()
+        ticker.cancel()
+        return len(ticks)
+
+    assert asyncio.run(run()) > 1
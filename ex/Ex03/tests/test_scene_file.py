@@ -0,0 +1,100 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TEST_SCENES, TOLERANCE
+from hw3 import render_scene
+from instancing import Instance
+from mesh import Mesh
+from packet_tracer import render_scene_packet
+from parallel_renderer import render_scene_parallel
+from scene_file import describe_scene, load_scene, save_scene, scene_cache_stats
+
+OBJ_FILE = 'v -0.5 -0.5 -2\nv 0.5 -0.5 -2\nv 0 0.5 -2.5\nf 1 2 3\n'
+
+
+# This function writes a notebook scene as a scene file, with a mesh from an OBJ file next to it, and returns its path
+def write_scene(directory, scene_name='scene3'):
+    camera, ambient, lights, objects = TEST_SCENES[scene_name]
+    description = describe_scene(camera, ambient, lights, objects, MAX_DEPTH)
+    description['objects'].append({'type': 'mesh', 'path': 'triangle.obj',
+                                   'material': description['objects'][0]['material']})
+    (directory / 'triangle.obj').write_text(OBJ_FILE)
+    path = directory / 'scene.json'
+    path.write_text(json.dumps(description))
+    return str(path)
+
+
+def get_cache_files(directory):
+    return sorted(os.listdir(directory / '.scene_cache'))
+
+
+def test_saved_scene_renders_like_the_scene(tmp_path, scene, reference):
+    camera, ambient, lights, objects = scene
+    if any(isinstance(obj, (Mesh, Instance)) for obj in objects):
+        pytest.skip('A scene file refers to the OBJ file of a mesh, so a mesh made in Python cannot be saved')
+    path = str(tmp_path / 'scene.json')
+    save_scene(path, camera, ambient, lights, objects, MAX_DEPTH)
+    loaded_camera, loaded_ambient, loaded_lights, loaded_objects, max_depth = load_scene(path)
+
+    assert max_depth == MAX_DEPTH
+    image = render_scene_packet(loaded_camera, loaded_ambient, loaded_lights, loaded_objects, SCREEN_SIZE, max_depth)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+
+
+def test_cache_hit_renders_like_a_miss(tmp_path):
+    path = write_scene(tmp_path)
+    missed = load_scene(path)
+    assert not scene_cache_stats['cache_hit']
+    hit = load_scene(path)
+    assert scene_cache_stats['cache_hit']
+    assert len(get_cache_files(tmp_path)) == 1
+
+    camera, ambient, lights, objects, max_depth = hit
+    compiled_scene = objects[0]
+    image = render_scene_packet(camera, ambient, lights, objects, SCREEN_SIZE, max_depth)
+    np.testing.assert_allclose(image, render_scene_packet(*missed[:4], SCREEN_SIZE, max_depth), rtol=0, atol=0)
+    # Tracing packets needs only the cached arrays and the meshes, so the other objects were never made
+    assert 'primitives' not in compiled_scene.__dict__ and len(compiled_scene.others) == 1
+
+    # The scalar engine asks for the primitives, which are made then
+    image = render_scene(camera, ambient, lights, objects, SCREEN_SIZE, max_depth)
+    np.testing.assert_allclose(image, render_scene(*missed[:4], SCREEN_SIZE, max_depth), rtol=0, atol=TOLERANCE)
+    assert len(compiled_scene.primitives) == len(missed[3][0].primitives)
+    assert compiled_scene.primitives[-1] is compiled_scene.others[0]
+
+
+@pytest.mark.parametrize('engine', ['packet', 'scalar'])
+def test_cached_scene_renders_in_worker_processes(tmp_path, engine):
+    path = write_scene(tmp_path)
+    load_scene(path)
+    camera, ambient, lights, objects, max_depth = load_scene(path)
+    reference = render_scene_packet(camera, ambient, lights, objects, SCREEN_SIZE, max_depth)
+    image = render_scene_parallel(camera, ambient, lights, objects, SCREEN_SIZE, max_depth, tile_size=8, workers=2,
+                                  engine=engine)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
+
+
+def test_cache_is_invalidated_by_a_change_of_the_scene_or_of_a_mesh(tmp_path):
+    path = write_scene(tmp_path)
+    load_scene(path)
+    load_scene(path)
+    assert scene_cache_stats['cache_hit']
+
+    description = json.loads((tmp_path / 'scene.json').read_text())
+    description['objects'][0]['material']['diffuse'] = [0, 0, 1]
+    (tmp_path / 'scene.json').write_text(json.dumps(description))
+    _, _, _, objects, _ = load_scene(path)
+    assert not scene_cache_stats['cache_hit']
+    np.testing.assert_array_equal(objects[0].materials['diffuse'][0], [0, 0, 1])
+
+    (tmp_path / 'triangle.obj').write_text(OBJ_FILE.replace('v 0 0.5 -2.5', 'v 0 0.8 -2.5'))
+    _, _, _, objects, _ = load_scene(path)
+    assert not scene_cache_stats['cache_hit']
+    assert objects[0].others[0].vertices[2, 1] == 0.8
+    assert len(get_cache_files(tmp_path)) == 3
+
+    load_scene(path)
+    assert scene_cache_stats['cache_hit']
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+import streaming_renderer
+from streaming_renderer import render_scene_to_file, stream_stats
+
+
+@pytest.mark.parametrize('extension', ['.npy', '.png'])
+def test_streamed_file_matches_render_scene(scene, reference, tmp_path, extension):
+    camera, ambient, lights, objects = scene
+    path = str(tmp_path / f'image{extension}')
+    render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, path, band_height=5)
+    if extension == '.npy':
+        np.testing.assert_allclose(np.load(path), reference, rtol=0, atol=TOLERANCE)
+    else:
+        import matplotlib.pyplot as plt
+        # PNG files keep 8 bits per channel
+        np.testing.assert_allclose(plt.imread(path)[:, :, :3], reference, rtol=0, atol=1 / 255)
+
+
+class Interrupted(Exception):
+    pass
+
+
+# This function makes render_band raise after the given number of bands, like a render that was killed
+def interrupt_after(monkeypatch, bands):
+    render_band = streaming_renderer.render_band
+    calls = []
+
+    def interrupted_render_band(*args):
+        if len(calls) == bands:
+            raise Interrupted
+        calls.append(args)
+        return render_band(*args)
+    monkeypatch.setattr(streaming_renderer, 'render_band', interrupted_render_band)
+
+
+@pytest.mark.parametrize('extension', ['.npy', '.png'])
+def test_interrupted_render_resumes_from_its_progress(scene, reference, tmp_path, monkeypatch, extension):
+    camera, ambient, lights, objects = scene
+    path = str(tmp_path / f'image{extension}')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 2)
+        with pytest.raises(Interrupted):
+            render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, path, band_height=5)
+    assert os.path.exists(path + '.progress')
+
+    render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, path, band_height=5)
+    height = SCREEN_SIZE[1]
+    assert stream_stats['resumed_rows'] == 10
+    assert stream_stats['bands'] == len(range(10, height, 5))
+    assert not os.path.exists(path + '.progress')
+    if extension == '.npy':
+        np.testing.assert_allclose(np.load(path), reference, rtol=0, atol=TOLERANCE)
+    else:
+        import matplotlib.pyplot as plt
+        np.testing.assert_allclose(plt.imread(path)[:, :, :3], reference, rtol=0, atol=1 / 255)
+
+
+def test_progress_of_another_image_is_not_resumed(scene, reference, tmp_path, monkeypatch):
+    camera, ambient, lights, objects = scene
+    path = str(tmp_path / 'image.npy')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 1)
+        with pytest.raises(Interrupted):
+            render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH + 1, path, band_height=5)
+
+    render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, path, band_height=5)
+    assert stream_stats['resumed_rows'] == 0
+    np.testing.assert_allclose(np.load(path), reference, rtol=0, atol=TOLERANCE)
+
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 1)
+        with pytest.raises(Interrupted):
+            render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, path, band_height=5)
+    render_scene_to_file(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, path, band_height=5, resume=False)
+    assert stream_stats['resumed_rows'] == 0
+    np.testing.assert_allclose(np.load(path), reference, rtol=0, atol=TOLERANCE)
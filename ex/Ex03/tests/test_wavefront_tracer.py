@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+from conftest import MAX_DEPTH, SCREEN_SIZE, TOLERANCE
+from wavefront_tracer import render_scene_wavefront
+
+
+# Without a throughput cutoff, the wavefront tracer traces every reflection render_scene traces, sorted or not
+@pytest.mark.parametrize('sort_rays', [False, True])
+def test_wavefront_engine_matches_render_scene(sort_rays, scene, reference):
+    camera, ambient, lights, objects = scene
+    image = render_scene_wavefront(camera, ambient, lights, objects, SCREEN_SIZE, MAX_DEPTH, min_throughput=0,
+                                   sort_rays=sort_rays)
+    np.testing.assert_allclose(image, reference, rtol=0, atol=TOLERANCE)
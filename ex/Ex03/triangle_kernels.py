@@ -0,0 +1,164 @@
+import time
+
+import numpy as np
+
+# Numba is optional: without it the scalar kernel runs as plain Python, which is still faster than np.linalg
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+# Möller–Trumbore intersection of a single ray with a triangle, given by its vertex a and its edges ab and ac.
+# It solves the same system as Triangle.intersect (a + u * ab + v * ac = origin + t * direction) with cross and dot
+# products of the precomputed edges, so it allocates no matrix. It returns t, or np.inf if the ray misses or
+# if t is not above min_t.
+@njit(cache=True)
+def intersect_triangle(origin, direction, a, ab, ac, min_t):
+    # p = direction x ac
+    px = direction[1] * ac[2] - direction[2] * ac[1]
+    py = direction[2] * ac[0] - direction[0] * ac[2]
+    pz = direction[0] * ac[1] - direction[1] * ac[0]
+    det = ab[0] * px + ab[1] * py + ab[2] * pz
+    if det == 0:
+        return np.inf
+    inv_det = 1.0 / det
+
+    sx = origin[0] - a[0]
+    sy = origin[1] - a[1]
+    sz = origin[2] - a[2]
+    u = (sx * px + sy * py + sz * pz) * inv_det
+    if u < 0 or u > 1:
+        return np.inf
+
+    # q = s x ab
+    qx = sy * ab[2] - sz * ab[1]
+    qy = sz * ab[0] - sx * ab[2]
+    qz = sx * ab[1] - sy * ab[0]
+    v = (direction[0] * qx + direction[1] * qy + direction[2] * qz) * inv_det
+    if v < 0 or u + v > 1:
+        return np.inf
+
+    t = (ac[0] * qx + ac[1] * qy + ac[2] * qz) * inv_det
+    if t > min_t:
+        return t
+    return np.inf
+
+
+# Slab test of a single ray against an axis aligned box. It returns whether the ray is inside the box somewhere
+# between min_t and max_t, without allocating any array.
+@njit(cache=True)
+def hits_box(origin, direction, bounds_min, bounds_max, min_t, max_t):
+    t_near = min_t
+    t_far = max_t
+    for axis in range(3):
+        if direction[axis] == 0:
+            if origin[axis] < bounds_min[axis] or origin[axis] > bounds_max[axis]:
+                return False
+            continue
+        inverse_direction = 1.0 / direction[axis]
+        t0 = (bounds_min[axis] - origin[axis]) * inverse_direction
+        t1 = (bounds_max[axis] - origin[axis]) * inverse_direction
+        if t0 > t1:
+            t0, t1 = t1, t0
+        t_near = max(t_near, t0)
+        t_far = min(t_far, t1)
+        if t_near > t_far:
+            return False
+    return True
+
+
+# Möller–Trumbore intersection of every ray with every triangle, with NumPy.
+# It returns a (number of triangles, number of rays) array of distances, with np.inf for a miss.
+def intersect_triangles_packet(a, ab, ac, origins, directions, min_t):
+    p = np.cross(directions[np.newaxis, :, :], ac[:, np.newaxis, :])
+    det = np.einsum('tj,trj->tr', ab, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0 / det
+        s = origins[np.newaxis, :, :] - a[:, np.newaxis, :]
+        u = np.einsum('trj,trj->tr', s, p) * inv_det
+        q = np.cross(s, ab[:, np.newaxis, :])
+        v = np.einsum('rj,trj->tr', directions, q) * inv_det
+        t = np.einsum('tj,trj->tr', ac, q) * inv_det
+        # u + v of a ray parallel to a triangle (det == 0) is inf - inf, which the det != 0 test rejects
+        hit = (det != 0) & (u >= 0) & (u <= 1) & (v >= 0) & (u + v <= 1) & (t > min_t)
+    t[~hit] = np.inf
+    return t
+
+
+# The intersection Triangle.intersect used before these kernels: a 3x3 np.linalg solve per ray.
+# It is kept as the reference for benchmark_triangle_kernels.
+def intersect_triangle_linalg(origin, direction, a, ab, ac, min_t):
+    A = np.column_stack((ab, ac, -direction))
+    if np.linalg.det(A) == 0:
+        return np.inf
+    try:
+        u, v, t = np.linalg.solve(A, origin - a)
+    except np.linalg.LinAlgError:
+        return np.inf
+    if 0 <= u <= 1 and 0 <= v <= 1 and (u + v) <= 1 and t > min_t:
+        return t
+    return np.inf
+
+
+# This function times the np.linalg reference, the scalar kernel and the batched kernel on the triangles of the
+# pyramids from the notebook and from your_own_scene, with rays shot from the camera towards each pyramid.
+# It returns, per pyramid, the tests per second of every kernel, the speedups over np.linalg and whether all
+# kernels found the same distances.
+def benchmark_triangle_kernels(number_of_rays=2000, seed=0):
+    from helper_classes import Pyramid, epsilon
+    from hw3 import your_own_scene
+
+    _, _, objects = your_own_scene()
+    pyramids = {
+        'diamond': Pyramid(np.array([[-0.5, -0.142, -0.998], [-0.034, 0.092, -0.145], [0.484, 0.031, -0.998],
+                                     [-0.104, 0.851, -0.828], [0.23, -0.833, -0.591]])),
+        'spacecraft': [obj for obj in objects if isinstance(obj, Pyramid)][0],
+    }
+    camera = np.array([0.0, 0.0, 1.0])
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    for name, pyramid in pyramids.items():
+        vertices = np.array([[t.a, t.b, t.c] for t in pyramid.triangle_list], dtype=float)
+        a, ab, ac = vertices[:, 0], vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0]
+        low, high = vertices.reshape(-1, 3).min(axis=0), vertices.reshape(-1, 3).max(axis=0)
+        targets = rng.uniform(low, high, (number_of_rays, 3))
+        directions = targets - camera
+        directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        origins = np.broadcast_to(camera, directions.shape).copy()
+
+        # Compile the scalar kernel before timing it
+        intersect_triangle(origins[0], directions[0], a[0], ab[0], ac[0], epsilon)
+
+        timings = {}
+        distances = {}
+        for kernel_name, kernel in (('linalg', intersect_triangle_linalg), ('scalar', intersect_triangle)):
+            start = time.perf_counter()
+            distances[kernel_name] = np.array([[kernel(origin, direction, a[i], ab[i], ac[i], epsilon)
+                                                for origin, direction in zip(origins, directions)]
+                                               for i in range(len(a))])
+            timings[kernel_name] = time.perf_counter() - start
+        start = time.perf_counter()
+        distances['batched'] = intersect_triangles_packet(a, ab, ac, origins, directions, epsilon)
+        timings['batched'] = time.perf_counter() - start
+
+        tests = len(a) * number_of_rays
+        results[name] = {
+            'tests': tests,
+            'tests_per_second': {kernel_name: tests / timing for kernel_name, timing in timings.items()},
+            'speedup': {kernel_name: timings['linalg'] / timing for kernel_name, timing in timings.items()},
+            'agree': all(np.allclose(distances['linalg'], d) for d in distances.values()),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for pyramid_name, result in benchmark_triangle_kernels().items():
+        print(f"{pyramid_name}: {result['tests']} ray-triangle tests, kernels agree: {result['agree']}")
+        for kernel_name in result['speedup']:
+            print(f"    {kernel_name:8} {result['tests_per_second'][kernel_name]:14,.0f} tests/s "
+                  f"{result['speedup'][kernel_name]:8.1f}x")
@@ -0,0 +1,162 @@
+import time
+
+import numpy as np
+
+from helper_classes import *
+from compiled_scene import compile_scene
+from mesh import reset_traversal_stats, traversal_stats
+from packet_tracer import PACKET_SIZE, get_primary_directions, trace_packet
+
+# Secondary rays whose accumulated reflection weight falls below this threshold are not traced
+MIN_THROUGHPUT = 0.01
+
+# Sorted rays are ordered by the Morton code of their origin on a grid of 2 ** MORTON_BITS cells per axis
+MORTON_BITS = 10
+
+# For every bounce of the last render: the number of rays traced, and the number of secondary rays dropped
+# because their throughput fell below the threshold. Also the seconds spent sorting the secondary rays.
+wavefront_stats = {'traced': [], 'dropped': [], 'sort_seconds': 0.0}
+
+
+# This function spreads the lowest MORTON_BITS (10) bits of every value apart, with two zero bits between each two
+def spread_bits(values):
+    values = values & 0x3ff
+    values = (values | (values << 16)) & 0x030000ff
+    values = (values | (values << 8)) & 0x0300f00f
+    values = (values | (values << 4)) & 0x030c30c3
+    return (values | (values << 2)) & 0x09249249
+
+
+# This function returns the Morton code of every point: the index of its cell, in a grid of 2 ** MORTON_BITS cells
+# per axis over the bounds of the points, along a Z-order curve, so points in nearby cells get nearby codes
+def get_morton_codes(points):
+    low = points.min(axis=0)
+    scale = (2 ** MORTON_BITS - 1) / np.maximum(points.max(axis=0) - low, epsilon)
+    cells = ((points - low) * scale).astype(np.uint64)
+    return (spread_bits(cells[:, 0]) << 2) | (spread_bits(cells[:, 1]) << 1) | spread_bits(cells[:, 2])
+
+
+# This function returns the order that groups rays that travel alike: first by the octant of their direction (the
+# signs of its coordinates), then by the Morton code of their origin. Packets of sorted rays go down the same
+# branches of a hierarchy, so every node a packet visits is tested by more of its rays, and the rays a node
+# gathers lie close together in memory.
+def get_coherence_order(origins, directions):
+    if not len(origins):
+        return np.zeros(0, dtype=int)
+    octants = ((directions[:, 0] < 0) * 4 + (directions[:, 1] < 0) * 2 + (directions[:, 2] < 0)).astype(np.uint64)
+    keys = (octants << 3 * MORTON_BITS) | get_morton_codes(origins)
+    return np.argsort(keys, kind='stable')
+
+
+# A queue of rays waiting to be traced at the same bounce, stored as arrays.
+# throughput is the product of the reflection coefficients along each ray's path, and pixels is the index of the
+# pixel each ray adds its color to.
+class Wavefront:
+    def __init__(self, origins, directions, throughput, pixels):
+        self.origins = origins
+        self.directions = directions
+        self.throughput = throughput
+        self.pixels = pixels
+
+    def __len__(self):
+        return len(self.pixels)
+
+    # This function returns the rays [start, end) of the wavefront as a smaller wavefront
+    def slice(self, start, end):
+        return Wavefront(self.origins[start:end], self.directions[start:end], self.throughput[start:end],
+                         self.pixels[start:end])
+
+    # This function returns the rays of the wavefront selected by mask
+    def select(self, mask):
+        return Wavefront(self.origins[mask], self.directions[mask], self.throughput[mask], self.pixels[mask])
+
+    # This function joins wavefronts into one
+    @staticmethod
+    def concatenate(wavefronts):
+        return Wavefront(np.concatenate([w.origins for w in wavefronts]).reshape(-1, 3),
+                         np.concatenate([w.directions for w in wavefronts]).reshape(-1, 3),
+                         np.concatenate([w.throughput for w in wavefronts]),
+                         np.concatenate([w.pixels for w in wavefronts]).astype(int))
+
+
+# This function traces a packet of the wavefront, adds the shaded colors of its hits to the image, and returns the
+# reflected rays of those hits (with their new throughput) as the packet's part of the next wavefront
+def trace_wavefront_packet(scene, compiled_scene, wavefront, image):
+    hit, ids, points, normals, local_colors = trace_packet(scene, compiled_scene, wavefront.origins,
+                                                           wavefront.directions)
+    throughput = wavefront.throughput[hit]
+    pixels = wavefront.pixels[hit]
+    np.add.at(image, pixels, throughput[:, np.newaxis] * local_colors)
+
+    reflected_directions = reflected_rows(wavefront.directions[hit], normals)
+    next_throughput = throughput * compiled_scene.materials['reflection'][ids]
+    return Wavefront(points, reflected_directions, next_throughput, pixels)
+
+
+# This function renders the scene like render_scene_packet, but handles reflections as a wavefront: all the
+# secondary rays of the image that are still active at a bounce are queued, and traced together in packets of up to
+# packet_size rays. Rays whose throughput falls below min_throughput are dropped from the queue, since what they
+# could add to their pixel is invisible; with min_throughput=0 the image matches render_scene.
+# This makes large max_depth values cheap: the queue empties as soon as no ray is worth tracing any more.
+# If sort_rays is True, the secondary rays of every bounce are sorted by get_coherence_order before they are split
+# into packets, so every packet (and the shadow rays of its hits) is coherent. The pixel of every ray travels with
+# it, so the colors still land on the right pixels.
+def render_scene_wavefront(camera, ambient, lights, objects, screen_size, max_depth, min_throughput=MIN_THROUGHPUT,
+                           packet_size=PACKET_SIZE, sort_rays=False):
+    width, height = screen_size
+    scene = {"objects": objects, "ambient": ambient, "lights": lights}
+    compiled_scene = compile_scene(objects)
+    wavefront_stats.update({'traced': [], 'dropped': [], 'sort_seconds': 0.0})
+
+    directions = get_primary_directions(camera, screen_size)
+    origins = np.broadcast_to(np.asarray(camera, dtype=float), directions.shape)
+    wavefront = Wavefront(origins, directions, np.ones(len(directions)), np.arange(len(directions)))
+    image = np.zeros((height * width, 3))
+    depth = 1
+
+    while len(wavefront):
+        next_wavefronts = [trace_wavefront_packet(scene, compiled_scene, wavefront.slice(start, start + packet_size),
+                                                  image)
+                           for start in range(0, len(wavefront), packet_size)]
+        wavefront_stats['traced'].append(len(wavefront))
+        if depth + 1 > max_depth:
+            break
+
+        wavefront = Wavefront.concatenate(next_wavefronts)
+        active = wavefront.throughput >= min_throughput
+        wavefront_stats['dropped'].append(int(np.count_nonzero(~active)))
+        wavefront = wavefront.select(active)
+        if sort_rays:
+            start_time = time.perf_counter()
+            wavefront = wavefront.select(get_coherence_order(wavefront.origins, wavefront.directions))
+            wavefront_stats['sort_seconds'] += time.perf_counter() - start_time
+        depth += 1
+
+    # We clip the values between 0 and 1 so all pixel values will make sense.
+    return np.clip(image, 0, 1).reshape(height, width, 3)
+
+
+# This function renders the scene with render_scene_wavefront twice, without and with sorting the secondary rays,
+# and returns for each the best time of repeat renders, the rays per second, and the traversal steps, ray-box tests
+# and ray-face tests per ray of the mesh hierarchies (see mesh.traversal_stats). The packets are smaller than
+# PACKET_SIZE, since sorting only helps when the secondary rays of a bounce are split into many packets.
+def compare_ray_sorting(camera, ambient, lights, objects, screen_size, max_depth, packet_size=4096, repeat=1):
+    results = {}
+    for sort_rays in (False, True):
+        seconds = np.inf
+        for _ in range(repeat):
+            reset_traversal_stats()
+            start_time = time.perf_counter()
+            render_scene_wavefront(camera, ambient, lights, objects, screen_size, max_depth, 0, packet_size,
+                                   sort_rays)
+            seconds = min(seconds, time.perf_counter() - start_time)
+        rays = max(1, traversal_stats['rays'])
+        results['sorted' if sort_rays else 'unsorted'] = {
+            'seconds': seconds,
+            'rays_per_second': sum(wavefront_stats['traced']) / seconds,
+            'sort_seconds': wavefront_stats['sort_seconds'],
+            'steps_per_ray': traversal_stats['steps'] / rays,
+            'box_tests_per_ray': traversal_stats['box_tests'] / rays,
+            'face_tests_per_ray': traversal_stats['face_tests'] / rays,
+        }
+    return results